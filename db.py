@@ -4,10 +4,14 @@ from dotenv import load_dotenv
 
 load_dotenv()
 
+def connect():
+    return pymysql.connect(db=os.getenv('DB_NAME'),
+                           host=os.getenv('DB_HOST'),
+                           port=int(os.getenv('DB_PORT')),
+                           user=os.getenv('DB_USER'),
+                           password=os.getenv('DB_PASS'),
+                           local_infile=True, # allows DBUtils.bulk_load_data_values to use LOAD DATA LOCAL INFILE
+                           autocommit=False) # requires .commit(), so everything is implicitly a transaction
+
 # Connect to the database
-connection = pymysql.connect(db=os.getenv('DB_NAME'),
-                             host=os.getenv('DB_HOST'),
-                             port=int(os.getenv('DB_PORT')),
-                             user=os.getenv('DB_USER'),
-                             password=os.getenv('DB_PASS'),
-                             autocommit=False) # requires .commit(), so everything is implicitly a transaction
+connection = connect()
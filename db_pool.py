@@ -0,0 +1,45 @@
+import queue
+import threading
+from contextlib import contextmanager
+
+from db import connect
+
+# Hands out up to `size` database connections, which are opened the first time
+# they are needed and reused afterwards. A connection must only be used by one
+# thread at a time, so acquire() blocks while all of them are in use.
+class ConnectionPool:
+
+    def __init__(self, size, connect=connect):
+        self.size = size
+        self.__connect = connect
+        self.__idle = queue.LifoQueue()
+        self.__opened = []
+        self.__lock = threading.Lock()
+
+    def acquire(self):
+        with self.__lock:
+            if self.__idle.empty() and len(self.__opened) < self.size:
+                connection = self.__connect()
+                self.__opened.append(connection)
+                return connection
+        return self.__idle.get()
+
+    # The connection is handed back as is, committing or rolling back its
+    # transaction is up to whoever acquired it
+    def release(self, connection):
+        self.__idle.put(connection)
+
+    @contextmanager
+    def connection(self):
+        connection = self.acquire()
+        try:
+            yield connection
+        finally:
+            self.release(connection)
+
+    def close(self):
+        with self.__lock:
+            for connection in self.__opened:
+                connection.close()
+            self.__opened = []
+            self.__idle = queue.LifoQueue()
@@ -0,0 +1,196 @@
+import os
+import re
+import json
+import shutil
+import hashlib
+import logging
+import requests
+
+logger = logging.getLogger('importer')
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'data', 'download_cache')
+CHUNK_SIZE = 2**16  # at most this much is lost when a download is interrupted
+
+class DownloadError(Exception):
+    pass
+
+# What DownloadCache.fetch() got: the path of the downloaded content, its md5
+# hash (the same as file_checksum() gives), whether it changed since the URL
+# was last fetched, and the file name the server gave it, if any
+class Download:
+
+    def __init__(self, url, path, hash, changed, filename=None):
+        self.url = url
+        self.path = path
+        self.hash = hash
+        self.changed = changed
+        self.filename = filename
+
+    # Whether the content is the one that was imported with this file_hash,
+    # so that an import can stop before parsing anything
+    def unchanged_since(self, file_hash):
+        return file_hash is not None and file_hash == self.hash
+
+    # Puts the content at `path`, as a hard link when possible
+    def link_to(self, path):
+        if os.path.exists(path) and os.path.samefile(self.path, path):
+            return
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        try:
+            os.link(self.path, path + '.tmp')
+        except OSError:
+            shutil.copyfile(self.path, path + '.tmp')
+        os.replace(path + '.tmp', path)
+
+# Downloads shared by the importers. The content of every URL is kept under
+# the hash of its content (blobs/<md5>), and an index remembers the hash, ETag
+# and Last-Modified of every URL, so that:
+#   - a URL is fetched again with If-None-Match and If-Modified-Since, and the
+#     cached content is used when the server answers 304 Not Modified
+#   - a download that was interrupted is resumed with a Range request (with
+#     If-Range, so that it starts over if the file changed in the meantime)
+#   - the importers can tell that the content is the same as the one they
+#     imported last time before parsing it, see Download.unchanged_since()
+# The content can also be linked to the fixed path an importer reads it from.
+class DownloadCache:
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, session=None, timeout=60):
+        self.cache_dir = cache_dir
+        self.blobs_dir = os.path.join(cache_dir, 'blobs')
+        self.partial_dir = os.path.join(cache_dir, 'partial')
+        self.index_path = os.path.join(cache_dir, 'index.json')
+        self.session = session if session is not None else requests.Session()
+        self.timeout = timeout
+        os.makedirs(self.blobs_dir, exist_ok=True)
+        os.makedirs(self.partial_dir, exist_ok=True)
+
+    def blob_path(self, hash):
+        return os.path.join(self.blobs_dir, hash)
+
+    def fetch(self, url, path=None, headers=None):
+        index = self.__read_index()
+        entry = index.get(url)
+        if entry is not None and not os.path.exists(self.blob_path(entry['hash'])):
+            entry = None
+
+        partial_path = os.path.join(self.partial_dir, hashlib.sha1(url.encode('utf8')).hexdigest())
+        partial_validators_path = partial_path + '.json'
+        partial_validators = read_json(partial_validators_path)
+
+        # Ranges and Content-Length refer to the bytes as they are stored
+        request_headers = {'Accept-Encoding': 'identity', **(headers or {})}
+        offset = 0
+        if os.path.exists(partial_path) and partial_validators and (partial_validators['etag'] or partial_validators['last_modified']):
+            offset = os.path.getsize(partial_path)
+            request_headers['Range'] = 'bytes=%d-' % offset
+            request_headers['If-Range'] = partial_validators['etag'] or partial_validators['last_modified']
+        elif entry is not None:
+            if entry['etag']:
+                request_headers['If-None-Match'] = entry['etag']
+            if entry['last_modified']:
+                request_headers['If-Modified-Since'] = entry['last_modified']
+
+        try:
+            with self.session.get(url, headers=request_headers, stream=True, timeout=self.timeout) as response:
+
+                if response.status_code == 416 and offset:
+                    # The partial download is no use, start over
+                    os.remove(partial_path)
+                    return self.fetch(url, path, headers)
+
+                if response.status_code == 304 and entry is not None:
+                    logger.info('Not modified since it was last downloaded: %s' % url)
+                    download = Download(url, self.blob_path(entry['hash']), entry['hash'], changed=False, filename=entry['filename'])
+
+                elif response.status_code in (200, 206):
+                    if response.status_code == 206 and content_range_start(response) != offset:
+                        os.remove(partial_path)
+                        raise DownloadError('%s: the server resumed from the wrong offset, fetch it again to start over' % url)
+                    if response.status_code == 200:
+                        offset = 0
+                        write_json(partial_validators_path, {
+                            'etag': response.headers.get('ETag'),
+                            'last_modified': response.headers.get('Last-Modified'),
+                            'filename': content_disposition_filename(response)
+                        })
+                    else:
+                        logger.info('Resuming the download at byte %d: %s' % (offset, url))
+
+                    hash = hashlib.md5()
+                    if offset:
+                        with open(partial_path, 'rb') as f:
+                            for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+                                hash.update(chunk)
+                    with open(partial_path, 'ab' if offset else 'wb') as f:
+                        for chunk in response.iter_content(CHUNK_SIZE):
+                            f.write(chunk)
+                            hash.update(chunk)
+
+                    size = os.path.getsize(partial_path)
+                    if 'Content-Length' in response.headers and size != offset + int(response.headers['Content-Length']):
+                        raise DownloadError('%s: the download stopped at byte %d, fetch it again to resume it' % (url, size))
+
+                    validators = read_json(partial_validators_path) or {'etag': None, 'last_modified': None, 'filename': None}
+                    download = Download(url, self.blob_path(hash.hexdigest()), hash.hexdigest(),
+                                        changed=entry is None or entry['hash'] != hash.hexdigest(),
+                                        filename=validators['filename'])
+                    os.replace(partial_path, download.path)
+                    os.remove(partial_validators_path)
+
+                    index[url] = {
+                        'hash': download.hash,
+                        'size': size,
+                        'etag': validators['etag'],
+                        'last_modified': validators['last_modified'],
+                        'filename': validators['filename']
+                    }
+                    self.__write_index(index)
+                    if entry is not None and download.changed:
+                        self.__remove_unused_blob(entry['hash'], index)
+
+                else:
+                    raise DownloadError('%s: HTTP %d' % (url, response.status_code))
+
+        except requests.RequestException as error:
+            # What was received so far is kept, to be resumed next time
+            raise DownloadError('%s: %s' % (url, error)) from error
+
+        if path is not None:
+            download.link_to(path)
+        return download
+
+    def __read_index(self):
+        return read_json(self.index_path) or {}
+
+    def __write_index(self, index):
+        write_json(self.index_path, index)
+
+    def __remove_unused_blob(self, hash, index):
+        if not any(entry['hash'] == hash for entry in index.values()):
+            os.remove(self.blob_path(hash))
+
+# e.g. 'attachment; filename="GDP.xlsx"'
+def content_disposition_filename(response):
+    match = re.search(r'filename=(.+)', response.headers.get('Content-Disposition', ''))
+    return match.group(1).replace('"', '') if match else None
+
+def content_range_start(response):
+    # e.g. 'bytes 100-199/200'
+    try:
+        return int(response.headers['Content-Range'].split()[1].split('-')[0])
+    except (KeyError, IndexError, ValueError):
+        return None
+
+def read_json(path):
+    try:
+        with open(path, 'r', encoding='utf8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+# Written to a temporary file first, so that an interrupted write never leaves
+# a truncated file behind
+def write_json(path, value):
+    with open(path + '.tmp', 'w', encoding='utf8') as f:
+        json.dump(value, f)
+    os.replace(path + '.tmp', path)
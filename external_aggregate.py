@@ -0,0 +1,165 @@
+import os
+import heapq
+import pickle
+import itertools
+import tempfile
+from operator import itemgetter
+
+# Sums values by key over more keys than fit in memory. The sums are kept in a
+# dict until it holds as many keys as the memory budget allows, then they are
+# sorted and spilled to an anonymous temporary file as a run, and the dict
+# starts over. At the end the runs and what is left in memory are merged by
+# key, and the sums of the same key in different runs are added up.
+#
+#   with ExternalSum(memory_budget=256 * 2**20) as sums:
+#       for row in rows:
+#           sums.add((variable, country, year), value)
+#       for (variable, country, year), value in sums.sorted_sums():
+#           ...
+#
+# The keys have to be picklable and comparable with each other.
+
+DEFAULT_MEMORY_BUDGET = 256 * 2**20  # bytes
+
+# A rough size of a key of a few short strings and ints, its sum, and its
+# slot in the dict
+BYTES_PER_ENTRY = 250
+
+SPILL_BATCH_SIZE = 10000  # entries pickled at once
+
+class ExternalSum:
+
+    def __init__(self, memory_budget=DEFAULT_MEMORY_BUDGET):
+        self.max_entries = max(1, memory_budget // BYTES_PER_ENTRY)
+        self.sums = {}
+        self.runs = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def add(self, key, value):
+        sums = self.sums
+        if key in sums:
+            sums[key] += value
+        else:
+            sums[key] = value
+            if len(sums) >= self.max_entries:
+                self.spill()
+
+    def spill(self):
+        entries = sorted(self.sums.items(), key=itemgetter(0))
+        self.sums = {}
+        run = tempfile.TemporaryFile()
+        for start in range(0, len(entries), SPILL_BATCH_SIZE):
+            pickle.dump(entries[start:start + SPILL_BATCH_SIZE], run, pickle.HIGHEST_PROTOCOL)
+        run.seek(0)
+        self.runs.append(run)
+
+    # The (key, sum) of every key, sorted by key. The values of a key are
+    # added up in the order they were added.
+    def sorted_sums(self):
+        entries = sorted(self.sums.items(), key=itemgetter(0))
+        self.sums = {}
+        merged = heapq.merge(*[read_run(run) for run in self.runs], entries, key=itemgetter(0))
+        for key, group in itertools.groupby(merged, key=itemgetter(0)):
+            _, total = next(group)
+            for _, value in group:
+                total += value
+            yield key, total
+        self.close()
+
+    def close(self):
+        for run in self.runs:
+            run.close()
+        self.runs = []
+
+def read_run(run):
+    while True:
+        try:
+            entries = pickle.load(run)
+        except EOFError:
+            return
+        yield from entries
+
+# Rows pickled to a named temporary file, so that a worker process can hand
+# any number of them to its parent through the file system, rather than as a
+# list through a pipe. It can be pickled itself, and the rows can be read any
+# number of times, until close() removes the file.
+class SpilledRows:
+
+    def __init__(self, rows, dir=None):
+        rows = iter(rows)
+        with tempfile.NamedTemporaryFile(dir=dir, suffix='.pickle', delete=False) as run:
+            self.path = run.name
+            for batch in iter(lambda: list(itertools.islice(rows, SPILL_BATCH_SIZE)), []):
+                pickle.dump(batch, run, pickle.HIGHEST_PROTOCOL)
+
+    def __iter__(self):
+        with open(self.path, 'rb') as run:
+            yield from read_run(run)
+
+    def close(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+# Rows spilled to an anonymous temporary file per partition, e.g. per batch of
+# variables, so that the rows of one partition can be read back on their own
+# without holding those of the others in memory. A partition keeps up to
+# SPILL_BATCH_SIZE rows in memory before they are pickled to its file, and
+# its rows are read back in the order they were added.
+#
+#   with SpilledPartitions() as partitions:
+#       for row in rows:
+#           partitions.add(batch_index_by_variable[row[3]], row)
+#       for batch_index in partitions.partitions():
+#           for row in partitions.read(batch_index):
+#               ...
+class SpilledPartitions:
+
+    def __init__(self):
+        self.pending = {}
+        self.runs = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def add(self, partition, row):
+        pending = self.pending.get(partition)
+        if pending is None:
+            pending = self.pending[partition] = []
+        pending.append(row)
+        if len(pending) >= SPILL_BATCH_SIZE:
+            self.spill(partition)
+
+    def spill(self, partition):
+        run = self.runs.get(partition)
+        if run is None:
+            run = self.runs[partition] = tempfile.TemporaryFile()
+        run.seek(0, os.SEEK_END)
+        pickle.dump(self.pending[partition], run, pickle.HIGHEST_PROTOCOL)
+        self.pending[partition] = []
+
+    # The partitions that rows were added to, in the order of their first row
+    def partitions(self):
+        return list(self.pending)
+
+    def read(self, partition):
+        if self.pending.get(partition):
+            self.spill(partition)
+        run = self.runs.get(partition)
+        if run is None:
+            return
+        run.seek(0)
+        yield from read_run(run)
+
+    def close(self):
+        for run in self.runs.values():
+            run.close()
+        self.pending = {}
+        self.runs = {}
@@ -0,0 +1,121 @@
+import os
+import time
+import atexit
+import logging
+import subprocess
+
+logger = logging.getLogger('importer')
+
+# Paces an import, in place of sleeping for a fixed time every N rows.
+# It is unthrottled by default, so that imports run at full speed in a batch
+# window. When the database or the machine needs protecting, it can:
+#   - limit the rows processed per second, see tick()
+#   - limit the data_values written per second, see wrote()
+#   - lower the CPU priority (niceness) and IO priority (ionice class) of the
+#     process, which also applies to the processes it forks
+# Every limit defaults to an environment variable, so that the importers
+# can be throttled without changing them:
+#   IMPORT_MAX_ROWS_PER_SECOND, IMPORT_MAX_WRITES_PER_SECOND,
+#   IMPORT_NICENESS, IMPORT_IONICE_CLASS (1 realtime, 2 best-effort, 3 idle)
+class Governor:
+
+    def __init__(self, max_rows_per_second=None, max_writes_per_second=None, niceness=None, ionice_class=None, report_at_exit=True):
+        self.max_rows_per_second = max_rows_per_second
+        self.max_writes_per_second = max_writes_per_second
+        self.niceness = niceness
+        self.ionice_class = ionice_class
+        self.start_time = time.time()
+        self.seconds_throttled = 0.0
+        self.rows = 0
+        self.writes = 0
+        self.__rows_pacer = Pacer(max_rows_per_second)
+        self.__writes_pacer = Pacer(max_writes_per_second)
+
+        if niceness is not None:
+            # lowering the niceness needs privileges, but the import can go on without it
+            try:
+                os.nice(niceness - os.nice(0))
+            except OSError as error:
+                logger.warning('Could not set the CPU priority: %s' % error)
+        if ionice_class is not None:
+            try:
+                subprocess.check_call(['ionice', '-c', str(ionice_class), '-p', str(os.getpid())])
+            except (OSError, subprocess.CalledProcessError) as error:
+                logger.warning('Could not set the IO priority: %s' % error)
+
+        if report_at_exit and self.is_throttled():
+            atexit.register(self.log_report)
+
+    @classmethod
+    def from_env(cls, max_rows_per_second=None, max_writes_per_second=None, niceness=None, ionice_class=None, **kwargs):
+        def env(value, name, type):
+            if value is not None:
+                return value
+            if os.getenv(name):
+                return type(os.getenv(name))
+            return None
+        return cls(
+            max_rows_per_second=env(max_rows_per_second, 'IMPORT_MAX_ROWS_PER_SECOND', float),
+            max_writes_per_second=env(max_writes_per_second, 'IMPORT_MAX_WRITES_PER_SECOND', float),
+            niceness=env(niceness, 'IMPORT_NICENESS', int),
+            ionice_class=env(ionice_class, 'IMPORT_IONICE_CLASS', int),
+            **kwargs
+        )
+
+    def is_throttled(self):
+        return any(limit is not None for limit in (
+            self.max_rows_per_second, self.max_writes_per_second, self.niceness, self.ionice_class
+        ))
+
+    # Call for every row processed
+    def tick(self, rows=1):
+        self.rows += rows
+        self.seconds_throttled += self.__rows_pacer.advance(rows)
+
+    # Call with the number of data_values after writing them
+    def wrote(self, rows):
+        self.writes += rows
+        self.seconds_throttled += self.__writes_pacer.advance(rows)
+
+    def report(self):
+        return {
+            'rows': self.rows,
+            'writes': self.writes,
+            'seconds': round(time.time() - self.start_time, 3),
+            'seconds_throttled': round(self.seconds_throttled, 3),
+            'max_rows_per_second': self.max_rows_per_second,
+            'max_writes_per_second': self.max_writes_per_second,
+            'niceness': self.niceness,
+            'ionice_class': self.ionice_class
+        }
+
+    def log_report(self):
+        message = 'Throttled for {seconds_throttled}s of {seconds}s ({rows} rows, {writes} writes)'.format(**self.report())
+        print(message)
+        logger.info(message)
+
+# Sleeps whenever the count gets ahead of `max_per_second` since the start.
+# The clock is only checked about 20 times per second's worth of counts, so
+# pacing a fast loop costs little more than an addition.
+class Pacer:
+
+    def __init__(self, max_per_second):
+        self.max_per_second = max_per_second
+        self.count = 0
+        self.next_check = 0
+        self.start_time = None
+
+    def advance(self, count):
+        if self.max_per_second is None:
+            return 0.0
+        if self.start_time is None:
+            self.start_time = time.time()
+        self.count += count
+        if self.count < self.next_check:
+            return 0.0
+        self.next_check = self.count + max(self.max_per_second / 20, 1)
+        ahead = self.start_time + self.count / self.max_per_second - time.time()
+        if ahead <= 0:
+            return 0.0
+        time.sleep(ahead)
+        return ahead
@@ -135,6 +135,8 @@ DATABASES = {
         'OPTIONS': {
             'sql_mode': 'traditional',
             'charset': 'utf8',
+            # for the LOAD DATA LOCAL INFILE of the importers' data_values
+            'local_infile': True,
             'init_command': 'SET '
                 'default_storage_engine=INNODB,'
                 'character_set_connection=utf8,'
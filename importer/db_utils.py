@@ -1,17 +1,143 @@
 import json
+import functools
+import math
+import re
 import time
+import queue
+import tempfile
+import threading
+import uuid
 import unidecode
+import pymysql.cursors
+from contextlib import contextmanager
+from pymysql.err import MySQLError
 
 UNMODIFIED = 0
 INSERT = 1
 UPDATE = 2
 
+# MySQL error codes for a server or client that does not allow LOAD DATA LOCAL
+LOCAL_INFILE_DISABLED_ERRORS = (1148, 2068, 3948)
+
+# MySQL error codes for a deadlock and a lock wait timeout, after which the
+# statement can be retried
+LOCK_ERRORS = (1205, 1213)
+
 def normalise_country_name(country_name):
     return unidecode.unidecode(country_name.lower())
 
+def tsv_field(value):
+    if value is None:
+        return '\\N'
+    if isinstance(value, float):
+        value = repr(value)
+    return str(value).replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n')
+
+def parse_tsv_field(field):
+    if field == '\\N':
+        return None
+    return re.sub(r'\\(.)', lambda match: {'n': '\n', 't': '\t'}.get(match.group(1), match.group(1)), field)
+
+def data_values_equal(old_value, new_value):
+    # data_values.value is a VARCHAR, so the stored value is a string while the
+    # incoming one may be a number
+    try:
+        return float(old_value) == float(new_value)
+    except (TypeError, ValueError):
+        return str(old_value) == str(new_value)
+
 class NotOne(ValueError):
     pass
 
+class BulkLoadCheckFailed(ValueError):
+    pass
+
+class DuplicateDataValues(ValueError):
+    pass
+
+# Collapses the whitespace of a query, and the repeated value lists of a
+# multi-row INSERT, so that every run of a statement has the same template
+def statement_template(query):
+    template = ' '.join(query.split())
+    return re.sub(r'(\([^()]*\))(\s*,\s*\1)+', r'\1, ...', template)
+
+# Wraps a cursor to record, per DBUtils method and statement template, how
+# many times it ran, how long it took and how many rows it affected. The
+# method is the owner's statement_label, see labelled().
+# Latencies are kept in a histogram with ~12% wide buckets, which is precise
+# enough for the p95 and doesn't grow with the number of statements.
+class InstrumentedCursor:
+
+    BUCKETS_PER_DECADE = 20
+
+    def __init__(self, cursor, owner):
+        self.__cursor = cursor
+        self.__owner = owner
+        self.stats = {}
+
+    def __getattr__(self, name):
+        return getattr(self.__cursor, name)
+
+    def execute(self, query, *args, **kwargs):
+        return self.__timed(query, self.__cursor.execute, query, *args, **kwargs)
+
+    def executemany(self, query, *args, **kwargs):
+        return self.__timed(query, self.__cursor.executemany, query, *args, **kwargs)
+
+    def __timed(self, query, method, *args, **kwargs):
+        start_time = time.perf_counter()
+        try:
+            return method(*args, **kwargs)
+        finally:
+            seconds = time.perf_counter() - start_time
+            key = (self.__owner.statement_label, statement_template(query))
+            if key not in self.stats:
+                self.stats[key] = {'calls': 0, 'seconds': 0.0, 'rows': 0, 'histogram': {}}
+            stats = self.stats[key]
+            stats['calls'] += 1
+            stats['seconds'] += seconds
+            stats['rows'] += max(self.__cursor.rowcount, 0)
+            bucket = math.floor(math.log10(max(seconds, 1e-6)) * self.BUCKETS_PER_DECADE)
+            stats['histogram'][bucket] = stats['histogram'].get(bucket, 0) + 1
+
+    def __p95(self, histogram, calls):
+        remaining = math.ceil(calls * 0.95)
+        for bucket in sorted(histogram):
+            remaining -= histogram[bucket]
+            if remaining <= 0:
+                return 10 ** ((bucket + 1) / self.BUCKETS_PER_DECADE)
+
+    # The statements that took the most time in total, slowest first
+    def summary(self, limit=20):
+        total_seconds = sum(stats['seconds'] for stats in self.stats.values()) or 1.0
+        return [
+            {
+                'method': method,
+                'statement': template[:200],
+                'calls': stats['calls'],
+                'total_seconds': round(stats['seconds'], 3),
+                'share': round(stats['seconds'] / total_seconds, 3),
+                'p95_seconds': round(self.__p95(stats['histogram'], stats['calls']), 6),
+                'rows': stats['rows']
+            }
+            for (method, template), stats in sorted(self.stats.items(), key=lambda item: -item[1]['seconds'])[:limit]
+        ]
+
+# Labels the statements a DBUtils method runs with its name in the statement
+# stats. Only the outermost labelled method counts, e.g. touch_variable rather
+# than the upsert_one it calls.
+def labelled(method):
+    @functools.wraps(method)
+    def labelled_method(self, *args, **kwargs):
+        if self.statement_label is not None:
+            return method(self, *args, **kwargs)
+        self.statement_label = method.__name__
+        try:
+            return method(self, *args, **kwargs)
+        finally:
+            self.statement_label = None
+    return labelled_method
+
 class DBUtils:
 
     # TODO create bulk inserts for every create? what type should they return?
@@ -30,10 +156,49 @@ class DBUtils:
             'sources_updated': 0
         }
         self.entity_id_by_normalised_name = {}
+        # Set to False once the server refuses LOAD DATA LOCAL INFILE
+        self.local_infile = True
+        # Filled by prefetch_namespace
+        self.prefetched_namespace = None
+        self.tag_id_by_key = {}
+        self.dataset_tag_pairs = set()
+        self.dataset_id_by_key = {}
+        self.source_id_by_key = {}
+        self.variable_id_by_key = {}
+        self.variable_id_by_code = {}
+        # Metadata of cached rows, written by apply_metadata_refreshes
+        self.tag_ids_to_refresh = set()
+        self.datasets_to_refresh = {}
+        self.sources_to_refresh = {}
+        # Set while in bulk_load_mode
+        self.bulk_load_settings = None
+        self.bulk_load_variable_ids = None
+        self.bulk_load_report = None
+        # The method running the current statement, see labelled()
+        self.statement_label = None
 
     def get_counts(self):
         return self.counts
 
+    # Starts recording the time and rows of every statement, see
+    # InstrumentedCursor. The summary is added to the import_state of
+    # note_import.
+    def enable_instrumentation(self):
+        if not isinstance(self.cursor, InstrumentedCursor):
+            self.cursor = InstrumentedCursor(self.cursor, self)
+
+    def get_statement_stats(self, limit=20):
+        if isinstance(self.cursor, InstrumentedCursor):
+            return self.cursor.summary(limit)
+        return None
+
+    def format_statement_stats(self, limit=20):
+        return '\n'.join(
+            '{total_seconds:9.2f}s {share:6.1%} {calls:8d} calls p95 {p95_seconds:.4f}s {rows:10d} rows  {method}: {statement}'.format(**stats)
+            for stats in self.get_statement_stats(limit) or []
+        )
+
+    @labelled
     def fetch_one_or_none(self, *args, **kwargs):
         self.cursor.execute(*args, **kwargs)
         rows = self.cursor.fetchall()
@@ -44,6 +209,7 @@ class DBUtils:
         else:
             return None
 
+    @labelled
     def fetch_one(self, *args, **kwargs):
         result = self.fetch_one_or_none(*args, **kwargs)
         if result is None:
@@ -51,10 +217,12 @@ class DBUtils:
         else:
             return result
 
+    @labelled
     def fetch_many(self, *args, **kwargs):
         self.cursor.execute(*args, **kwargs)
         return self.cursor.fetchall()
 
+    @labelled
     def upsert_one(self, *args, **kwargs):
         self.cursor.execute(*args, **kwargs)
         if self.cursor.rowcount == 0: return UNMODIFIED
@@ -62,9 +230,390 @@ class DBUtils:
         if self.cursor.rowcount == 2: return UPDATE
         return None
 
+    @labelled
     def upsert_many(self, query, tuples):
         self.cursor.executemany(query, tuples)
 
+    # Writes (value, year, entityId, variableId) tuples to data_values through
+    # a temporary TSV file and LOAD DATA LOCAL INFILE, which is much faster
+    # than executemany. Falls back to executemany if the server doesn't allow
+    # it. With `replace`, existing values are overwritten, otherwise a row that
+    # clashes with an existing one, or with another row, fails the load with
+    # DuplicateDataValues (LOAD DATA LOCAL can only skip such rows, so the
+    # rows it loaded are counted instead).
+    # Returns the method used, the number of rows and the rows/s achieved.
+    @labelled
+    def bulk_load_data_values(self, data_values, replace=False):
+        data_values = self.__track_bulk_load(data_values)
+        start_time = time.time()
+        # Only the load itself runs with bulk_load_mode's settings, so the
+        # metadata upserts in between still see the unique keys
+        with self.__session_settings(self.bulk_load_settings):
+            if self.local_infile:
+                num_rows = self.__load_data_values_from_tsv(data_values, replace)
+            else:
+                num_rows = self.__insert_data_values(data_values, replace)
+        # The LOAD DATA attempt may have fallen back to executemany
+        method = 'load_data_local_infile' if self.local_infile else 'executemany'
+        seconds = time.time() - start_time
+        return {
+            'method': method,
+            'rows': num_rows,
+            'seconds': seconds,
+            'rows_per_second': num_rows / seconds if seconds else 0.0
+        }
+
+    def __load_data_values_from_tsv(self, data_values, replace):
+        with tempfile.NamedTemporaryFile('w', encoding='utf8', newline='', suffix='.tsv') as tsv_file:
+            num_rows = 0
+            for row in data_values:
+                tsv_file.write('\t'.join(tsv_field(field) for field in row) + '\n')
+                num_rows += 1
+            tsv_file.flush()
+            if not num_rows:
+                return 0
+            try:
+                self.cursor.execute("""
+                    LOAD DATA LOCAL INFILE %s
+                    """ + ('REPLACE' if replace else '') + """
+                    INTO TABLE data_values
+                    CHARACTER SET utf8mb4
+                    FIELDS TERMINATED BY '\\t' ESCAPED BY '\\\\'
+                    LINES TERMINATED BY '\\n'
+                    (value, year, entityId, variableId)
+                """, [tsv_file.name])
+            except MySQLError as error:
+                if error.args[0] not in LOCAL_INFILE_DISABLED_ERRORS:
+                    raise
+                self.local_infile = False
+            else:
+                if not replace and self.cursor.rowcount != num_rows:
+                    raise DuplicateDataValues(
+                        'Only %d of %d data_values were loaded, the others clash with existing or repeated keys' % (max(self.cursor.rowcount, 0), num_rows)
+                    )
+                return num_rows
+            # The rows have already been consumed, so the fallback reads them
+            # back from the TSV file
+            with open(tsv_file.name, encoding='utf8', newline='') as written_file:
+                return self.__insert_data_values((
+                    tuple(parse_tsv_field(field) for field in line.rstrip('\n').split('\t'))
+                    for line in written_file
+                ), replace)
+
+    def __insert_data_values(self, data_values, replace, batch_size=50000):
+        if replace:
+            insert_sql = """
+                INSERT INTO data_values
+                    (value, year, entityId, variableId)
+                VALUES
+                    (%s, %s, %s, %s)
+                ON DUPLICATE KEY UPDATE
+                    value = VALUES(value)
+            """
+        else:
+            insert_sql = """
+                INSERT INTO data_values
+                    (value, year, entityId, variableId)
+                VALUES
+                    (%s, %s, %s, %s)
+            """
+        num_rows = 0
+        batch = []
+        for row in data_values:
+            batch.append(row)
+            if len(batch) >= batch_size:
+                self.upsert_many(insert_sql, batch)
+                num_rows += len(batch)
+                batch = []
+        if batch:
+            self.upsert_many(insert_sql, batch)
+            num_rows += len(batch)
+        return num_rows
+
+    # Writes (value, year, entityId, variableId) tuples like
+    # bulk_load_data_values, but fans them out in batches to one worker thread
+    # per connection of `pool`. The rows are partitioned by variableId, so no
+    # two workers write the same keys, and each worker writes its batches in
+    # the order the rows were given.
+    # The workers only see what this connection has committed, and would wait
+    # on the locks of anything it hasn't (e.g. the data_values it deleted, or
+    # the variables the rows point to), so the caller has to commit those
+    # first. Every batch is committed by its worker once it is written, and is
+    # retried on a deadlock. If a worker fails, the batches committed so far
+    # stay in the database, and the error is raised once all workers stopped.
+    # It can't be used in bulk_load_mode: the batches would be committed before
+    # they are checked.
+    def parallel_load_data_values(self, pool, data_values, replace=False, batch_size=50000):
+        if self.bulk_load_settings is not None:
+            raise ValueError('parallel_load_data_values cannot be used in bulk_load_mode')
+        start_time = time.time()
+        num_workers = pool.size
+        batch_queues = [queue.Queue(maxsize=2) for _ in range(num_workers)]
+        rows_by_worker = [0] * num_workers
+        methods = set()
+        errors = []
+
+        def work(batch_queue, worker_index):
+            stopped = False
+            try:
+                with pool.connection() as connection:
+                    loader = DBUtils(connection.cursor())
+                    while True:
+                        batch = batch_queue.get()
+                        if batch is None:
+                            stopped = True
+                            break
+                        if errors:
+                            continue # keep draining the queue so the producer doesn't block
+                        try:
+                            rows_by_worker[worker_index] += loader.__load_batch(connection, batch, replace)
+                        except Exception as error:
+                            connection.rollback()
+                            errors.append(error)
+                    methods.add('load_data_local_infile' if loader.local_infile else 'executemany')
+            except Exception as error:
+                # e.g. the connection couldn't be opened
+                errors.append(error)
+            # A worker that failed outside of a batch still drains its queue,
+            # so that the producer doesn't block
+            while not stopped:
+                stopped = batch_queue.get() is None
+
+        workers = [
+            threading.Thread(target=work, args=(batch_queue, worker_index), daemon=True)
+            for worker_index, batch_queue in enumerate(batch_queues)
+        ]
+        for worker in workers:
+            worker.start()
+
+        try:
+            batches = [[] for _ in range(num_workers)]
+            for row in data_values:
+                worker_index = int(row[3]) % num_workers
+                batches[worker_index].append(row)
+                if len(batches[worker_index]) >= batch_size:
+                    batch_queues[worker_index].put(batches[worker_index])
+                    batches[worker_index] = []
+                    if errors:
+                        break
+            else:
+                for worker_index, batch in enumerate(batches):
+                    if batch:
+                        batch_queues[worker_index].put(batch)
+        finally:
+            for batch_queue in batch_queues:
+                batch_queue.put(None)
+            for worker in workers:
+                worker.join()
+
+        if errors:
+            raise errors[0]
+
+        num_rows = sum(rows_by_worker)
+        seconds = time.time() - start_time
+        return {
+            'method': 'parallel_' + '+'.join(sorted(methods)),
+            'workers': num_workers,
+            'rows': num_rows,
+            'seconds': seconds,
+            'rows_per_second': num_rows / seconds if seconds else 0.0
+        }
+
+    # Writes data_values with parallel_load_data_values when given a pool, and
+    # with bulk_load_data_values otherwise
+    @labelled
+    def load_data_values(self, data_values, replace=False, pool=None):
+        if pool is not None:
+            return self.parallel_load_data_values(pool, data_values, replace)
+        return self.bulk_load_data_values(data_values, replace)
+
+    def __load_batch(self, connection, batch, replace, attempts=3):
+        for attempt in range(attempts):
+            try:
+                num_rows = self.bulk_load_data_values(batch, replace)['rows']
+                connection.commit()
+                return num_rows
+            except MySQLError as error:
+                connection.rollback()
+                if error.args[0] not in LOCK_ERRORS or attempt == attempts - 1:
+                    raise
+
+    # For trusted imports only: the data_values loaded inside it are loaded
+    # with the unique and foreign key checks turned off and a larger bulk
+    # insert buffer, which saves InnoDB most of its work on the secondary
+    # indexes. The settings only apply to the loads themselves, and the
+    # previous ones are restored after each.
+    # On a clean exit, the data_values of the variables loaded inside it are
+    # checked for the orphans and duplicates the checks would have caught, and
+    # BulkLoadCheckFailed is raised if there are any. So it should cover one
+    # unit the importer commits (e.g. a file or a batch of variables), and be
+    # exited before that commit; the checks are paid once per unit. The
+    # result is recorded in the import_state of note_import.
+    # With `enabled=False` it does nothing, so importers can make it opt-in.
+    @contextmanager
+    def bulk_load_mode(self, enabled=True, bulk_insert_buffer_size=256 * 1024 * 1024):
+        if not enabled:
+            yield
+            return
+        self.bulk_load_settings = {
+            'unique_checks': 0,
+            'foreign_key_checks': 0,
+            'bulk_insert_buffer_size': bulk_insert_buffer_size
+        }
+        self.bulk_load_variable_ids = set()
+        try:
+            yield
+        finally:
+            self.bulk_load_settings = None
+            variable_ids = self.bulk_load_variable_ids
+            self.bulk_load_variable_ids = None
+
+        report = self.check_data_values(variable_ids)
+        if self.bulk_load_report is None:
+            self.bulk_load_report = {'variables_checked': 0, 'orphaned_rows': 0, 'duplicate_keys': 0}
+        for key, count in report.items():
+            self.bulk_load_report[key] += count
+        if report['orphaned_rows'] or report['duplicate_keys']:
+            raise BulkLoadCheckFailed(
+                'Found %(orphaned_rows)d orphaned data_values and %(duplicate_keys)d duplicate keys after the bulk load' % report
+            )
+
+    # Counts the data_values of the given variables that point to a missing
+    # entity or variable, and the (entityId, variableId, year) keys that occur
+    # more than once
+    @labelled
+    def check_data_values(self, variable_ids):
+        variable_ids = list(variable_ids)
+        report = {'variables_checked': len(variable_ids), 'orphaned_rows': 0, 'duplicate_keys': 0}
+        for i in range(0, len(variable_ids), 1000):
+            chunk = variable_ids[i:i + 1000]
+            (orphaned_rows,) = self.fetch_one("""
+                SELECT COUNT(*)
+                FROM data_values
+                LEFT JOIN entities ON entities.id = data_values.entityId
+                LEFT JOIN variables ON variables.id = data_values.variableId
+                WHERE data_values.variableId IN %s
+                AND (entities.id IS NULL OR variables.id IS NULL)
+            """, [chunk])
+            (duplicate_keys,) = self.fetch_one("""
+                SELECT COUNT(*)
+                FROM (
+                    SELECT 1
+                    FROM data_values
+                    WHERE variableId IN %s
+                    GROUP BY entityId, variableId, year
+                    HAVING COUNT(*) > 1
+                ) AS duplicates
+            """, [chunk])
+            report['orphaned_rows'] += orphaned_rows
+            report['duplicate_keys'] += duplicate_keys
+        return report
+
+    # Applies the given session variables, and restores their previous values
+    # on exit. Does nothing if `settings` is None.
+    @contextmanager
+    def __session_settings(self, settings):
+        if settings is None:
+            yield
+            return
+        names = list(settings.keys())
+        previous_values = self.fetch_one('SELECT ' + ', '.join('@@SESSION.%s' % name for name in names))
+        self.__set_session_variables(names, [settings[name] for name in names])
+        try:
+            yield
+        finally:
+            self.__set_session_variables(names, previous_values)
+
+    @labelled
+    def __set_session_variables(self, names, values):
+        self.cursor.execute('SET ' + ', '.join('SESSION %s = %%s' % name for name in names), list(values))
+
+    def __track_bulk_load(self, data_values):
+        if self.bulk_load_variable_ids is None:
+            return data_values
+        return self.__tracked_data_values(data_values)
+
+    def __tracked_data_values(self, data_values):
+        for row in data_values:
+            self.bulk_load_variable_ids.add(row[3])
+            yield row
+
+    # Brings the data_values of a variable in line with the given
+    # (entityId, year, value) tuples, by merge-joining them against the stored
+    # rows and writing only the differences. If a key is given more than once,
+    # the last value wins. The stored rows are streamed from the server rather
+    # than fetched at once, and as no other statement can run on the
+    # connection until they are all read, the differences are written after.
+    # Returns how many rows were inserted, updated, deleted and left unchanged.
+    @labelled
+    def sync_data_values(self, variable_id, data_values):
+        incoming_value_by_key = {}
+        for entity_id, year, value in data_values:
+            incoming_value_by_key[(int(entity_id), int(year))] = value
+        incoming_rows = sorted(incoming_value_by_key.items())
+
+        to_insert = []
+        to_update = []
+        to_delete = []
+        unchanged = 0
+        j = 0
+        existing_cursor = self.cursor.connection.cursor(pymysql.cursors.SSCursor)
+        try:
+            existing_cursor.execute("""
+                SELECT entityId, year, value
+                FROM data_values
+                WHERE variableId = %s
+                ORDER BY entityId ASC, year ASC
+            """, [variable_id])
+            for entity_id, year, value in existing_cursor.fetchall_unbuffered():
+                existing_key = (entity_id, year)
+                while j < len(incoming_rows) and incoming_rows[j][0] < existing_key:
+                    to_insert.append(incoming_rows[j])
+                    j += 1
+                if j < len(incoming_rows) and incoming_rows[j][0] == existing_key:
+                    if data_values_equal(value, incoming_rows[j][1]):
+                        unchanged += 1
+                    else:
+                        to_update.append(incoming_rows[j])
+                    j += 1
+                else:
+                    to_delete.append(existing_key)
+        finally:
+            existing_cursor.close()
+        to_insert.extend(incoming_rows[j:])
+
+        if to_insert:
+            self.bulk_load_data_values(
+                (value, year, entity_id, variable_id)
+                for (entity_id, year), value in to_insert
+            )
+        if to_update:
+            self.upsert_many("""
+                INSERT INTO data_values
+                    (value, year, entityId, variableId)
+                VALUES
+                    (%s, %s, %s, %s)
+                ON DUPLICATE KEY UPDATE
+                    value = VALUES(value)
+            """, [
+                (value, year, entity_id, variable_id)
+                for (entity_id, year), value in to_update
+            ])
+        for start in range(0, len(to_delete), 1000):
+            self.cursor.execute("""
+                DELETE FROM data_values
+                WHERE variableId = %s
+                AND (entityId, year) IN %s
+            """, [variable_id, to_delete[start:start + 1000]])
+
+        return {
+            'inserted': len(to_insert),
+            'updated': len(to_update),
+            'deleted': len(to_delete),
+            'unchanged': unchanged
+        }
+
+    @labelled
     def execute_until_empty(self, *args, **kwargs):
         first = True
         while first or self.cursor.rowcount > 0:
@@ -81,6 +630,7 @@ class DBUtils:
         """, [name])
         return tag_id
 
+    @labelled
     def upsert_parent_tag(self, name):
         try:
             return self.__fetch_parent_tag(name)
@@ -92,7 +642,90 @@ class DBUtils:
             self.counts['tags_inserted'] += 1
             return self.__fetch_parent_tag(name)
 
+    # Loads the tags, datasets, sources and variables of a namespace, so that
+    # upserting any of them needs no round trip. The metadata of the ones that
+    # already exist is only refreshed by apply_metadata_refreshes.
+    @labelled
+    def prefetch_namespace(self, namespace):
+        self.prefetched_namespace = namespace
+        for tag_id, name, parent_id, dataset_id in self.fetch_many("""
+            SELECT tags.id, tags.name, tags.parentId, dataset_tags.datasetId
+            FROM tags
+            JOIN dataset_tags ON dataset_tags.tagId = tags.id
+            JOIN datasets ON datasets.id = dataset_tags.datasetId
+            WHERE datasets.namespace = %s
+        """, [namespace]):
+            self.tag_id_by_key[(name, parent_id)] = tag_id
+            self.dataset_tag_pairs.add((dataset_id, tag_id))
+        for dataset_id, name in self.fetch_many("""
+            SELECT id, name
+            FROM datasets
+            WHERE namespace = %s
+        """, [namespace]):
+            self.dataset_id_by_key[(name, namespace)] = dataset_id
+        self.source_id_by_key.update(self.__fetch_source_id_by_key(namespace))
+        for var_id, name, code, dataset_id in self.fetch_many("""
+            SELECT variables.id, variables.name, variables.code, variables.datasetId
+            FROM variables
+            JOIN datasets ON datasets.id = variables.datasetId
+            WHERE datasets.namespace = %s
+        """, [namespace]):
+            self.variable_id_by_key[(name, dataset_id)] = var_id
+            if code is not None:
+                self.variable_id_by_code[code] = var_id
+
+    # Writes the metadata refreshes queued by the upserts of prefetched tags,
+    # datasets and sources, with one statement each
+    @labelled
+    def apply_metadata_refreshes(self):
+        if self.tag_ids_to_refresh:
+            self.cursor.execute("""
+                UPDATE tags
+                SET updatedAt = NOW(),
+                    isBulkImport = TRUE
+                WHERE id IN %s
+            """, [list(self.tag_ids_to_refresh)])
+            self.tag_ids_to_refresh.clear()
+
+        if self.datasets_to_refresh:
+            # This is actually a bulk UPDATE, since the primary key always clashes
+            self.upsert_many("""
+                INSERT INTO datasets
+                    (id, name, description, namespace, createdAt, createdByUserId, updatedAt, metadataEditedAt, metadataEditedByUserId, dataEditedAt, dataEditedByUserId)
+                VALUES
+                    (%s, %s, %s, %s, NOW(), %s, NOW(), NOW(), %s, NOW(), %s)
+                ON DUPLICATE KEY UPDATE
+                    description = VALUES(description),
+                    updatedAt = VALUES(updatedAt),
+                    metadataEditedAt = VALUES(metadataEditedAt),
+                    metadataEditedByUserId = VALUES(metadataEditedByUserId),
+                    dataEditedAt = VALUES(dataEditedAt),
+                    dataEditedByUserId = VALUES(dataEditedByUserId)
+            """, list(self.datasets_to_refresh.values()))
+            self.datasets_to_refresh.clear()
+
+        if self.sources_to_refresh:
+            # This is actually a bulk UPDATE, since the primary key always clashes
+            self.upsert_many("""
+                INSERT INTO sources
+                    (id, name, description, datasetId, createdAt, updatedAt)
+                VALUES
+                    (%s, %s, %s, %s, NOW(), NOW())
+                ON DUPLICATE KEY UPDATE
+                    description = VALUES(description),
+                    updatedAt = VALUES(updatedAt)
+            """, list(self.sources_to_refresh.values()))
+            self.sources_to_refresh.clear()
+
+    @labelled
     def upsert_tag(self, name, parent_id):
+        if (name, parent_id) in self.tag_id_by_key:
+            tag_id = self.tag_id_by_key[(name, parent_id)]
+            if tag_id not in self.tag_ids_to_refresh:
+                self.tag_ids_to_refresh.add(tag_id)
+                self.counts['tags_updated'] += 1
+            return tag_id
+
         operation = self.upsert_one("""
             INSERT INTO
                 tags (name, parentId, createdAt, updatedAt, isBulkImport)
@@ -114,9 +747,15 @@ class DBUtils:
             AND parentId = %s
         """, [name, parent_id])
 
+        if self.prefetched_namespace is not None:
+            self.tag_id_by_key[(name, parent_id)] = tag_id
+
         return tag_id
 
+    @labelled
     def associate_dataset_tag(self, dataset_id, tag_id):
+        if (dataset_id, tag_id) in self.dataset_tag_pairs:
+            return
         self.upsert_one("""
             INSERT INTO dataset_tags
                 (datasetId, tagId)
@@ -126,8 +765,20 @@ class DBUtils:
                 tagId = VALUES(tagId)
         """, [dataset_id, tag_id])
         # ON DUPLICATE here only avoids error, it intentionally updates nothing
+        if self.prefetched_namespace is not None:
+            self.dataset_tag_pairs.add((dataset_id, tag_id))
 
+    @labelled
     def upsert_dataset(self, name, namespace, user_id, tag_id, description='This is a dataset imported by the automated fetcher'):
+        if (name, namespace) in self.dataset_id_by_key:
+            dataset_id = self.dataset_id_by_key[(name, namespace)]
+            if dataset_id not in self.datasets_to_refresh:
+                self.counts['datasets_updated'] += 1
+            self.datasets_to_refresh[dataset_id] = (dataset_id, name, description, namespace, user_id, user_id, user_id)
+            if tag_id is not None:
+                self.associate_dataset_tag(dataset_id, tag_id)
+            return dataset_id
+
         operation = self.upsert_one("""
             INSERT INTO datasets
                 (name, description, namespace, createdAt, createdByUserId, updatedAt, metadataEditedAt, metadataEditedByUserId, dataEditedAt, dataEditedByUserId)
@@ -152,12 +803,23 @@ class DBUtils:
         if operation == INSERT: self.counts['datasets_inserted'] += 1
         if operation == UPDATE: self.counts['datasets_updated'] += 1
 
+        if namespace == self.prefetched_namespace:
+            self.dataset_id_by_key[(name, namespace)] = dataset_id
+
         if tag_id is not None:
             self.associate_dataset_tag(dataset_id, tag_id)
 
         return dataset_id
 
+    @labelled
     def upsert_source(self, name, description, dataset_id):
+        if (name, dataset_id) in self.source_id_by_key:
+            source_id = self.source_id_by_key[(name, dataset_id)]
+            if source_id not in self.sources_to_refresh:
+                self.counts['sources_updated'] += 1
+            self.sources_to_refresh[source_id] = (source_id, name, description, dataset_id)
+            return source_id
+
         # There is no UNIQUE key constraint we can rely on to prevent duplicates
         # so we have to do a SELECT before INSERT...
         row = self.fetch_one_or_none("""
@@ -191,8 +853,11 @@ class DBUtils:
                 'id': row[0]
             })
             self.counts['sources_updated'] += 1
+        if self.prefetched_namespace is not None:
+            self.source_id_by_key[(name, dataset_id)] = row[0]
         return row[0]
 
+    @labelled
     def upsert_variable(self, name, code, unit, short_unit, source_id, dataset_id, description=None, timespan='', coverage='', display={}):
         operation = self.upsert_one("""
             INSERT INTO variables
@@ -223,6 +888,136 @@ class DBUtils:
 
         return var_id
 
+    def __fetch_source_id_by_key(self, namespace):
+        # Ordered so that the lowest id wins if there are duplicate sources
+        return {
+            (name, dataset_id): source_id
+            for name, dataset_id, source_id in self.fetch_many("""
+                SELECT sources.name, sources.datasetId, sources.id
+                FROM sources
+                JOIN datasets ON datasets.id = sources.datasetId
+                WHERE datasets.namespace = %s
+                ORDER BY sources.id DESC
+            """, [namespace])
+        }
+
+    # Batched version of upsert_source. Takes a list of dicts holding the
+    # keyword arguments of upsert_source, and returns the source IDs in the
+    # same order. All the datasets must be in the given namespace.
+    @labelled
+    def upsert_sources_many(self, namespace, sources):
+        # As in upsert_source, there is no UNIQUE key constraint we can rely on,
+        # so we fetch the existing sources of the namespace up front
+        if namespace == self.prefetched_namespace:
+            source_id_by_key = self.source_id_by_key
+        else:
+            source_id_by_key = self.__fetch_source_id_by_key(namespace)
+
+        sources_to_update = {}
+        sources_to_insert = {}
+        for source in sources:
+            key = (source['name'], source['dataset_id'])
+            if key in source_id_by_key:
+                sources_to_update[key] = (source_id_by_key[key], source['name'], source['description'], source['dataset_id'])
+            else:
+                sources_to_insert[key] = (source['name'], source['description'], source['dataset_id'])
+
+        if sources_to_update:
+            # This is actually a bulk UPDATE, since the primary key always clashes
+            self.upsert_many("""
+                INSERT INTO sources
+                    (id, name, description, datasetId, createdAt, updatedAt)
+                VALUES
+                    (%s, %s, %s, %s, NOW(), NOW())
+                ON DUPLICATE KEY UPDATE
+                    description = VALUES(description),
+                    updatedAt = VALUES(updatedAt)
+            """, list(sources_to_update.values()))
+            self.counts['sources_updated'] += len(sources_to_update)
+
+        if sources_to_insert:
+            self.upsert_many("""
+                INSERT INTO sources
+                    (name, description, datasetId, createdAt, updatedAt)
+                VALUES
+                    (%s, %s, %s, NOW(), NOW())
+            """, list(sources_to_insert.values()))
+            self.counts['sources_inserted'] += len(sources_to_insert)
+            source_id_by_key = self.__fetch_source_id_by_key(namespace)
+            if namespace == self.prefetched_namespace:
+                self.source_id_by_key.update(source_id_by_key)
+
+        return [
+            source_id_by_key[(source['name'], source['dataset_id'])]
+            for source in sources
+        ]
+
+    # Batched version of upsert_variable. Takes a list of dicts holding the
+    # keyword arguments of upsert_variable, and returns the variable IDs in the
+    # same order. All the datasets must be in the given namespace.
+    @labelled
+    def upsert_variables_many(self, namespace, variables):
+        if not variables:
+            return []
+
+        self.upsert_many("""
+            INSERT INTO variables
+                (name, code, description, unit, shortUnit, timespan, coverage, display, sourceId, datasetId, createdAt, updatedAt)
+            VALUES
+                (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, NOW(), NOW())
+            ON DUPLICATE KEY UPDATE
+                name = VALUES(name),
+                code = VALUES(code),
+                timespan = VALUES(timespan),
+                datasetId = VALUES(datasetId),
+                sourceId = VALUES(sourceId),
+                updatedAt = VALUES(updatedAt)
+        """, [
+            (
+                var['name'],
+                var['code'],
+                var.get('description'),
+                var['unit'],
+                var['short_unit'],
+                var.get('timespan', ''),
+                var.get('coverage', ''),
+                json.dumps(var.get('display', {})),
+                var['source_id'],
+                var['dataset_id']
+            )
+            for var in variables
+        ])
+        # MySQL reports 1 affected row per insert and 2 per update
+        variables_updated = max(self.cursor.rowcount - len(variables), 0)
+        self.counts['variables_inserted'] += len(variables) - variables_updated
+        self.counts['variables_updated'] += variables_updated
+
+        # (name, datasetId) is UNIQUE, so it identifies every upserted variable.
+        # Only the variables just upserted are fetched, not the whole namespace,
+        # since this runs for every batch. The names are used rather than the
+        # codes, which can be NULL.
+        var_id_by_key = {
+            (name, dataset_id): var_id
+            for name, dataset_id, var_id in self.fetch_many("""
+                SELECT name, datasetId, id
+                FROM variables
+                WHERE datasetId IN %s
+                AND name IN %s
+            """, [
+                list({var['dataset_id'] for var in variables}),
+                list({var['name'] for var in variables})
+            ])
+        }
+
+        if namespace == self.prefetched_namespace:
+            self.variable_id_by_key.update(var_id_by_key)
+
+        return [
+            var_id_by_key[(var['name'], var['dataset_id'])]
+            for var in variables
+        ]
+
+    @labelled
     def touch_variable(self, var_id):
         self.cursor.execute("""
             UPDATE variables
@@ -231,47 +1026,157 @@ class DBUtils:
         """, [var_id])
         self.counts['variables_updated'] += self.cursor.rowcount
 
+    @labelled
+    def touch_variables(self, var_ids):
+        if not var_ids:
+            return
+        self.cursor.execute("""
+            UPDATE variables
+            SET updatedAt = NOW()
+            WHERE id IN %s
+        """, [list(var_ids)])
+        self.counts['variables_updated'] += self.cursor.rowcount
+
+    # Merges the `variable_fingerprints` of every import of this type, with
+    # later imports taking precedence
+    @labelled
+    def fetch_variable_fingerprints(self, import_type):
+        fingerprints = {}
+        for (import_state,) in self.fetch_many("""
+            SELECT import_state
+            FROM importer_importhistory
+            WHERE import_type = %s
+            ORDER BY import_time ASC, id ASC
+        """, [import_type]):
+            try:
+                fingerprints.update(json.loads(import_state).get('variable_fingerprints', {}))
+            except (TypeError, ValueError, AttributeError):
+                continue
+        return fingerprints
+
+    # Returns the import_state of the last import of this type that completed,
+    # i.e. that isn't a checkpoint, or None
+    @labelled
+    def fetch_last_import_state(self, import_type):
+        for (import_state,) in self.fetch_many("""
+            SELECT import_state
+            FROM importer_importhistory
+            WHERE import_type = %s
+            ORDER BY import_time DESC, id DESC
+        """, [import_type]):
+            try:
+                state = json.loads(import_state)
+            except (TypeError, ValueError):
+                continue
+            if isinstance(state, dict) and 'checkpoint' not in state:
+                return state
+        return None
+
+    @labelled
     def note_import(self, import_type, import_notes, import_state):
+        statement_stats = self.get_statement_stats()
+        if statement_stats is not None:
+            import_state = json.dumps({**json.loads(import_state), 'statement_stats': statement_stats})
+        if self.bulk_load_report is not None:
+            import_state = json.dumps({**json.loads(import_state), 'bulk_load_mode': self.bulk_load_report})
         self.upsert_one("""
             INSERT INTO importer_importhistory (import_type, import_time, import_notes, import_state)
             VALUES (%s, NOW(), %s, %s)
         """, [import_type, import_notes, import_state])
 
+    # Returns the ID of the run that is starting and the checkpoints it can
+    # skip. With `resume`, that is the run that most recently failed to
+    # complete, i.e. whose checkpoints were not followed by a note_import.
+    @labelled
+    def begin_run(self, import_type, resume):
+        checkpoints = []
+        if resume:
+            for (import_state,) in self.fetch_many("""
+                SELECT import_state
+                FROM importer_importhistory
+                WHERE import_type = %s
+                ORDER BY import_time ASC, id ASC
+            """, [import_type]):
+                try:
+                    state = json.loads(import_state)
+                except (TypeError, ValueError):
+                    continue
+                if not isinstance(state, dict) or 'checkpoint' not in state:
+                    checkpoints = []
+                elif checkpoints and checkpoints[-1]['run'] != state['run']:
+                    checkpoints = [state]
+                else:
+                    checkpoints.append(state)
+        run = checkpoints[0]['run'] if checkpoints else uuid.uuid4().hex
+        return run, checkpoints
 
-    def __get_cached_entity_id(self, name):
-        normalised_name = normalise_country_name(name)
-        if normalised_name in self.entity_id_by_normalised_name:
-            return self.entity_id_by_normalised_name[normalised_name]
-        else:
-            return None
+    # Records that a unit of an import (e.g. one of its files) is complete,
+    # together with the hash of its input, and commits everything written so
+    # far, so that a later failure doesn't roll it back
+    @labelled
+    def checkpoint(self, import_type, run, unit, input_hash, **state):
+        self.apply_metadata_refreshes()
+        self.note_import(
+            import_type=import_type,
+            import_notes='Checkpoint: %s' % unit,
+            import_state=json.dumps({
+                **state,
+                'checkpoint': unit,
+                'run': run,
+                'input_hash': input_hash
+            })
+        )
+        self.cursor.connection.commit()
 
+
+    @labelled
     def get_or_create_entity(self, name):
-        # Serve from cache if available
-        entity_id = self.__get_cached_entity_id(name)
-        if entity_id is not None:
-            return entity_id
-        # Populate cache from database
-        self.prefill_entity_cache([name])
-        entity_id = self.__get_cached_entity_id(name)
-        if entity_id is not None:
-            return entity_id
-        # If still not in cache, it's a new entity and we have to insert it
-        else:
+        return self.resolve_entities([name])[name]
+
+    @labelled
+    def resolve_entities(self, names):
+        # Normalise every name once, the cache and the database lookups are
+        # both keyed by the normalised name
+        normalised_name_by_name = {}
+        for name in names:
+            if name not in normalised_name_by_name:
+                normalised_name_by_name[name] = normalise_country_name(name)
+        # Populate cache from database for all uncached names in one query
+        uncached_names = [
+            name
+            for name, normalised_name in normalised_name_by_name.items()
+            if normalised_name not in self.entity_id_by_normalised_name
+        ]
+        if uncached_names:
+            self.prefill_entity_cache(uncached_names)
+        # Anything still not in the cache is a new entity. Names that normalise
+        # to the same string only need to be inserted once, under the spelling
+        # that was seen first.
+        names_to_insert = {}
+        for name in uncached_names:
+            normalised_name = normalised_name_by_name[name]
+            if normalised_name not in self.entity_id_by_normalised_name:
+                names_to_insert.setdefault(normalised_name, name)
+        if names_to_insert:
+            names_to_insert = list(names_to_insert.values())
             self.upsert_one("""
                 INSERT INTO entities
                     (name, displayName, validated, createdAt, updatedAt)
                 VALUES
-                    (%s, '', FALSE, NOW(), NOW())
-            """, [name])
-            self.counts['entities_inserted'] += 1
-            (entity_id,) = self.fetch_one("""
-                SELECT id FROM entities
-                WHERE name = %s
-            """, [name])
-            # Cache the newly created entity
-            self.entity_id_by_normalised_name[normalise_country_name(name)] = entity_id
-            return entity_id
+            """ + ",".join(["(%s, '', FALSE, NOW(), NOW())"] * len(names_to_insert)), names_to_insert)
+            self.counts['entities_inserted'] += len(names_to_insert)
+            # Cache the newly created entities
+            for name, entity_id in self.fetch_many("""
+                SELECT name, id FROM entities
+                WHERE name IN %s
+            """, [names_to_insert]):
+                self.entity_id_by_normalised_name[normalise_country_name(name)] = entity_id
+        return {
+            name: self.entity_id_by_normalised_name[normalised_name]
+            for name, normalised_name in normalised_name_by_name.items()
+        }
 
+    @labelled
     def prefill_entity_cache(self, names):
         rows = self.fetch_many("""
             SELECT
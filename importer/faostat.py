@@ -7,7 +7,8 @@ import json
 import glob
 import unidecode
 import time
-import zipfile
+import tempfile
+import multiprocessing
 
 sys.path.insert(1, os.path.join(sys.path[0], '..'))
 # from grapher_admin.models import Entity|DatasetSubcategory|DatasetCategory|Dataset|Source|Variable|VariableType|DataValue
@@ -18,8 +19,12 @@ sys.path.insert(1, os.path.join(sys.path[0], '..'))
 # from django.utils import timezone
 # from grapher_admin.views import write_dataset_csv
 from db import connection
-from utils import extract_short_unit, file_checksum, starts_with
+from db_pool import ConnectionPool
+from utils import extract_short_unit, file_checksum, parse_import_args, governor_from_args, DataFingerprints, PairSet, map_sources
 from db_utils import DBUtils
+from faostat_layouts import find_layout, compile_layout, history_file_name
+from zip_members import member_names, open_member, DecompressionError
+from external_aggregate import ExternalSum, SpilledRows
 
 CURRENT_PATH = os.path.dirname(os.path.realpath(__file__))
 
@@ -28,8 +33,7 @@ start_time = datetime.now()
 # Each zip file contains only one csv file
 # The link to the bulk download: http://fenixservices.fao.org/faostat/static/bulkdownloads/FAOSTAT.zip
 # These csv files contain different structure variants
-# Some of the zip files may have been compressed using a compression format not available in python
-# Unzip those files, and put their csv files into the same directory where all zip files are located
+# The csv files are streamed out of the zip files, including the ones compressed with Deflate64, see zip_members.py
 # Here is what you need to to before running this script:
 # Put all .zip and .csv files you want to parse in one directory
 # make sure you have metadata csv files for each of your .zip or .csv file
@@ -38,13 +42,27 @@ start_time = datetime.now()
 # Put each dataset file's name into an appropriate category in the category_files dict
 # Fill in the files_to_exclude list with files you don't want to parse
 # Please note that the datasets which don't have their corresponding .csv metadata files will have some of the "Sources" fields empty
-# Check the column_types list and the logic for dealing with different column types in the process_csv_file function
+# Check that the files' columns follow one of the layouts in faostat_layouts.py, and add a layout or a file rule there if not
 # Fill in the file_dataset_names dict with names of datasets for each file
 # The script will perform the necessary checks and will inform the user if anything is missing
 
+
+def add_arguments(parser):
+    parser.add_argument('--aggregate-memory', type=int, default=256,
+        help="the megabytes of values of a bilateral file summed in memory, before they are spilled to temporary files")
+
+
+args = parse_import_args(add_arguments)
+governor = governor_from_args(args)
+
 db = None
+pool = ConnectionPool(args.workers) if args.workers > 1 else None
 processed_values = 0  # the total number of values processed
-var_ids_to_delete = []
+var_ids_to_delete = set()  # the variables of the files being updated, until they are upserted again
+data_values_by_var_id = None  # with --sync, collects the values of the file being updated per variable id
+var_ids_to_write = None  # while a file is updated, the variables whose data_values are written
+file_fingerprints = None  # fingerprints of the variables in the file being processed
+previous_fingerprints = {}  # fingerprints of the variables as of their last import
 
 PARENT_TAG_NAME = 'FAOSTAT 2018'  # set the name of the root category of all data that will be imported by this script
 DATASET_NAMESPACE = 'faostat_2018'
@@ -67,13 +85,11 @@ category_files = {
     "Trade": [
         "Trade_Crops_Livestock_E_All_Data_(Normalized).zip",
         "Trade_LiveAnimals_E_All_Data_(Normalized).zip",
-        "Trade_DetailedTradeMatrix_E_All_Data_(Normalized).zip",  # this file cannot be extracted using python's zipfile module
-        "Trade_DetailedTradeMatrix_E_All_Data_(Normalized).csv",
+        "Trade_DetailedTradeMatrix_E_All_Data_(Normalized).zip",
         "Trade_Indices_E_All_Data_(Normalized).zip"
     ],
     "Food Balance": [
-        "FoodBalanceSheets_E_All_Data_(Normalized).zip",  # this file cannot be extracted using python's zipfile module
-        "FoodBalanceSheets_E_All_Data_(Normalized).csv",
+        "FoodBalanceSheets_E_All_Data_(Normalized).zip",
         "CommodityBalances_Crops_E_All_Data_(Normalized).zip",
         "CommodityBalances_LivestockFish_E_All_Data_(Normalized).zip",
         "FoodSupply_Crops_E_All_Data_(Normalized).zip",
@@ -324,28 +340,9 @@ file_dataset_names = {
     "Trade_LiveAnimals_E_All_Data_(Normalized).zip":
         "Live animals",
     "Value_of_Production_E_All_Data_(Normalized).zip":
-        "Value of Agricultural Production",
-    "FoodBalanceSheets_E_All_Data_(Normalized).csv":
-        "Food Balance Sheets",
-    "Trade_DetailedTradeMatrix_E_All_Data_(Normalized).csv":
-        "Detailed trade matrix"
+        "Value of Agricultural Production"
 }
 
-# the different column name variants found in the FAO dataset files
-column_types = [
-    # 11 columns
-    tuple(["Area Code", "Area", "Item Code", "Item", "ISO Currency Code", "Currency", "Year Code", "Year", "Unit", "Value", "Flag"]),
-    tuple(["CountryCode", "Country", "ItemCode", "Item", "ElementGroup", "ElementCode", "Element", "Year", "Unit", "Value", "Flag"]),
-    tuple(["Area Code", "Area", "Item Code", "Item", "Element Code", "Element", "Year Code", "Year", "Unit", "Value", "Flag"]),
-    tuple(["Country Code", "Country", "Item Code", "Item", "Element Code", "Element", "Year Code", "Year", "Unit", "Value", "Flag"]),
-    tuple(["Country Code", "Country", "Source Code", "Source", "Indicator Code", "Indicator", "Year Code", "Year", "Unit", "Value", "Flag"]),
-    tuple(["Recipient Country Code", "Recipient Country", "Item Code", "Item", "Donor Country Code", "Donor Country", "Year Code", "Year", "Unit", "Value", "Flag"]),
-    # 13 columns
-    tuple(["Reporter Country Code", "Reporter Countries", "Partner Country Code", "Partner Countries", "Item Code", "Item", "Element Code", "Element", "Year Code", "Year", "Unit", "Value", "Flag"]),
-    # 15 columns
-    tuple(["Donor Code", "Donor", "Recipient Country Code", "Recipient Country", "Item Code", "Item", "Element Code", "Element", "Purpose Code", "Purpose", "Year Code", "Year", "Unit", "Value", "Flag"])
-]
-
 files_to_exclude = [
     "CommodityBalances_Crops_E_All_Data_(Normalized).zip",
     "CommodityBalances_LivestockFish_E_All_Data_(Normalized).zip",
@@ -374,12 +371,36 @@ for category, files in category_files.items():
 all_files_meta = []  # will contain all the .csv metadata files in the folder given by metadata_dir variable
 for file in glob.glob(os.path.join(metadata_dir, "*.csv")):
     all_files_meta.append(os.path.splitext(os.path.basename(file))[0] + ".zip")
-    # dataset files that can't be extracted by python will be put in csv format in the folder with other .zip files
+    # dataset files can also be put in the folder in csv format, instead of in a zip file
     all_files_meta.append(os.path.splitext(os.path.basename(file))[0] + ".csv")
 
-print("########################################################################################")
-print("Please make sure you set the ulimit on your operating system to a value higher than 5000")
-print("########################################################################################")
+
+# A dataset file is either the path of a csv file, or an (archive path, member
+# name) pair for the csv file in a zip file, which is streamed rather than
+# extracted. Every pass over the rows reads the file again from the start.
+def open_dataset_file(source):
+    if isinstance(source, tuple):
+        return open_member(*source, encoding='latin-1')
+    return open(source, encoding='latin-1', newline='')
+
+
+def read_rows(source):
+    with open_dataset_file(source) as csvfile:
+        yield from csv.reader(csvfile)
+
+
+def read_header(source):
+    rows = read_rows(source)
+    try:
+        return next(rows)
+    finally:
+        rows.close()
+
+
+# the csv files that were taken out of their zip files by hand, which are read from the zip files instead
+def is_extracted_copy(csv_path):
+    return os.path.isfile(os.path.splitext(csv_path)[0] + '.zip')
+
 
 # Will now perform the checks for files, dataset categories and file structures
 parsing_notes = []
@@ -393,22 +414,13 @@ for file in glob.glob(os.path.join(all_dataset_files_dir, "*.zip")):
     if one_file in files_to_exclude:
         parsing_notes.append("File %s will be excluded from parsing." % one_file)
     if one_file not in files_to_exclude:
-        file_extracted = 1
-        zip_ref = zipfile.ZipFile(file, 'r')
-        csv_filename = zip_ref.namelist()[0]
         try:
-            zip_ref.extractall("/tmp")
-        except:
-            file_extracted = 0
-        zip_ref.close()
-
-        if file_extracted:
-            with open(os.path.join("/tmp", csv_filename), encoding='latin-1') as csvfile:
-                reader = csv.DictReader(csvfile)
-                columns = tuple(reader.fieldnames)
-                if not any([starts_with(columns, c) for c in column_types]):
-                    parsing_notes.append("The file %s contains columns that are not defined in the column_types list." % one_file)
-            os.remove("/tmp/%s" % csv_filename)
+            columns = read_header((file, member_names(file)[0]))
+        except DecompressionError as e:
+            parsing_notes.append("The file %s could not be read: %s" % (one_file, e))
+        else:
+            if find_layout(columns) is None:
+                parsing_notes.append("The file %s contains columns that are not defined in faostat_layouts.py." % one_file)
     if one_file not in files_to_exclude:
         if one_file not in file_dataset_names:
             parsing_notes.append(
@@ -417,6 +429,9 @@ for file in glob.glob(os.path.join(all_dataset_files_dir, "*.zip")):
 
 for file in glob.glob(os.path.join(all_dataset_files_dir, "*.csv")):
     one_file = os.path.basename(file)
+    if is_extracted_copy(file):
+        parsing_notes.append("File %s will be skipped, its zip file is read instead." % one_file)
+        continue
     if one_file not in all_files_cat and one_file not in files_to_exclude:
         parsing_notes.append("The file %s is not found in the category_files dict." % one_file)
     if one_file not in all_files_meta and one_file not in files_to_exclude:
@@ -424,12 +439,9 @@ for file in glob.glob(os.path.join(all_dataset_files_dir, "*.csv")):
     if one_file in files_to_exclude:
         parsing_notes.append("File %s will be excluded from parsing." % one_file)
     if one_file not in files_to_exclude:
-        with open(file, encoding='latin-1') as csvfile:
-            reader = csv.DictReader(csvfile)
-            columns = tuple(reader.fieldnames)
-            if not any([starts_with(columns, c) for c in column_types]):
-                parsing_notes.append(
-                    "The file %s contains columns that are not defined in the column_types list." % one_file)
+        if find_layout(read_header(file)) is None:
+            parsing_notes.append(
+                "The file %s contains columns that are not defined in faostat_layouts.py." % one_file)
     if one_file not in files_to_exclude:
         if one_file not in file_dataset_names:
             parsing_notes.append(
@@ -445,124 +457,214 @@ if len(parsing_notes) > 0:
         sys.exit()
 
 
-def process_csv_file_update(filename_to_process: str, original_filename: str):
+# The variable names in a file. The bilateral layouts name two variables in
+# every row, one for each of their perspectives.
+def read_var_names(source, original_filename: str):
+    file_layout = compile_layout(read_header(source), original_filename, file_dataset_names[original_filename])
+    var_names = set()
+    for row in read_rows(source):
+        if file_layout.is_header(row):
+            continue
+        governor.tick()
+        for extract in file_layout.extractors:
+            var_names.add(extract(row)[1])
+    return var_names
+
+
+# Parses a file into whether it is bilateral, and the rows that go to
+# process_one_row(): (year, value, countryname, variablecode, variablename, unit).
+# The year and value are False where they are not numbers. Nothing here uses
+# the database, so that files can be parsed in worker processes.
+def parse_dataset_file(source, original_filename: str):
+    rows = read_rows(source)
+    # the layout is matched to the header once, the rows are then only
+    # picked apart by index, see faostat_layouts.py
+    file_layout = compile_layout(next(rows), original_filename, file_dataset_names[original_filename])
+    if file_layout.is_bilateral:
+        return True, sum_bilateral_rows(file_layout, rows)
+    return False, parse_rows(file_layout, rows)
+
+
+def parse_rows(file_layout, rows):
+    current_file_var_codes = set()
+    current_file_var_names = set()
+    previous_row = None
+
+    extract = file_layout.extractors[0]
+    skip_repeated_rows = file_layout.rules['skip_repeated_rows']
+    item_code_and_name = file_layout.item_code_and_name
+    for row in rows:
+        # avoiding duplicate rows
+        if skip_repeated_rows:
+            if row == previous_row:
+                continue
+            previous_row = row
+        if item_code_and_name is not None:
+            item_code, item_name = item_code_and_name(row)
+            if item_code not in current_file_var_codes and item_name not in current_file_var_names:
+                current_file_var_codes.add(item_code)
+                current_file_var_names.add(item_name)
+            elif item_code in current_file_var_codes and item_name in current_file_var_names:
+                pass
+            else:
+                continue
+
+        countryname, variablename, variablecode, year, value, unit = extract(row)
+
+        try:
+            year = int(year)
+            value = float(value)
+        except ValueError:
+            year = False
+            value = False
+
+        yield year, value, countryname, variablecode, variablename, unit
+
+
+# The bilateral files give every row a value for a variable of each
+# perspective, and a variable can have several values for the same country and
+# year, which are added up. The values are summed per (variable, country, year)
+# in one pass over the file, spilling to disk past the memory budget, see
+# external_aggregate.py.
+def sum_bilateral_rows(file_layout, rows):
+    code_and_unit_by_var_name = {}
+    with ExternalSum(memory_budget=args.aggregate_memory * 2**20) as value_sums:
+        for row in rows:
+            if file_layout.is_header(row):
+                continue
+            governor.tick()
+            for extract in file_layout.extractors:
+                countryname, variablename, variablecode, year, value, unit = extract(row)
+                code_and_unit_by_var_name[variablename] = (variablecode, unit)
+                try:
+                    year = int(year)
+                    value = float(value)
+                except ValueError:
+                    continue
+                value_sums.add((variablename, countryname, year), value)
+
+        for (variablename, countryname, year), value in value_sums.sorted_sums():
+            variablecode, variableunit = code_and_unit_by_var_name[variablename]
+            yield year, str(value), countryname, variablecode, variablename, variableunit
+
+
+# A task is (source, original_filename, is_update). The variable names are only
+# read for the files being updated, whose variables are replaced.
+def parse_dataset_file_lazily(task):
+    source, original_filename, is_update = task
+    var_names = read_var_names(source, original_filename) if is_update else None
+    is_bilateral, parsed_rows = parse_dataset_file(source, original_filename)
+    return var_names, is_bilateral, parsed_rows
+
+
+# Parses a file in a worker process. The rows are spilled to a file, which the
+# importing process reads back, so neither process holds them in memory.
+def parse_dataset_file_eagerly(task):
+    var_names, is_bilateral, parsed_rows = parse_dataset_file_lazily(task)
+    return var_names, is_bilateral, SpilledRows(parsed_rows, dir=spill_dir.name)
+
+
+def process_csv_file_update(source, original_filename: str, unique_var_names, is_bilateral: bool, parsed_rows):
     print('Processing: %s' % original_filename)
 
     global db
+    global var_ids_to_delete
+    global data_values_by_var_id
+    global var_ids_to_write
 
-    # we will now construct the list of all unique variable names found in one file
+    file_var_ids = [
+        row[0]
+        for row in db.fetch_many("""
+            SELECT id
+            FROM variables
+            JOIN datasets ON datasets.id = variables.datasetId
+            WHERE datasets.namespace = %(namespace)s
+            AND variables.name IN %(var_names)s
+        """, {
+            'namespace': DATASET_NAMESPACE,
+            'var_names': list(unique_var_names)
+        })
+    ]
+    var_ids_to_delete.update(file_var_ids)
 
-    unique_var_names = []
-    global var_ids_to_delete
+    # Only the variables whose data differs from their last import are
+    # written. A zip file changes as a whole even when most of the items in it
+    # are identical.
+    if args.sync:
 
-    with open(filename_to_process, encoding='latin-1') as currentfile:
-        currentreader = csv.DictReader(currentfile)
-        filecolumns = tuple(currentreader.fieldnames)
-
-        if any([starts_with(filecolumns, c) for c in column_types[0:5]]):
-            for row in currentreader:
-                if starts_with(filecolumns, column_types[0]):
-                    variablename = row['Item']
-                if starts_with(filecolumns, column_types[1]):
-                    variablename = '%s - %s' % (row['Item'], row['Element'])
-                if starts_with(filecolumns, column_types[2]):
-                    variablename = '%s - %s' % (row['Item'], row['Element'])
-                if starts_with(filecolumns, column_types[3]):
-                    variablename = '%s - %s' % (row['Item'], row['Element'])
-                if starts_with(filecolumns, column_types[4]):
-                    variablename = '%s - %s' % (row['Indicator'], row['Source'])
-
-                if original_filename == 'Emissions_Agriculture_Energy_E_All_Data_(Normalized).zip':
-                    variablename += ' - %s' % row['Unit']
-
-                if original_filename == 'Production_LivestockPrimary_E_All_Data_(Normalized).zip':
-                    variablename += ' - %s' % row['Unit']
-
-                if original_filename == 'Trade_LiveAnimals_E_All_Data_(Normalized).zip':
-                    variablename += ' - %s' % row['Unit']
-
-                variablename = file_dataset_names[original_filename] + ': ' + variablename
-                if variablename not in unique_var_names:
-                    unique_var_names.append(variablename)
-
-        if any([starts_with(filecolumns, c) for c in column_types[5:8]]):
-            if starts_with(filecolumns, column_types[5]):
-                iterations = [
-                    {
-                        'varname_format': '%s - Donors'
-                    },
-                    {
-                        'varname_format': '%s - Recipients'
-                    }]
-            if starts_with(filecolumns, column_types[6]):
-                iterations = [
-                    {
-                        'varname_format': '%s - %s - Reporters'
-                    },
-                    {
-                        'varname_format': '%s - %s - Partners'
-                    }]
-            if starts_with(filecolumns, column_types[7]):
-                iterations = [
-                    {
-                        'varname_format': '%s - %s - Donors'
-                    },
-                    {
-                        'varname_format': '%s - %s - Recipients'
-                    }]
-            for oneiteration in iterations:
-                currentfile.seek(0)
-                row_counter = 0
-                for row in currentreader:
-                    if row['Year'] == 'Year':
-                        continue
-                    row_counter += 1
-                    if row_counter % 300 == 0:
-                        time.sleep(0.001)  # this is done in order to not keep the CPU busy all the time
-                    if starts_with(filecolumns, column_types[5]):
-                        variablename = oneiteration['varname_format'] % row['Item']
-                    if starts_with(filecolumns, column_types[6]):
-                        variablename = oneiteration['varname_format'] % (row['Item'], row['Element'])
-                    if starts_with(filecolumns, column_types[7]):
-                        variablename = oneiteration['varname_format'] % (row['Item'], row['Purpose'])
-
-                    variablename = file_dataset_names[original_filename] + ': ' + variablename
-                    if variablename not in unique_var_names:
-                        unique_var_names.append(variablename)
-
-        var_ids_to_delete += [
-            row[0]
-            for row in db.fetch_many("""
-                SELECT id
-                FROM variables
-                JOIN datasets ON datasets.id = variables.datasetId
-                WHERE datasets.namespace = %(namespace)s
-                AND variables.name IN %(var_names)s
-            """, {
-                'namespace': DATASET_NAMESPACE,
-                'var_names': unique_var_names
-            })
-        ]
+        # Every variable is synced as a whole, so its values are collected
+        data_values_by_var_id = {var_id: [] for var_id in file_var_ids}
+        process_csv_file_insert(original_filename, is_bilateral, parsed_rows)
+
+        changed_var_ids = changed_variables(data_values_by_var_id)
 
+        entity_id_by_name = db.resolve_entities(
+            countryname
+            for var_id in changed_var_ids
+            for countryname, _, _ in data_values_by_var_id[var_id]
+        )
+
+        sync_totals = {'inserted': 0, 'updated': 0, 'deleted': 0, 'unchanged': 0}
+        for var_id in changed_var_ids:
+            sync_counts = db.sync_data_values(var_id, [
+                (entity_id_by_name[countryname], year, value)
+                for countryname, year, value in data_values_by_var_id[var_id]
+            ])
+            for key, count in sync_counts.items():
+                sync_totals[key] += count
+        print('Synced data_values: %(inserted)d inserted, %(updated)d updated, %(deleted)d deleted, %(unchanged)d unchanged.' % sync_totals)
+
+        data_values_by_var_id = None
+        return
+
+    # The file is read once to upsert and fingerprint its variables, and once
+    # more to write the data_values of the ones that changed, rather than
+    # holding all of its values in memory. The variable-country pairs of the
+    # file are only tracked after the last read, so that both reads keep the
+    # same rows.
+    var_ids_to_write = set()
+    file_vars_countries = process_csv_file_insert(original_filename, is_bilateral, parsed_rows, track_pairs=False)
+
+    changed_var_ids = changed_variables(list(dict.fromkeys(file_var_ids + list(file_fingerprints.keys()))))
+
+    if changed_var_ids:
         db.execute_until_empty("""
             DELETE FROM data_values
             WHERE variableId IN %s
             LIMIT 100000
-        """, [var_ids_to_delete])
-
-    process_csv_file_insert(filename_to_process, original_filename)
+        """, [changed_var_ids])
+        var_ids_to_write = set(changed_var_ids)
+        # the rows spilled by a worker process can be read again, the others are parsed again
+        if not isinstance(parsed_rows, SpilledRows):
+            _, parsed_rows = parse_dataset_file(source, original_filename)
+        process_csv_file_insert(original_filename, is_bilateral, parsed_rows, track_pairs=False)
+
+    unique_data_tracker.update(file_vars_countries)
+    var_ids_to_write = None
+
+
+# The variables of the file being updated whose data changed since their last import
+def changed_variables(var_ids):
+    changed_var_ids = [
+        var_id
+        for var_id in var_ids
+        if file_fingerprints.hexdigest(var_id) is None
+        or file_fingerprints.hexdigest(var_id) != previous_fingerprints.get(str(var_id))
+    ]
+    print('%d of %d variables have changed.' % (len(changed_var_ids), len(var_ids)))
+    return changed_var_ids
 
 
-def process_csv_file_insert(filename_to_process: str, original_filename: str):
+# Returns the variable-country pairs of the file, which are added to
+# unique_data_tracker unless `track_pairs` is False
+def process_csv_file_insert(original_filename: str, is_bilateral: bool, parsed_rows, track_pairs=True):
     print('Processing: %s' % original_filename)
 
     global unique_data_tracker
+    global file_fingerprints
     global db
 
-    current_file_vars_countries = set()  # keeps track of variables+countries we saw in the current file
-    current_file_var_codes = set()
-    current_file_var_names = set()
-    previous_row = tuple()
+    file_fingerprints = DataFingerprints()
 
     category_name = file_to_category_dict[original_filename]
 
@@ -584,7 +686,6 @@ def process_csv_file_insert(filename_to_process: str, original_filename: str):
             user_id=user_id
         )
 
-    insert_string = 'INSERT into data_values (value, year, entityId, variableId) VALUES (%s, %s, %s, %s)'  # this is used for constructing the query for mass inserting to the data_values table
     data_values_tuple_list = []
 
     # reading source information from a csv file in metadata_dir
@@ -631,221 +732,33 @@ def process_csv_file_insert(filename_to_process: str, original_filename: str):
         """, [DATASET_NAMESPACE])
     }
 
-    with open(filename_to_process, encoding='latin-1') as currentfile:
-        currentreader = csv.DictReader(currentfile)
-        filecolumns = tuple(currentreader.fieldnames)
-
-        # these column types are very similar
-        if any([starts_with(filecolumns, c) for c in column_types[0:5]]):
-            for row in currentreader:
-                if starts_with(filecolumns, column_types[0]):
-                    countryname = row['Area']
-                    variablename = row['Item']
-                    variablecode = row['Item Code']
-                if starts_with(filecolumns, column_types[1]):
-                    countryname = row['Country']
-                    variablename = '%s - %s' % (row['Item'], row['Element'])
-                    variablecode = '%s - %s' % (row['ItemCode'], row['ElementCode'])
-                if starts_with(filecolumns, column_types[2]):
-                    countryname = row['Area']
-                    variablename = '%s - %s' % (row['Item'], row['Element'])
-                    variablecode = '%s - %s' % (row['Item Code'], row['Element Code'])
-                if starts_with(filecolumns, column_types[3]):
-                    countryname = row['Country']
-                    variablename = '%s - %s' % (row['Item'], row['Element'])
-                    variablecode = '%s - %s' % (row['Item Code'], row['Element Code'])
-                if starts_with(filecolumns, column_types[4]):
-                    countryname = row['Country']
-                    variablename = '%s - %s' % (row['Indicator'], row['Source'])
-                    variablecode = '%s - %s' % (row['Indicator Code'], row['Source Code'])
-
-                if original_filename == 'Emissions_Agriculture_Energy_E_All_Data_(Normalized).zip':
-                    variablename += ' - %s' % row['Unit']
-
-                if original_filename == 'Production_LivestockPrimary_E_All_Data_(Normalized).zip':
-                    variablename += ' - %s' % row['Unit']
-
-                if original_filename == 'Trade_LiveAnimals_E_All_Data_(Normalized).zip':
-                    variablename += ' - %s' % row['Unit']
-
-                # avoiding duplicate rows
-                if original_filename == 'Inputs_Pesticides_Use_E_All_Data_(Normalized).zip':
-                    if row['Item Code'] not in current_file_var_codes and row['Item'] not in current_file_var_names:
-                        current_file_var_codes.add(row['Item Code'])
-                        current_file_var_names.add(row['Item'])
-                    elif row['Item Code'] in current_file_var_codes and row['Item'] in current_file_var_names:
-                        pass
-                    else:
-                        continue
-
-                # avoiding duplicate rows
-                if original_filename == 'FoodBalanceSheets_E_All_Data_(Normalized).csv':
-                    temp_row = [rowvalue for rowkey, rowvalue in row.items()]
-                    if tuple(temp_row) == previous_row:
-                        previous_row = tuple(temp_row)
-                        continue
-                    else:
-                        previous_row = tuple(temp_row)
-                    if row['Item Code'] not in current_file_var_codes and row['Item'] not in current_file_var_names:
-                        current_file_var_codes.add(row['Item Code'])
-                        current_file_var_names.add(row['Item'])
-                    elif row['Item Code'] in current_file_var_codes and row['Item'] in current_file_var_names:
-                        pass
-                    else:
-                        continue
-
-                try:
-                    year = int(row['Year'])
-                    value = float(row['Value'])
-                except ValueError:
-                    year = False
-                    value = False
-
-                variablename = file_dataset_names[original_filename] + ': ' + variablename
-
-                current_file_vars_countries.add(tuple([countryname, variablecode]))
-
-                process_one_row(year, value, countryname, variablecode, variablename, var_id_by_name,
-                                row['Unit'], source_id_by_name[category_name], dataset_id_by_name[dataset_name], variable_description, data_values_tuple_list)
-
-            unique_data_tracker.update(current_file_vars_countries)
-
-        # these are the files that require several iterations over all rows
-        if any([starts_with(filecolumns, c) for c in column_types[5:8]]):
-            if starts_with(filecolumns, column_types[5]):
-                iterations = [
-                    {
-                        'country_field': 'Donor Country',
-                        'varname_format': '%s - Donors'
-                    },
-                    {
-                        'country_field': 'Recipient Country',
-                        'varname_format': '%s - Recipients'
-                    }]
-            if starts_with(filecolumns, column_types[6]):
-                iterations = [
-                    {
-                        'country_field': 'Reporter Countries',
-                        'varname_format': '%s - %s - Reporters'
-                    },
-                    {
-                        'country_field': 'Partner Countries',
-                        'varname_format': '%s - %s - Partners'
-                    }]
-            if starts_with(filecolumns, column_types[7]):
-                iterations = [
-                    {
-                        'country_field': 'Donor',
-                        'varname_format': '%s - %s - Donors'
-                    },
-                    {
-                        'country_field': 'Recipient Country',
-                        'varname_format': '%s - %s - Recipients'
-                    }]
-            for oneiteration in iterations:
-                file_stream_holder = {}  # we will break down these files into smaller files
-                dict_writer_holder = {}
-                separate_files_names = {}  # we will keep the filenames in this dict
-                unique_vars = []
-                # first we collect all variable names
-                currentfile.seek(0)
-                row_counter = 0
-                for row in currentreader:
-                    if row['Year'] == 'Year':
-                        continue
-                    row_counter += 1
-                    if row_counter % 300 == 0:
-                        time.sleep(0.001)  # this is done in order to not keep the CPU busy all the time
-                    if starts_with(filecolumns, column_types[5]):
-                        variablename = oneiteration['varname_format'] % row['Item']
-                    if starts_with(filecolumns, column_types[6]):
-                        variablename = oneiteration['varname_format'] % (row['Item'], row['Element'])
-                    if starts_with(filecolumns, column_types[7]):
-                        variablename = oneiteration['varname_format'] % (row['Item'], row['Purpose'])
-                    if variablename not in unique_vars:
-                        unique_vars.append(variablename)
-                # then we break the dataset into files named after the variable names
-                for varname in unique_vars:
-                    separate_files_names[varname.replace('/', '+') + '.csv'] = varname
-                    file_stream_holder[varname] = open(os.path.join('/tmp', varname.replace('/', '+') + '.csv'),
-                                                       'w+', encoding='latin-1')
-                    dict_writer_holder[varname] = csv.DictWriter(file_stream_holder[varname],
-                                                                 fieldnames=['Country', 'Variable', 'Varcode', 'Year',
-                                                                             'Unit', 'Value'])
-                    dict_writer_holder[varname].writeheader()
-                # go back to the beginning of the file
-                currentfile.seek(0)
-                row_counter = 0
-                for row in currentreader:
-                    if row['Year'] == 'Year':
-                        continue
-                    row_counter += 1
-                    if row_counter % 300 == 0:
-                        time.sleep(0.001)  # this is done in order to not keep the CPU busy all the time
-                    if starts_with(filecolumns, column_types[5]):
-                        variablename = oneiteration['varname_format'] % row['Item']
-                        variablecode = row['Item Code']
-                        dict_writer_holder[variablename].writerow({'Country': row[oneiteration['country_field']], 'Variable': variablename,
-                                                                   'Varcode': variablecode, 'Unit': row['Unit'],
-                                                                   'Year': row['Year'], 'Value': row['Value']})
-                    if starts_with(filecolumns, column_types[6]):
-                        variablename = oneiteration['varname_format'] % (row['Item'], row['Element'])
-                        variablecode = '%s - %s' % (row['Item Code'], row['Element Code'])
-                        dict_writer_holder[variablename].writerow({'Country': row[oneiteration['country_field']], 'Variable': variablename,
-                                                                   'Varcode': variablecode, 'Unit': row['Unit'], 'Year': row['Year'],
-                                                                   'Value': row['Value']})
-                    if starts_with(filecolumns, column_types[7]):
-                        variablename = oneiteration['varname_format'] % (row['Item'], row['Purpose'])
-                        variablecode = '%s - %s' % (row['Item Code'], row['Purpose Code'])
-                        dict_writer_holder[variablename].writerow({'Country': row[oneiteration['country_field']], 'Variable': variablename,
-                                                                   'Varcode': variablecode, 'Unit': row['Unit'],
-                                                                   'Year': row['Year'], 'Value': row['Value']})
-                    if row_counter % 100000 == 0:
-                        for fileholder, actual_file in file_stream_holder.items():
-                            actual_file.flush()
-                            os.fsync(actual_file.fileno())
-                for fileholder, actual_file in file_stream_holder.items():
-                    actual_file.close()
-
-                # now parsing and importing each file individually
-
-                for each_separate_file, file_variable_name in separate_files_names.items():
-                    unique_records_holder = {}
-                    with open('/tmp/%s' % each_separate_file, encoding='latin-1') as separate_file:
-                        separate_file_reader = csv.DictReader(separate_file)
-                        row_counter = 0
-                        for row in separate_file_reader:
-                            row_counter += 1
-                            if row_counter % 300 == 0:
-                                time.sleep(0.001)  # this is done in order to not keep the CPU busy all the time
-                            countryname = row['Country']
-                            variablecode = row['Varcode']
-                            variableunit = row['Unit']
-                            year = row['Year']
-                            value = row['Value']
-
-                            try:
-                                year = int(year)
-                                value = float(value)
-                            except ValueError:
-                                year = False
-                                value = False
-                            if year is not False and value is not False:
-                                unique_record = tuple([countryname, year])
-                                if unique_record not in unique_records_holder:
-                                    unique_records_holder[unique_record] = value
-                                else:
-                                    unique_records_holder[unique_record] += value
-                    for key, value in unique_records_holder.items():
-                        variablename = file_dataset_names[original_filename] + ': ' + file_variable_name
-                        process_one_row(list(key)[1], str(value), list(key)[0], variablecode, variablename, var_id_by_name,
-                                        variableunit, source_id_by_name[category_name], dataset_id_by_name[dataset_name], variable_description, data_values_tuple_list)
-
-                    os.remove('/tmp/%s' % each_separate_file)
-
-        if len(data_values_tuple_list):  # insert any leftover data_values
-            with connection.cursor() as c:
-                c.executemany(insert_string, data_values_tuple_list)
+    current_file_vars_countries = set()  # keeps track of variables+countries we saw in the current file
+    for year, value, countryname, variablecode, variablename, unit in parsed_rows:
+        if not is_bilateral:
+            current_file_vars_countries.add((countryname, variablecode))
+        process_one_row(year, value, countryname, variablecode, variablename, var_id_by_name,
+                        unit, source_id_by_name[category_name], dataset_id_by_name[dataset_name], variable_description, data_values_tuple_list)
+    if track_pairs:
+        unique_data_tracker.update(current_file_vars_countries)
+
+    if len(data_values_tuple_list):  # insert any leftover data_values
+        insert_data_values(data_values_tuple_list)
+
+    return current_file_vars_countries
+
+
+def insert_data_values(data_values_tuple_list):
+    # the rows hold country names, which are resolved to entities for the whole batch at once
+    entity_id_by_name = db.resolve_entities(countryname for _, _, countryname, _ in data_values_tuple_list)
+    # The parallel writers only see the variables, entities and deletes that are committed
+    if pool is not None:
+        connection.commit()
+    load_stats = db.load_data_values((
+        (value, year, entity_id_by_name[countryname], var_id)
+        for value, year, countryname, var_id in data_values_tuple_list
+    ), pool=pool)
+    print('Loaded %(rows)d data_values in %(seconds).2fs (%(rows_per_second).0f rows/s) using %(method)s' % load_stats)
+    governor.wrote(load_stats['rows'])
 
 
 def process_one_row(year, value, countryname, variablecode, variablename, var_id_by_name,
@@ -857,15 +770,10 @@ def process_one_row(year, value, countryname, variablecode, variablename, var_id
     global db
 
     processed_values += 1
-    if processed_values % 300 == 0:
-        time.sleep(0.001)  # this is done in order to not keep the CPU busy all the time
-
-    insert_string = 'INSERT into data_values (value, year, entityId, variableId) VALUES (%s, %s, %s, %s)'  # this is used for constructing the query for mass inserting to the data_values table
+    governor.tick()
 
     if year is not False and value is not False:
         if tuple([countryname, variablecode]) not in unique_data_tracker:
-            entity_id = db.get_or_create_entity(countryname)
-
             # Daniel: I decided not to use variable codes any more because they
             # are not unique and cause conflicts. Previously, they were added
             # but then set to NULL if they conflicted with an existing variable.
@@ -881,30 +789,61 @@ def process_one_row(year, value, countryname, variablecode, variablename, var_id
                     dataset_id=dataset_id,
                     source_id=source_id
                 )
-                if var_id_by_name[variablename] in var_ids_to_delete:
-                    del var_ids_to_delete[var_ids_to_delete.index(var_id_by_name[variablename])]
+                var_ids_to_delete.discard(var_id_by_name[variablename])
+
+            file_fingerprints.add(var_id_by_name[variablename], countryname, int(year), str(value))
+
+            if data_values_by_var_id is not None:
+                data_values_by_var_id.setdefault(var_id_by_name[variablename], []).append(
+                    (countryname, int(year), str(value))
+                )
+                return
+
+            if var_ids_to_write is not None and var_id_by_name[variablename] not in var_ids_to_write:
+                return
 
             data_values_tuple_list.append(
-                (str(value), int(year), entity_id, var_id_by_name[variablename])
+                (str(value), int(year), countryname, var_id_by_name[variablename])
             )
-            if len(data_values_tuple_list) > 3000:  # insert when the length of the list goes over 3000
-                with connection.cursor() as c:
-                    c.executemany(insert_string, data_values_tuple_list)
+            if len(data_values_tuple_list) > 50000:  # insert when the length of the list goes over 50000
+                insert_data_values(data_values_tuple_list)
                 del data_values_tuple_list[:]
 
 
+# With --parse-workers, the files are parsed in forked processes, and only the
+# parsed rows are sent to this process, which does all the writing to the
+# database in the same order as a sequential run. A worker can parse a file
+# while this process writes the one before it. The rows go through spill
+# files in spill_dir, which is removed when the import ends.
+process_pool = None
+parse_dataset_file_for_import = parse_dataset_file_lazily
+if args.parse_workers > 1:
+    spill_dir = tempfile.TemporaryDirectory(prefix='faostat_')
+    process_pool = multiprocessing.get_context('fork').Pool(args.parse_workers)
+    parse_dataset_file_for_import = parse_dataset_file_eagerly
+
 with connection as c:
 
     global import_history_states
 
     db = DBUtils(c)
 
+    if args.instrument:
+        db.enable_instrumentation()
+
+    if not args.ignore_fingerprints:
+        previous_fingerprints = db.fetch_variable_fingerprints(DATASET_NAMESPACE)
+
+    # Every file is noted and committed once it is imported, so a rerun after a
+    # failure only processes the files that are new or changed since, and the
+    # most recent state of a file is the one that counts
     import_history_states = [
         json.loads(row[0])
         for row in db.fetch_many("""
             SELECT import_state
             FROM importer_importhistory
             WHERE import_type = %s
+            ORDER BY import_time ASC, id ASC
         """, DATASET_NAMESPACE)
     ]
 
@@ -915,6 +854,10 @@ with connection as c:
 
     parent_tag_id = db.upsert_parent_tag(PARENT_TAG_NAME)
 
+    # Existing tags, datasets and sources are looked up in the prefetched
+    # namespace, and get their metadata refreshed in bulk after every file
+    db.prefetch_namespace(DATASET_NAMESPACE)
+
     tag_id_by_name = {
         name: i
         for name, i in db.fetch_many("""
@@ -928,81 +871,71 @@ with connection as c:
 
     source_id_by_name = {}
 
-    unique_data_tracker = set()  # this set will keep track of variable-country combinations
+    unique_data_tracker = PairSet()  # this set will keep track of variable-country combinations, see utils.py
 
-    for eachfile in glob.glob(os.path.join(all_dataset_files_dir, "*.zip")):
+    dataset_files = []  # (path, source) of every file to import, in a fixed order
+    for eachfile in sorted(glob.glob(os.path.join(all_dataset_files_dir, "*.zip"))):
         if os.path.basename(eachfile) not in files_to_exclude:
-            file_extracted = 1
-            zip_ref = zipfile.ZipFile(eachfile, 'r')
-            csv_filename = zip_ref.namelist()[0]
+            source = (eachfile, member_names(eachfile)[0])
             try:
-                zip_ref.extractall("/tmp")
-            except:
-                file_extracted = 0
-                print("Could not extract file: %s" % eachfile)
-            zip_ref.close()
-
-            if file_extracted:
-                file_imported_before = False
-                for state in import_history_states:
-                    if state['file_name'] == os.path.basename(eachfile):
-                        file_imported_before = True
-                        imported_before_hash = state['file_hash']
-                if not file_imported_before:
-                    process_csv_file_insert("/tmp/%s" % csv_filename, os.path.basename(eachfile))
-                    os.remove("/tmp/%s" % csv_filename)
-                    db.note_import(
-                        import_type=DATASET_NAMESPACE,
-                        import_notes='Importing file %s' % os.path.basename(eachfile),
-                        import_state=json.dumps({
-                            'file_hash': file_checksum(eachfile),
-                            'file_name': os.path.basename(eachfile)
-                        })
-                    )
-                else:
-                    if imported_before_hash == file_checksum(eachfile):
-                        print('No updates available for file %s.' % os.path.basename(eachfile))
-                    else:
-                        process_csv_file_update("/tmp/%s" % csv_filename, os.path.basename(eachfile))
-                        os.remove("/tmp/%s" % csv_filename)
-                        db.note_import(
-                            import_type=DATASET_NAMESPACE,
-                            import_notes='Importing file %s' % os.path.basename(eachfile),
-                            import_state=json.dumps({
-                                'file_hash': file_checksum(eachfile),
-                                'file_name': os.path.basename(eachfile)
-                            })
-                        )
-
-    for eachfile in glob.glob(os.path.join(all_dataset_files_dir, "*.csv")):
-        if os.path.basename(eachfile) not in files_to_exclude:
-            file_imported_before = False
-            for state in import_history_states:
-                if state['file_name'] == os.path.basename(eachfile):
-                    file_imported_before = True
-                    imported_before_hash = state['file_hash']
-            if not file_imported_before:
-                process_csv_file_insert(eachfile, os.path.basename(eachfile))
-                db.note_import(
-                    import_type=DATASET_NAMESPACE,
-                    import_notes='Importing file %s' % os.path.basename(eachfile),
-                    import_state=json.dumps({
-                        'file_hash': file_checksum(eachfile),
-                        'file_name': os.path.basename(eachfile)
-                    })
-                )
+                read_header(source)
+            except DecompressionError as e:
+                print("Could not read file: %s (%s)" % (eachfile, e))
+                continue
+            dataset_files.append((eachfile, source))
+    for eachfile in sorted(glob.glob(os.path.join(all_dataset_files_dir, "*.csv"))):
+        if os.path.basename(eachfile) not in files_to_exclude and not is_extracted_copy(eachfile):
+            dataset_files.append((eachfile, eachfile))
+
+    tasks = []
+    file_hash_by_name = {}
+    for eachfile, source in dataset_files:
+        file_imported_before = False
+        for state in import_history_states:
+            # the files imported from hand-extracted .csv files are updated from their .zip files
+            if history_file_name(state['file_name']) == history_file_name(os.path.basename(eachfile)):
+                file_imported_before = True
+                imported_before_hash = state['file_hash']
+        file_hash_by_name[os.path.basename(eachfile)] = file_checksum(eachfile)
+        if not file_imported_before:
+            tasks.append((source, os.path.basename(eachfile), False))
+        elif imported_before_hash == file_hash_by_name[os.path.basename(eachfile)]:
+            print('No updates available for file %s.' % os.path.basename(eachfile))
+        else:
+            tasks.append((source, os.path.basename(eachfile), True))
+
+    for (source, original_filename, is_update), (var_names, is_bilateral, parsed_rows) in map_sources(parse_dataset_file_for_import, tasks, process_pool, 2 * args.parse_workers):
+        # With --bulk-load-mode, the unique and foreign key checks are turned
+        # off while the data_values of the file are loaded, and the loaded rows
+        # are checked before the file is committed
+        with db.bulk_load_mode(enabled=args.bulk_load_mode and not args.sync):
+            if is_update:
+                process_csv_file_update(source, original_filename, var_names, is_bilateral, parsed_rows)
             else:
-                if imported_before_hash == file_checksum(eachfile):
-                    print('No updates available for file %s.' % os.path.basename(eachfile))
-                else:
-                    process_csv_file_update(eachfile, os.path.basename(eachfile))
-                    db.note_import(
-                        import_type=DATASET_NAMESPACE,
-                        import_notes='Importing file %s' % os.path.basename(eachfile),
-                        import_state=json.dumps({
-                            'file_hash': file_checksum(eachfile),
-                            'file_name': os.path.basename(eachfile)
-                        })
-                    )
+                process_csv_file_insert(original_filename, is_bilateral, parsed_rows)
+        if isinstance(parsed_rows, SpilledRows):
+            parsed_rows.close()
+        db.apply_metadata_refreshes()
+        db.note_import(
+            import_type=DATASET_NAMESPACE,
+            import_notes='Importing file %s' % original_filename,
+            import_state=json.dumps({
+                'file_hash': file_hash_by_name[original_filename],
+                'file_name': original_filename,
+                'variable_fingerprints': file_fingerprints.hexdigests()
+            })
+        )
+        connection.commit()  # every file is committed separately, so a failure doesn't roll back the files before it
+
+if pool is not None:
+    pool.close()
+if process_pool is not None:
+    process_pool.close()
+    spill_dir.cleanup()
+
+if args.instrument:
+    print("Time spent per statement:\n%s" % db.format_statement_stats())
+
+governor.log_report()
 
 print("Script execution time: %s" % (datetime.now() - start_time))
@@ -0,0 +1,167 @@
+from operator import itemgetter
+
+# The column layouts of the FAOSTAT csv files. The header of every file starts
+# with the columns of one of them. A layout says which columns make up a
+# variable's name and code, and which column holds the country. The bilateral
+# layouts (donors and recipients, reporters and partners) give every row a
+# value for two variables, one for each of their country columns, so they have
+# two perspectives.
+# Adding a layout, or a rule for a file, is a matter of adding it here.
+LAYOUTS = [
+    # 11 columns
+    {
+        'columns': ("Area Code", "Area", "Item Code", "Item", "ISO Currency Code", "Currency", "Year Code", "Year", "Unit", "Value", "Flag"),
+        'name_columns': ("Item",),
+        'code_columns': ("Item Code",),
+        'perspectives': [{'country_column': "Area", 'name_format': '%s'}]
+    },
+    {
+        'columns': ("CountryCode", "Country", "ItemCode", "Item", "ElementGroup", "ElementCode", "Element", "Year", "Unit", "Value", "Flag"),
+        'name_columns': ("Item", "Element"),
+        'code_columns': ("ItemCode", "ElementCode"),
+        'perspectives': [{'country_column': "Country", 'name_format': '%s - %s'}]
+    },
+    {
+        'columns': ("Area Code", "Area", "Item Code", "Item", "Element Code", "Element", "Year Code", "Year", "Unit", "Value", "Flag"),
+        'name_columns': ("Item", "Element"),
+        'code_columns': ("Item Code", "Element Code"),
+        'perspectives': [{'country_column': "Area", 'name_format': '%s - %s'}]
+    },
+    {
+        'columns': ("Country Code", "Country", "Item Code", "Item", "Element Code", "Element", "Year Code", "Year", "Unit", "Value", "Flag"),
+        'name_columns': ("Item", "Element"),
+        'code_columns': ("Item Code", "Element Code"),
+        'perspectives': [{'country_column': "Country", 'name_format': '%s - %s'}]
+    },
+    {
+        'columns': ("Country Code", "Country", "Source Code", "Source", "Indicator Code", "Indicator", "Year Code", "Year", "Unit", "Value", "Flag"),
+        'name_columns': ("Indicator", "Source"),
+        'code_columns': ("Indicator Code", "Source Code"),
+        'perspectives': [{'country_column': "Country", 'name_format': '%s - %s'}]
+    },
+    {
+        'columns': ("Recipient Country Code", "Recipient Country", "Item Code", "Item", "Donor Country Code", "Donor Country", "Year Code", "Year", "Unit", "Value", "Flag"),
+        'name_columns': ("Item",),
+        'code_columns': ("Item Code",),
+        'perspectives': [
+            {'country_column': "Donor Country", 'name_format': '%s - Donors'},
+            {'country_column': "Recipient Country", 'name_format': '%s - Recipients'}
+        ]
+    },
+    # 13 columns
+    {
+        'columns': ("Reporter Country Code", "Reporter Countries", "Partner Country Code", "Partner Countries", "Item Code", "Item", "Element Code", "Element", "Year Code", "Year", "Unit", "Value", "Flag"),
+        'name_columns': ("Item", "Element"),
+        'code_columns': ("Item Code", "Element Code"),
+        'perspectives': [
+            {'country_column': "Reporter Countries", 'name_format': '%s - %s - Reporters'},
+            {'country_column': "Partner Countries", 'name_format': '%s - %s - Partners'}
+        ]
+    },
+    # 15 columns
+    {
+        'columns': ("Donor Code", "Donor", "Recipient Country Code", "Recipient Country", "Item Code", "Item", "Element Code", "Element", "Purpose Code", "Purpose", "Year Code", "Year", "Unit", "Value", "Flag"),
+        'name_columns': ("Item", "Purpose"),
+        'code_columns': ("Item Code", "Purpose Code"),
+        'perspectives': [
+            {'country_column': "Donor", 'name_format': '%s - %s - Donors'},
+            {'country_column': "Recipient Country", 'name_format': '%s - %s - Recipients'}
+        ]
+    }
+]
+
+# The rules for the files that need them:
+#   unit_in_name: the unit is added to the variable names, because items are
+#     measured in more than one unit
+#   skip_conflicting_items: rows whose item code was seen with another item
+#     name, or whose item name was seen with another item code, are skipped
+#   skip_repeated_rows: rows identical to the row before them are skipped
+FILE_RULES = {
+    "Emissions_Agriculture_Energy_E_All_Data_(Normalized).zip": {'unit_in_name': True},
+    "Production_LivestockPrimary_E_All_Data_(Normalized).zip": {'unit_in_name': True},
+    "Trade_LiveAnimals_E_All_Data_(Normalized).zip": {'unit_in_name': True},
+    "Inputs_Pesticides_Use_E_All_Data_(Normalized).zip": {'skip_conflicting_items': True},
+    "FoodBalanceSheets_E_All_Data_(Normalized).zip": {'skip_repeated_rows': True, 'skip_conflicting_items': True}
+}
+
+# FoodBalanceSheets and DetailedTradeMatrix used to be extracted by hand,
+# because zipfile can't read their Deflate64 members, and were imported and
+# noted in the import history under the names of the extracted .csv files.
+# Both names of these files stand for the same file in the import history.
+LEGACY_FILE_NAMES = {
+    "FoodBalanceSheets_E_All_Data_(Normalized).csv": "FoodBalanceSheets_E_All_Data_(Normalized).zip",
+    "Trade_DetailedTradeMatrix_E_All_Data_(Normalized).csv": "Trade_DetailedTradeMatrix_E_All_Data_(Normalized).zip"
+}
+
+def history_file_name(file_name):
+    return LEGACY_FILE_NAMES.get(file_name, file_name)
+
+DEFAULT_FILE_RULES = {
+    'unit_in_name': False,
+    'skip_conflicting_items': False,
+    'skip_repeated_rows': False
+}
+
+def find_layout(columns):
+    columns = tuple(columns)
+    for layout in LAYOUTS:
+        if columns[:len(layout['columns'])] == layout['columns']:
+            return layout
+    return None
+
+# The layout of one file, matched and compiled once from its header. The rows
+# are the lists csv.reader gives, and every perspective's extractor takes a row
+# to its (country, variable name, variable code, year, value, unit), with
+# the fields picked by index.
+class FileLayout:
+
+    def __init__(self, layout, header, original_filename, dataset_name):
+        self.layout = layout
+        self.rules = {**DEFAULT_FILE_RULES, **FILE_RULES.get(original_filename, {})}
+        self.is_bilateral = len(layout['perspectives']) > 1
+
+        index = {column: i for i, column in enumerate(header)}
+        self.year_index = index['Year']
+
+        # the item name and code pairs, for skip_conflicting_items
+        self.item_code_and_name = itemgetter(index['Item Code'], index['Item']) if self.rules['skip_conflicting_items'] else None
+
+        name_columns = list(layout['name_columns'])
+        name_suffix = ''
+        if self.rules['unit_in_name']:
+            name_columns.append('Unit')
+            name_suffix = ' - %s'
+
+        self.extractors = [
+            compile_extractor(
+                index=index,
+                country_column=perspective['country_column'],
+                name_format=dataset_name.replace('%', '%%') + ': ' + perspective['name_format'] + name_suffix,
+                name_columns=name_columns,
+                code_columns=layout['code_columns']
+            )
+            for perspective in layout['perspectives']
+        ]
+
+    # Some files repeat their header in the middle of the data
+    def is_header(self, row):
+        return row[self.year_index] == 'Year'
+
+def compile_layout(header, original_filename, dataset_name):
+    layout = find_layout(header)
+    if layout is None:
+        return None
+    return FileLayout(layout, header, original_filename, dataset_name)
+
+def compile_extractor(index, country_column, name_format, name_columns, code_columns):
+    country = itemgetter(index[country_column])
+    name_fields = itemgetter(*[index[column] for column in name_columns])
+    code_format = ' - '.join(['%s'] * len(code_columns))
+    code_fields = itemgetter(*[index[column] for column in code_columns])
+    year_value_unit = itemgetter(index['Year'], index['Value'], index['Unit'])
+
+    def extract(row):
+        year, value, unit = year_value_unit(row)
+        return country(row), name_format % name_fields(row), code_format % code_fields(row), year, value, unit
+
+    return extract
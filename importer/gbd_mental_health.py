@@ -61,10 +61,11 @@ CURRENT_PATH = os.path.dirname(os.path.realpath(__file__))
 #             wget http://s3.healthdata.org/gbd-api-2017-public/<hash of a file...>-$i.zip;
 #         done
 #
-# 4. Then, unzip them all and put them in a single folder. This should be the
-#    `csv_dir` specified below. Helpful command:
-#
-#         unzip \*.zip -x citation.txt -d csv/
+# 4. Then, put them all in a single folder. This should be the `csv_dir`
+#    specified below. There is no need to unzip them, the CSV files are read
+#    straight from the zip archives (CSV files that are already unzipped are
+#    read too). The archives are checksummed, and if none of them changed
+#    since the last import, the import is skipped.
 #
 
 def get_key(row):
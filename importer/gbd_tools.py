@@ -1,21 +1,29 @@
 import sys
 import os
 import json
+import hashlib
 import logging
 import unidecode
-import time
+import io
 import csv
 import glob
 import zipfile
+import operator
+import multiprocessing
+from contextlib import contextmanager
 
 # allow imports from parent directory
 sys.path.insert(1, os.path.join(sys.path[0], '..'))
 from db import connection
-from utils import extract_short_unit
+from db_pool import ConnectionPool
+from utils import extract_short_unit, file_checksum, parse_import_args, governor_from_args, DataFingerprints, map_sources
+from external_aggregate import SpilledPartitions
 from db_utils import DBUtils
 
 CURRENT_PATH = os.path.dirname(os.path.realpath(__file__))
 
+VARIABLES_PER_CHECKPOINT = 100  # with --sync, the data_values are committed after every this many variables
+
 def get_standard_name(entity_name):
     if entity_name == 'Global':
         return 'World'
@@ -24,12 +32,145 @@ def get_standard_name(entity_name):
     else:
         return entity_name
 
-def get_metric_value(row):
-    if row['metric_name'] == 'Percent':
-        return str(float(row['val']) * 100)
+# The filters and callbacks of the import in progress. They are kept in a
+# module global so that the parser processes, which are forked from the
+# importer, inherit them instead of having them pickled.
+parse_options = None
+governor = None
+
+# A CSV source is either the path of a CSV file, or an (archive path, member
+# name) pair for a CSV inside a zip archive. Archives are read without being
+# extracted, so that the GBD downloads don't need to be unzipped first. The
+# sources are plain strings and tuples so that they can be sent to the parser
+# processes.
+def find_csv_sources(csv_dir):
+    sources = sorted(glob.glob(os.path.join(csv_dir, '*.csv')))
+    for archive in sorted(glob.glob(os.path.join(csv_dir, '*.zip'))):
+        with zipfile.ZipFile(archive) as z:
+            for member in z.namelist():
+                # skips citation.txt
+                if member.lower().endswith('.csv'):
+                    sources.append((archive, member))
+    return sources
+
+# The file a CSV source is read from
+def get_source_path(source):
+    return source[0] if isinstance(source, tuple) else source
+
+# Names a CSV source in the logs and in the checkpoints
+def get_source_name(source):
+    if isinstance(source, tuple):
+        return '%s/%s' % (os.path.basename(source[0]), source[1])
+    return os.path.basename(source)
+
+@contextmanager
+def open_csv_source(source):
+    if isinstance(source, tuple):
+        archive, member = source
+        with zipfile.ZipFile(archive) as z, z.open(member) as raw:
+            yield io.TextIOWrapper(raw, encoding='utf8', newline='')
     else:
-        return row['val']
-
+        with open(source, 'r', encoding='utf8', newline='') as f:
+            yield f
+
+# The columns that vary within a variable
+LOCATION_COLUMNS = ('location_id', 'location_name')
+
+# Yields a (value, year, entity_name, var_code) tuple for every row of a CSV
+# file that we want to import. The key, variable name and unit of a var_code
+# are added to var_meta before its first row is yielded.
+#
+# Most rows of a GBD export are discarded, so the rows are not turned into
+# dicts. GBD exports have an `*_id` column for every `*_name` column, and the
+# name is always the same for a given ID. So the filter and the get_*
+# callbacks only run for the first row of every combination of the IDs that
+# identify a variable (e.g. measure, cause, sex, age and metric), and their
+# result is looked up by the tuple of those IDs for every other row. Entity
+# names are cached per location the same way.
+def parse_csv_file(source, var_meta):
+    with open_csv_source(source) as f:
+        reader = csv.reader(f)
+        header = next(reader)
+        position = {column: i for i, column in enumerate(header)}
+
+        dimension_positions = [
+            i for i, column in enumerate(header)
+            if column.endswith('_id') and column not in LOCATION_COLUMNS
+        ]
+        if not dimension_positions:
+            # Exports without IDs are filtered by name instead
+            dimension_positions = [
+                i for i, column in enumerate(header)
+                if column.endswith('_name') and column not in LOCATION_COLUMNS
+            ]
+        get_dimensions = operator.itemgetter(*dimension_positions)
+        location_position = position.get('location_id', position['location_name'])
+        location_name_position = position['location_name']
+        year_position = position['year']
+        value_position = position['val']
+
+        variable_by_dimensions = {}
+        entity_name_by_location = {}
+
+        for row in reader:
+            governor.tick()
+
+            dimensions = get_dimensions(row)
+            try:
+                variable = variable_by_dimensions[dimensions]
+            except KeyError:
+                variable = variable_by_dimensions[dimensions] = parse_variable(dict(zip(header, row)), var_meta)
+
+            # Skip rows we don't want to import
+            if variable is None:
+                continue
+
+            var_code, is_percent = variable
+
+            location = row[location_position]
+            try:
+                entity_name = entity_name_by_location[location]
+            except KeyError:
+                entity_name = entity_name_by_location[location] = get_standard_name(row[location_name_position])
+
+            value = row[value_position]
+            if is_percent:
+                value = str(float(value) * 100)
+
+            yield (value, int(row[year_position]), entity_name, var_code)
+
+# Returns the var_code of a row and whether its values are percentages, or
+# None if we don't import it
+def parse_variable(row, var_meta):
+    options = parse_options
+
+    if row['sex_name'] not in options['sex_names'] \
+        or row['age_name'] not in options['age_names'] \
+        or row['metric_name'] not in options['metric_names'] \
+        or row['measure_name'] not in options['measure_names']:
+        return None
+
+    var_code = options['get_var_code'](row)
+
+    if var_code not in var_meta:
+        var_meta[var_code] = (options['get_key'](row), options['get_var_name'](row), row['metric_name'])
+
+    return var_code, row['metric_name'] == 'Percent'
+
+def parse_csv_file_lazily(source):
+    var_meta = {}
+    return parse_csv_file(source, var_meta), var_meta
+
+# Runs in a parser process, the compact tuples are cheap to send back
+def parse_csv_file_eagerly(source):
+    var_meta = {}
+    return list(parse_csv_file(source, var_meta)), var_meta
+
+def fingerprint_csv_file(source):
+    fingerprints = DataFingerprints()
+    for value, year, entity_name, var_code in parse_csv_file(source, {}):
+        fingerprints.add(var_code, entity_name, year, value)
+    return fingerprints
 
 def import_csv_files(measure_names,
                      age_names,
@@ -51,19 +192,101 @@ def import_csv_files(measure_names,
 
     logger = logging.getLogger('importer')
 
+    args = parse_import_args()
+
+    # Forked parser processes pace themselves with a copy of it
+    global governor
+    governor = governor_from_args(args)
+
+    pool = ConnectionPool(args.workers) if args.workers > 1 else None
+
+    # With --sync, the data_values are spilled to a file per batch of
+    # variables, and only the differences to the database are written, a
+    # batch at a time, once all the files are read
+    spilled_data_values = SpilledPartitions()
+
+    global parse_options
+    parse_options = {
+        'measure_names': set(measure_names),
+        'age_names': set(age_names),
+        'metric_names': set(metric_names),
+        'sex_names': set(sex_names),
+        'get_key': get_key,
+        'get_var_name': get_var_name,
+        'get_var_code': get_var_code
+    }
+
+    # With --parse-workers, the CSV files are parsed and filtered in forked
+    # processes, and only the rows we import are sent to this process, which
+    # does all the writing to the database in the same order as before
+    process_pool = None
+    parse_csv_file_for_import = parse_csv_file_lazily
+    if args.parse_workers > 1:
+        process_pool = multiprocessing.get_context('fork').Pool(args.parse_workers)
+        parse_csv_file_for_import = parse_csv_file_eagerly
+
     try:
 
         with connection as c:
 
             db = DBUtils(c)
 
+            if args.instrument:
+                db.enable_instrumentation()
+
+            csv_sources = find_csv_sources(csv_dir)
+
+            # The checksums of the archives (and of any loose CSV files) are
+            # recorded with every import, together with the filters. If none of
+            # them changed since the last import, there is nothing to import.
+            # Use --ignore-fingerprints to import anyway, e.g. after changing
+            # how the variables are named.
+            input_checksums = {}
+            for source in csv_sources:
+                path = get_source_path(source)
+                if os.path.basename(path) not in input_checksums:
+                    input_checksums[os.path.basename(path)] = file_checksum(path)
+            parse_filters = {
+                name: sorted(parse_options[name])
+                for name in ('measure_names', 'age_names', 'metric_names', 'sex_names')
+            }
+
+            if not args.sync and not args.ignore_fingerprints:
+                last_state = db.fetch_last_import_state(namespace)
+                if last_state is not None \
+                    and last_state.get('input_checksums') == input_checksums \
+                    and last_state.get('parse_filters') == parse_filters:
+                    print('Skipping the import: no archive changed since the last import')
+                    logger.info('Skipping the import: no archive changed since the last import')
+                    return
+
             total_data_values_upserted = 0
 
+            batch_index_by_var_code = {}
+            sync_totals = {'inserted': 0, 'updated': 0, 'deleted': 0, 'unchanged': 0}
+
             def get_state():
-                return {
+                state = {
                     **db.get_counts(),
                     'data_values_upserted': total_data_values_upserted,
                 }
+                if args.sync:
+                    state.update(('data_values_' + key, count) for key, count in sync_totals.items())
+                state['throttle'] = governor.report()
+                state['variables_unchanged'] = len(unchanged_var_codes)
+                state['variable_fingerprints'] = variable_fingerprints()
+                state['input_checksums'] = input_checksums
+                state['parse_filters'] = parse_filters
+                return state
+
+            # The fingerprints are stored by variable ID, as in the WDI and
+            # FAOSTAT imports, which stays the same when a variable is renamed
+            def variable_fingerprints():
+                return {
+                    str(var_id_by_code[var_code]): fingerprint
+                    for var_code, fingerprint in fingerprints.hexdigests().items()
+                    if var_code in var_id_by_code
+                }
 
             def log_state():
                 message = " · ".join(str(key) + ": " + str(value) for key, value in get_state().items())
@@ -78,6 +301,11 @@ def import_csv_files(measure_names,
             # Create the parent tag
             parent_tag_id = db.upsert_parent_tag(parent_tag_name)
 
+            # Existing datasets and sources are looked up in the prefetched
+            # namespace, and only get their metadata (e.g. `retrievedDate`)
+            # refreshed in bulk when the pending metadata is upserted
+            db.prefetch_namespace(namespace)
+
             tag_id_by_name = {
                 name: i
                 for name, i in db.fetch_many("""
@@ -87,19 +315,9 @@ def import_csv_files(measure_names,
                 """, parent_tag_id)
             }
 
-            # Intentionally kept empty in order to force sources to be updated (in order
-            # to update `retrievedDate`)
             dataset_id_by_name = {}
 
-            var_id_by_code = {
-                code: i
-                for code, i in db.fetch_many("""
-                    SELECT variables.code, variables.id
-                    FROM variables
-                    LEFT JOIN datasets ON datasets.id = variables.datasetId
-                    WHERE datasets.namespace = %s
-                """, [namespace])
-            }
+            var_id_by_code = dict(db.variable_id_by_code)
 
             # Keep track of variables that we have changed the `updatedAt` column for
             touched_var_codes = set()
@@ -107,116 +325,251 @@ def import_csv_files(measure_names,
             # Keep track of which variables have had their data_values removed
             cleared_var_codes = set()
 
-            # Intentionally kept empty in order to force sources to be updated (in order
-            # to update `retrievedDate`)
+            # Keep track of which variables have had their data_values synced
+            synced_var_codes = set()
+
+            # Every CSV file is committed separately, or with --sync, every
+            # batch of variables. With --resume, the files that the last,
+            # interrupted run committed are skipped, and the variables it
+            # touched and cleared are not touched or cleared again. With
+            # --sync, the variables it synced from the same archives are
+            # skipped.
+            sync_input_hash = hashlib.md5(json.dumps([input_checksums, parse_filters], sort_keys=True).encode()).hexdigest()
+            run, checkpoints = db.begin_run(namespace, args.resume)
+            completed_file_hashes = {}
+            for checkpoint in checkpoints:
+                completed_file_hashes[checkpoint['checkpoint']] = checkpoint['input_hash']
+                touched_var_codes.update(checkpoint['touched_var_codes'])
+                cleared_var_codes.update(checkpoint['cleared_var_codes'])
+                if args.sync and checkpoint['input_hash'] == sync_input_hash:
+                    synced_var_codes.update(checkpoint.get('synced_var_codes', []))
+
             source_id_by_name = {}
 
+            # Sources and variables are upserted in bulk whenever the pending
+            # data_values are written, rather than one at a time as they appear
+            sources_to_upsert = {}
+            variables_to_upsert = {}
+            var_codes_to_touch = set()
+            var_codes_to_clear = set()
+
             data_values_to_insert = []
-            insert_data_value_sql = """
-                INSERT INTO data_values
-                    (value, year, entityId, variableId)
-                VALUES
-                    (%s, %s, %s, %s)
-                ON DUPLICATE KEY UPDATE
-                    value = VALUES(value)
-            """
-            # We need an ON DUPLICATE handler here because the GBD dataset has
-            # South Asia under two codes: 158 and 159. Both have the same values
-            # in our extract, so we can safely ignore overwrites.
-
-            for filename in glob.glob(os.path.join(csv_dir, '*.csv')):
-                with open(filename, 'r', encoding='utf8') as f:
-                    print('Processing: %s' % filename)
-                    logger.info('Processing: %s' % filename)
-                    reader = csv.DictReader(f)
-                    row_number = 0
-                    for row in reader:
-                        row_number += 1
-
-                        if row_number % 100 == 0:
-                            time.sleep(0.001)  # this is done in order to not keep the CPU busy all the time, the delay after each 100th row is 1 millisecond
-
-                        key = get_key(row)
-
-                        # Skip rows we don't want to import
-                        if row['sex_name'] not in sex_names \
-                            or row['age_name'] not in age_names \
-                            or row['metric_name'] not in metric_names \
-                            or row['measure_name'] not in measure_names:
-                            continue
-
-                        if key not in tag_id_by_name:
-                            tag_id_by_name[key] = db.upsert_tag(key, parent_tag_id)
-
-                        if key not in dataset_id_by_name:
-                            dataset_id_by_name[key] = db.upsert_dataset(
-                                name=key,
-                                namespace=namespace,
-                                tag_id=tag_id_by_name[key],
-                                user_id=user_id
-                            )
 
-                        if key not in source_id_by_name:
-                            source_id_by_name[key] = db.upsert_source(
-                                name=key,
-                                description=json.dumps(default_source_description),
-                                dataset_id=dataset_id_by_name[key]
-                            )
+            def upsert_pending_metadata():
+                db.apply_metadata_refreshes()
+
+                if sources_to_upsert:
+                    keys = list(sources_to_upsert.keys())
+                    source_ids = db.upsert_sources_many(namespace, list(sources_to_upsert.values()))
+                    source_id_by_name.update(zip(keys, source_ids))
+                    sources_to_upsert.clear()
+
+                if variables_to_upsert:
+                    var_codes = list(variables_to_upsert.keys())
+                    var_ids = db.upsert_variables_many(namespace, [
+                        {**var, 'source_id': source_id_by_name[var['source_id']]}
+                        for var in variables_to_upsert.values()
+                    ])
+                    var_id_by_code.update(zip(var_codes, var_ids))
+                    variables_to_upsert.clear()
+
+                if var_codes_to_touch:
+                    db.touch_variables([var_id_by_code[code] for code in var_codes_to_touch])
+                    var_codes_to_touch.clear()
+
+                if var_codes_to_clear:
+                    db.execute_until_empty("""
+                        DELETE FROM data_values
+                        WHERE data_values.variableId IN %s
+                        LIMIT 100000
+                    """, [[var_id_by_code[code] for code in var_codes_to_clear]])
+                    var_codes_to_clear.clear()
+
+            def insert_data_values(data_values):
+                upsert_pending_metadata()
+                # Entities are resolved for the whole batch at once, so that new
+                # entities cost one INSERT per batch rather than one per name
+                entity_id_by_name = db.resolve_entities(
+                    entity_name for _, _, entity_name, _ in data_values
+                )
+                # The parallel writers only see the metadata, entities and
+                # deletes that are committed
+                if pool is not None:
+                    connection.commit()
+                # We need to replace duplicates here because the GBD dataset has
+                # South Asia under two codes: 158 and 159. Both have the same values
+                # in our extract, so we can safely ignore overwrites.
+                load_stats = db.load_data_values((
+                    (value, year, entity_id_by_name[entity_name], var_id_by_code[var_code])
+                    for value, year, entity_name, var_code in data_values
+                ), replace=True, pool=pool)
+                logger.info('Loaded %(rows)d data_values in %(seconds).2fs (%(rows_per_second).0f rows/s) using %(method)s' % load_stats)
+                governor.wrote(load_stats['rows'])
+
+            # Variables whose data has not changed since the last import are
+            # skipped entirely. A variable's rows can be spread over several
+            # files (and archives), so the fingerprints need to be complete before we start
+            # deleting anything (or skipping files on resume), which takes an
+            # extra pass over the files.
+            fingerprints = DataFingerprints()
+            unchanged_var_codes = set()
+            previous_fingerprints = {} if args.ignore_fingerprints else db.fetch_variable_fingerprints(namespace)
+            fingerprint_first = bool(previous_fingerprints or completed_file_hashes)
+
+            if fingerprint_first:
+                for source, file_fingerprints in map_sources(fingerprint_csv_file, csv_sources, process_pool, 2 * args.parse_workers):
+                    print('Fingerprinted: %s' % get_source_name(source))
+                    logger.info('Fingerprinted: %s' % get_source_name(source))
+                    fingerprints.update(file_fingerprints)
+                unchanged_var_codes = {
+                    var_code
+                    for var_code, fingerprint in fingerprints.hexdigests().items()
+                    if var_code in var_id_by_code and previous_fingerprints.get(str(var_id_by_code[var_code])) == fingerprint
+                }
+                logger.info('%d variables are unchanged since the last import' % len(unchanged_var_codes))
+
+            # The CSVs in an archive share the checksum of the archive
+            file_hash_by_source = {}
+            for source in csv_sources:
+                file_hash = input_checksums[os.path.basename(get_source_path(source))] if not args.sync else None
+                if file_hash is not None and completed_file_hashes.get(get_source_name(source)) == file_hash:
+                    print('Skipping: %s (committed by the interrupted run)' % get_source_name(source))
+                    logger.info('Skipping: %s (committed by the interrupted run)' % get_source_name(source))
+                    continue
+                file_hash_by_source[source] = file_hash
+
+            for source, (file_data_values, var_meta) in map_sources(parse_csv_file_for_import, list(file_hash_by_source), process_pool, 2 * args.parse_workers):
+                file_hash = file_hash_by_source[source]
+                print('Processing: %s' % get_source_name(source))
+                logger.info('Processing: %s' % get_source_name(source))
+                for value, year, entity_name, var_code in file_data_values:
+                    key, var_name, unit = var_meta[var_code]
+
+                    if key not in tag_id_by_name:
+                        tag_id_by_name[key] = db.upsert_tag(key, parent_tag_id)
+
+                    if key not in dataset_id_by_name:
+                        dataset_id_by_name[key] = db.upsert_dataset(
+                            name=key,
+                            namespace=namespace,
+                            tag_id=tag_id_by_name[key],
+                            user_id=user_id
+                        )
 
-                        var_name = get_var_name(row)
+                    if key not in source_id_by_name and key not in sources_to_upsert:
+                        sources_to_upsert[key] = {
+                            'name': key,
+                            'description': json.dumps(default_source_description),
+                            'dataset_id': dataset_id_by_name[key]
+                        }
+
+                    if var_code not in var_id_by_code:
+                        if var_code not in variables_to_upsert:
+                            variables_to_upsert[var_code] = {
+                                'name': var_name,
+                                'code': var_code,
+                                'unit': unit,
+                                'short_unit': extract_short_unit(unit),
+                                'dataset_id': dataset_id_by_name[key],
+                                # resolved to the source ID once the source is upserted
+                                'source_id': key
+                            }
+                        touched_var_codes.add(var_code)
+                    elif var_code in unchanged_var_codes:
+                        continue
+                    elif var_code not in touched_var_codes:
+                        var_codes_to_touch.add(var_code)
+                        touched_var_codes.add(var_code)
+
+                    if not fingerprint_first:
+                        fingerprints.add(var_code, entity_name, year, value)
+
+                    if args.sync:
+                        if var_code not in synced_var_codes:
+                            if var_code not in batch_index_by_var_code:
+                                batch_index_by_var_code[var_code] = len(batch_index_by_var_code) // VARIABLES_PER_CHECKPOINT
+                            spilled_data_values.add(
+                                batch_index_by_var_code[var_code],
+                                (entity_name, year, value, var_code)
+                            )
+                        continue
 
-                        var_code = get_var_code(row)
+                    if var_code not in cleared_var_codes:
+                        var_codes_to_clear.add(var_code)
+                        cleared_var_codes.add(var_code)
 
-                        if var_code not in var_id_by_code:
-                            var_id_by_code[var_code] = db.upsert_variable(
-                                name=var_name,
-                                code=var_code,
-                                unit=row['metric_name'],
-                                short_unit=extract_short_unit(row['metric_name']),
-                                dataset_id=dataset_id_by_name[key],
-                                source_id=source_id_by_name[key]
-                            )
-                            touched_var_codes.add(var_code)
-                        elif var_code not in touched_var_codes:
-                            db.touch_variable(var_id_by_code[var_code])
-                            touched_var_codes.add(var_code)
-
-                        var_id = var_id_by_code[var_code]
-                        entity_name = get_standard_name(row['location_name'])
-                        entity_id = db.get_or_create_entity(entity_name)
-                        value = get_metric_value(row)
-                        year = int(row['year'])
-
-                        if var_code not in cleared_var_codes:
-                            db.execute_until_empty("""
-                                DELETE FROM data_values
-                                WHERE data_values.variableId = %s
-                                LIMIT 100000
-                            """, [var_id])
-                            cleared_var_codes.add(var_code)
-
-                        data_values_to_insert.append(
-                            (value, year, entity_id, var_id)
-                        )
+                    data_values_to_insert.append(
+                        (value, year, entity_name, var_code)
+                    )
 
-                        if len(data_values_to_insert) >= 50000:
-                            db.upsert_many(insert_data_value_sql, data_values_to_insert)
-                            total_data_values_upserted += len(data_values_to_insert)
-                            data_values_to_insert = []
-                            log_state()
+                    if len(data_values_to_insert) >= 50000:
+                        insert_data_values(data_values_to_insert)
+                        total_data_values_upserted += len(data_values_to_insert)
+                        data_values_to_insert = []
+                        log_state()
 
                 if len(data_values_to_insert): # insert any leftover data_values
-                    db.upsert_many(insert_data_value_sql, data_values_to_insert)
+                    insert_data_values(data_values_to_insert)
                     total_data_values_upserted += len(data_values_to_insert)
                     data_values_to_insert = []
                     log_state()
 
+                if not args.sync:
+                    upsert_pending_metadata()
+                    db.checkpoint(
+                        namespace, run, get_source_name(source), file_hash,
+                        touched_var_codes=sorted(touched_var_codes),
+                        cleared_var_codes=sorted(cleared_var_codes)
+                    )
+
+            if args.sync:
+                upsert_pending_metadata()
+                batch_indexes = spilled_data_values.partitions()
+                for batch_index in batch_indexes:
+                    data_values_by_var_code = {}
+                    for entity_name, year, value, var_code in spilled_data_values.read(batch_index):
+                        data_values_by_var_code.setdefault(var_code, []).append(
+                            (entity_name, year, value)
+                        )
+                    entity_id_by_name = db.resolve_entities(
+                        entity_name
+                        for data_values in data_values_by_var_code.values()
+                        for entity_name, _, _ in data_values
+                    )
+                    for var_code, data_values in data_values_by_var_code.items():
+                        sync_counts = db.sync_data_values(var_id_by_code[var_code], [
+                            (entity_id_by_name[entity_name], year, value)
+                            for entity_name, year, value in data_values
+                        ])
+                        for key, count in sync_counts.items():
+                            sync_totals[key] += count
+                    synced_var_codes.update(data_values_by_var_code)
+                    db.checkpoint(
+                        namespace, run, 'variables batch %d of %d' % (batch_index + 1, len(batch_indexes)), sync_input_hash,
+                        touched_var_codes=sorted(touched_var_codes),
+                        cleared_var_codes=sorted(cleared_var_codes),
+                        synced_var_codes=sorted(synced_var_codes)
+                    )
+                    log_state()
+
             db.note_import(
                 import_type=namespace,
                 import_notes='A gbd import was performed',
                 import_state=json.dumps(get_state())
             )
 
+            if args.instrument:
+                logger.info('Time spent per statement:\n%s' % db.format_statement_stats())
+
+            governor.log_report()
+
     except:
         logger.exception("error")
         raise
+
+    finally:
+        spilled_data_values.close()
+        if pool is not None:
+            pool.close()
+        if process_pool is not None:
+            process_pool.terminate()
@@ -0,0 +1,55 @@
+import os
+import sys
+import time
+import resource
+import subprocess
+
+sys.path.insert(1, os.path.join(sys.path[0], '..'))
+from utils import PairSet
+
+# Measures the peak RSS of FAOSTAT's tracker of (country, variable code)
+# pairs, as a set of tuples and as a PairSet, on synthetic FAOSTAT-sized data:
+# every area is paired with every other code, and the strings are created
+# afresh for every pair, as csv.reader creates them for every row. Every
+# structure is measured in a process of its own:
+#
+#     python pair_set_benchmark.py [areas] [codes]
+#     python pair_set_benchmark.py tuples|pairset [areas] [codes]
+#
+# A full FAOSTAT run also needs the database, so it is not measured here.
+
+STRUCTURES = {
+    'tuples': set,
+    'pairset': PairSet
+}
+
+def pairs(areas, codes):
+    for code in range(0, codes, 2):
+        for area in range(areas):
+            yield ('Area %d' % area, '%d - %d' % (code // 1000, code % 1000))
+
+def measure(structure, areas, codes):
+    tracker = STRUCTURES[structure]()
+    start_time = time.time()
+    for pair in pairs(areas, codes):
+        if pair not in tracker:
+            tracker.add(pair)
+    seconds = time.time() - start_time
+    # in kilobytes on Linux
+    peak_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print('%-8s %d pairs: peak RSS %.0f MB, %.1fs' % (structure, len(tracker), peak_mb, seconds))
+
+if __name__ == '__main__':
+    if sys.argv[1:2] and sys.argv[1] in STRUCTURES:
+        structure, sizes = sys.argv[1], sys.argv[2:]
+    else:
+        structure, sizes = None, sys.argv[1:]
+    areas, codes = [int(size) for size in sizes] or [280, 60000]
+
+    if structure is not None:
+        measure(structure, areas, codes)
+    else:
+        # the baseline of the interpreter and this module
+        print('baseline peak RSS %.0f MB' % (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024))
+        for structure in STRUCTURES:
+            subprocess.check_call([sys.executable, __file__, structure, str(areas), str(codes)])
@@ -4,40 +4,28 @@ import hashlib
 import csv
 import json
 import logging
-import requests
-import shutil
 import zipfile
-import time
 from datetime import datetime
-from openpyxl import load_workbook
 
 # allow imports from parent directory
 sys.path.insert(1, os.path.join(sys.path[0], '..'))
 from db import connection
-from utils import file_checksum, extract_short_unit, get_row_values, starts_with, default, yesno, strlist
-from db_utils import normalise_country_name
+from db_pool import ConnectionPool
+from download_cache import DownloadCache, DownloadError
+from utils import file_checksum, get_row_values, starts_with, yesno, strlist, parse_import_args, DataFingerprints
+from reshape import ROWS, COLUMNS, blocks, value_block, wide_to_long
+from external_aggregate import SpilledPartitions
+from db_utils import DBUtils, normalise_country_name
+from wdi_tables import FIRST_YEAR, EXCEL_ZIP_FILE_URL, CSV_ZIP_FILE_URL, SERIES_EXPECTED_HEADERS, DATA_EXPECTED_HEADERS, COUNTRY_EXPECTED_HEADERS, \
+    dataset_name_from_category, normalise_indicator_code, open_excel_tables, open_csv_tables, read_indicators, read_country_name_by_code
 
 DATASET_NAMESPACE = 'wdi'
 PARENT_TAG_NAME = 'World Development Indicators'  # set the name of the root category of all data that will be imported by this script
-ZIP_FILE_URL = 'http://databank.worldbank.org/data/download/WDI_excel.zip'
-FIRST_YEAR = 1960
+VARIABLES_PER_CHECKPOINT = 100  # the data_values are committed after every this many variables
 
 CURRENT_PATH = os.path.dirname(os.path.realpath(__file__))
 DOWNLOADS_PATH = os.path.join(CURRENT_PATH, '..', 'data', 'wdi')
 
-DEFAULT_SOURCE_DESCRIPTION = {
-    'dataPublishedBy': 'World Bank – World Development Indicators',
-    'link': 'http://data.worldbank.org/data-catalog/world-development-indicators',
-    'retrievedDate': time.strftime('%d-%B-%y')
-}
-
-# The column headers we expect the sheets to have.
-# We will only check that the headers begin with the columns listed here, if
-# there are additional columns, that's fine and it shouldn't affect our script.
-SERIES_EXPECTED_HEADERS = ('Series Code', 'Topic', 'Indicator Name', 'Short definition', 'Long definition', 'Unit of measure', 'Periodicity', 'Base Period', 'Other notes', 'Aggregation method', 'Limitations and exceptions', 'Notes from original source', 'General comments', 'Source', 'Statistical concept and methodology', 'Development relevance', 'Related source links', 'Other web links', 'Related indicators', 'License Type')
-DATA_EXPECTED_HEADERS = ('Country Name', 'Country Code', 'Indicator Name', 'Indicator Code', str(FIRST_YEAR))
-COUNTRY_EXPECTED_HEADERS = ('Country Code', 'Short Name', 'Table Name', 'Long Name', '2-alpha code', 'Currency Unit', 'Special Notes', 'Region', 'Income Group', 'WB-2 code', 'National accounts base year', 'National accounts reference year', 'SNA price valuation', 'Lending category', 'Other groups', 'System of National Accounts', 'Alternative conversion factor', 'PPP survey year', 'Balance of Payments Manual in use', 'External debt Reporting status', 'System of trade', 'Government Accounting concept', 'IMF data dissemination standard', 'Latest population census', 'Latest household survey', 'Source of most recent Income and expenditure data', 'Vital registration complete', 'Latest agricultural census', 'Latest industrial data', 'Latest trade data')
-
 logging.basicConfig(
     filename=os.path.join(CURRENT_PATH, '..', 'logs', '%s-wdi.log' % (os.environ['DB_NAME'])),
     level=logging.INFO,
@@ -46,6 +34,12 @@ logging.basicConfig(
 
 logger = logging.getLogger('importer')
 
+def add_wdi_arguments(parser):
+    parser.add_argument('--source', choices=['excel', 'csv'], default='excel',
+        help="read the tables from the Excel workbook, or from the CSV bundle, which is faster to parse")
+
+args = parse_import_args(add_wdi_arguments)
+
 def info(message):
     print(message)
     logger.info(message)
@@ -55,98 +49,53 @@ def terminate(message):
     logger.info("Terminating script...")
     sys.exit(1)
 
-def dataset_name_from_category(category):
-    return 'World Development Indicators - ' + category
-
-def normalise_indicator_code(code):
-    return code.upper().strip()
-
-# Extract indicator from row in Series worksheet
-def indicator_from_row(row):
-    values = get_row_values(row)
-
-    code = normalise_indicator_code(values[0])
-    category = values[1].split(':')[0]
-    name = values[2]
-
-    source_description = {
-        **DEFAULT_SOURCE_DESCRIPTION,
-        'dataPublisherSource': values[13],
-        'additionalInfo': '\n'.join([
-            title + ': ' + content
-            for (title, content) in [
-                ('Limitations and exceptions', values[10]),
-                ('Notes from original source', values[11]),
-                ('General comments', values[12]),
-                ('Statistical concept and methodology', values[14]),
-                ('Related source links', values[16]),
-                ('Other web links', values[17])
-            ]
-            if content
-        ])
-    }
-
-    # override dataPublishedBy if from the IEA
-    if 'iea.org' in json.dumps(source_description).lower() or 'iea stat' in json.dumps(source_description).lower() or 'iea 2014' in json.dumps(source_description).lower():
-        source_description['dataPublishedBy'] = 'International Energy Agency (IEA) via The World Bank'
-
-    indicator = {
-        'variableId': None,
-        'datasetId': None,
-        'sourceId': None,
-        'code': code,
-        'category': category,
-        'datasetName': dataset_name_from_category(category),
-        'name': name,
-        'description': default(values[4], ''),
-        'unit': default(values[5], ''),
-        'shortUnit': None, # derived below
-        'source': {
-            'name': 'World Bank - WDI: ' + name,
-            'description': json.dumps(source_description)
-        }
-    }
-    # if no unit is specified, try to derive it from the name
-    if not indicator['unit'] and '(' in indicator['name'] and ')' in indicator['name']:
-        indicator['unit'] = indicator['name'][
-            indicator['name'].rfind('(') + 1:
-            indicator['name'].rfind(')')
-        ]
-    # derive the short unit
-    indicator['shortUnit'] = extract_short_unit(indicator['unit'])
-    return indicator
-
 # Create a directory for holding the downloads.
 if not os.path.exists(DOWNLOADS_PATH):
     os.makedirs(DOWNLOADS_PATH)
 
-excel_filepath = os.path.join(DOWNLOADS_PATH, 'WDIEXCEL.xlsx')
-
-if not os.path.isfile(excel_filepath) or yesno("The spreadsheet has been downloaded before. Download latest version?"):
-    info("Getting the zip file...")
-    request_header = {'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_10_1) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/39.0.2171.95 Safari/537.36'}
-    r = requests.get(ZIP_FILE_URL, stream=True, headers=request_header)
-    if r.ok:
-        zip_filepath = os.path.join(DOWNLOADS_PATH, 'wdi.zip')
-        with open(zip_filepath, 'wb') as out_file:
-            shutil.copyfileobj(r.raw, out_file)
-        info("Saved the zip file to disk.")
-        z = zipfile.ZipFile(zip_filepath)
+download_cache = DownloadCache()
+request_header = {'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_10_1) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/39.0.2171.95 Safari/537.36'}
+
+info("Getting the zip file...")
+try:
+    if args.source == 'csv':
+        download = download_cache.fetch(CSV_ZIP_FILE_URL, headers=request_header)
+    else:
+        download = download_cache.fetch(EXCEL_ZIP_FILE_URL, path=os.path.join(DOWNLOADS_PATH, 'wdi.zip'), headers=request_header)
+except DownloadError as error:
+    terminate("The ZIP file could not be downloaded: %s" % error)
+
+# Nothing to do if the last import was of the same zip file
+if not args.sync and not args.ignore_fingerprints:
+    with connection as c:
+        last_import_state = DBUtils(c).fetch_last_import_state(DATASET_NAMESPACE)
+    if last_import_state is not None and download.unchanged_since(last_import_state.get('download_hash')):
+        info("The zip file has not changed since the last import.")
+        sys.exit(0)
+
+if args.source == 'csv':
+
+    # The CSVs are read straight from the zip file
+    input_filepath = download.path
+
+else:
+
+    input_filepath = os.path.join(DOWNLOADS_PATH, 'WDIEXCEL.xlsx')
+
+    if download.changed or not os.path.isfile(input_filepath):
+        z = zipfile.ZipFile(download.path)
         z.extractall(DOWNLOADS_PATH)
-        r = None  # we do not need the request anymore
         info("Successfully extracted the zip file.")
-    else:
-        terminate("The ZIP file could not be downloaded.")
 
 # ==============================================================================
 # Load the worksheets we need and check that they have the columns we expect.
 # ==============================================================================
 
-wb = load_workbook(excel_filepath, read_only=True)
-
-series_ws_rows = wb['Series'].rows
-data_ws_rows = wb['Data'].rows
-country_ws_rows = wb['Country'].rows
+# Both sources give the same rows, as tuples of values
+if args.source == 'csv':
+    series_ws_rows, data_ws_rows, country_ws_rows = open_csv_tables(input_filepath)
+else:
+    series_ws_rows, data_ws_rows, country_ws_rows = open_excel_tables(input_filepath)
 
 series_headers = get_row_values(next(series_ws_rows))
 data_headers = get_row_values(next(data_ws_rows))
@@ -170,10 +119,7 @@ if not starts_with(country_headers, COUNTRY_EXPECTED_HEADERS):
 last_available_year = int(data_headers[-1])
 timespan = str(FIRST_YEAR) + "-" + str(last_available_year)
 
-indicators = [
-    indicator_from_row(row)
-    for row in series_ws_rows
-]
+indicators = read_indicators(series_ws_rows)
 
 indicator_by_code = {
     indicator['code']: indicator
@@ -186,13 +132,7 @@ categories = list({
     for indicator in indicators
 })
 
-country_name_by_code = dict(
-    (get_row_values(row)[0].upper().strip(), get_row_values(row)[2])
-    for row in country_ws_rows
-)
-
-# Data sheet uses INX for 'Not classified', but Country sheet does not list it.
-country_name_by_code['INX'] = 'Not classified'
+country_name_by_code = read_country_name_by_code(country_ws_rows)
 
 
 # Using the connection as context creates an implicit transaction:
@@ -200,6 +140,12 @@ country_name_by_code['INX'] = 'Not classified'
 # `c` is a cursor.
 with connection as c:
 
+    db = DBUtils(c)
+
+    # Only the statements that go through DBUtils are instrumented
+    if args.instrument:
+        db.enable_instrumentation()
+
     c.execute("""
         SELECT id FROM users WHERE email = 'daniel@gavrilov.co.uk'
     """)
@@ -642,91 +588,179 @@ with connection as c:
         terminate("User did not wish to continue")
 
     # ==========================================================================
-    # Delete and reinsert all data_values.
-    # This will take a while as more than 1 million rows are inserted.
+    # Delete and reinsert the data_values of the variables whose data changed
+    # since the last import, or with --sync, only write the ones that changed.
+    # This will take a while as more than 1 million rows are read.
     # ==========================================================================
 
-    message = 'Deleting data_values for the updated variables, this will take a while...'
-    logger.info(message)
-    print(message)
-
-    # Clear the existing data_values for the variables that we will update
-    first = True
-    while first or c.rowcount > 0:
-        first = False
-        c.execute("""
-            DELETE FROM data_values
-            WHERE variableId IN %s
-            LIMIT 100000
-        """, [[
-            # We don't want to remove any discontinued variables
-            variable_id_by_code[indicator['code']]
-            for indicator in indicators
-        ]])
-
-
     start_year = FIRST_YEAR
     end_year = last_available_year
 
     start_index = 4
     end_index = 4 + (end_year - start_year)
 
-    index_year_pairs = list(zip(
-        range(start_index, end_index + 1),
-        range(start_year, end_year + 1)
+    years = list(range(start_year, end_year + 1))
+
+    # The data_values of a block of rows, see reshape.py
+    def data_values_from_rows(rows):
+        entity_ids = [entity_id_by_code[row[1].upper().strip()] for row in rows]
+        variable_ids = [variable_id_by_code[row[3].upper().strip()] for row in rows]
+        return wide_to_long(
+            value_block(rows, start_index, end_index + 1),
+            (COLUMNS, years), (ROWS, entity_ids), (ROWS, variable_ids),
+            missing=(None,) # only output a row if it has a value
+        )
+
+    published_variable_ids = list(dict.fromkeys(
+        variable_id_by_code[indicator['code']]
+        for indicator in indicators
     ))
 
-    def data_values_from_row(row):
-        values = get_row_values(row)
-        country_code = values[1].upper().strip()
-        indicator_code = values[3].upper().strip()
-        entity_id = entity_id_by_code[country_code]
-        variable_id = variable_id_by_code[indicator_code]
-        return [
-            (values[index], year, entity_id, variable_id)
-            for index, year in index_year_pairs
-            if values[index] is not None # only output a row if it has a value
+    # The Data sheet is ordered by country, so all of it has to be read
+    # before we know which variables changed. It is read once: the
+    # data_values are fingerprinted, and spilled to a temporary file per
+    # batch of variables, so that the batches with changed variables can be
+    # written one at a time without holding the sheet in memory.
+    info("Fingerprinting the data_values in the spreadsheet...")
+
+    fingerprints = DataFingerprints()
+
+    batch_index_by_variable_id = {
+        variable_id: index // VARIABLES_PER_CHECKPOINT
+        for index, variable_id in enumerate(published_variable_ids)
+    }
+    spilled_data_values = SpilledPartitions()
+
+    for rows in blocks(data_ws_rows):
+        for data_value in data_values_from_rows(rows):
+            value, year, entity_id, variable_id = data_value
+            fingerprints.add(variable_id, entity_id, year, value)
+            batch_index = batch_index_by_variable_id.get(variable_id)
+            if batch_index is not None:
+                spilled_data_values.add(batch_index, data_value)
+
+    previous_fingerprints = {} if args.ignore_fingerprints else db.fetch_variable_fingerprints(DATASET_NAMESPACE)
+
+    input_checksum = file_checksum(input_filepath)
+
+    # The data_values are written and committed in batches of variables. With
+    # --resume, the batches that the last, interrupted run committed from the
+    # same spreadsheet (or CSV files) are skipped.
+    run, checkpoints = db.begin_run(DATASET_NAMESPACE, args.resume)
+
+    completed_variable_ids = set(
+        variable_id
+        for checkpoint in checkpoints
+        if checkpoint['input_hash'] == input_checksum
+        for variable_id in checkpoint['variable_ids']
+    )
+
+    changed_variable_ids = [
+        variable_id
+        for variable_id in published_variable_ids
+        if fingerprints.hexdigest(variable_id) is None
+        or fingerprints.hexdigest(variable_id) != previous_fingerprints.get(str(variable_id))
+    ]
+
+    info("%d of %d variables have changed since the last import." % (len(changed_variable_ids), len(published_variable_ids)))
+
+    if completed_variable_ids:
+        num_changed = len(changed_variable_ids)
+        changed_variable_ids = [
+            variable_id
+            for variable_id in changed_variable_ids
+            if variable_id not in completed_variable_ids
         ]
+        info("%d of them were committed by the interrupted run and will be skipped." % (num_changed - len(changed_variable_ids)))
+
+    pool = ConnectionPool(args.workers) if args.workers > 1 and not args.sync else None
 
-    finished = False
+    sync_totals = {'inserted': 0, 'updated': 0, 'deleted': 0, 'unchanged': 0}
     total_inserted = 0
 
-    while not finished:
+    # The changed variables of every batch that has any, by batch index
+    changed_variable_ids_by_batch = {}
+    for variable_id in changed_variable_ids:
+        changed_variable_ids_by_batch.setdefault(batch_index_by_variable_id[variable_id], []).append(variable_id)
 
-        finished = True
-        data_values_to_insert = []
+    # Only the changed variables of a batch are written
+    def read_batch_data_values(batch_index, variable_ids):
+        variable_ids = set(variable_ids)
+        for data_value in spilled_data_values.read(batch_index):
+            if data_value[3] in variable_ids:
+                yield data_value
 
-        for row in data_ws_rows:
-            data_values_to_insert += data_values_from_row(row)
-            if len(data_values_to_insert) > 50000:
-                finished = False
-                break
+    batch_start = 0
 
-        message = "Inserting {} data_values rows, {} inserted so far.".format(len(data_values_to_insert), total_inserted)
-        logger.info(message)
-        print(message, end='\r')
+    for batch_index, batch_variable_ids in sorted(changed_variable_ids_by_batch.items()):
 
-        c.executemany("""
-            INSERT INTO
-                data_values (value, year, entityId, variableId)
-            VALUES
-                (%s, %s, %s, %s)
-        """, data_values_to_insert)
+        if args.sync:
+
+            # Every variable is synced as a whole, with the data_values of
+            # the batch grouped by variable
+            data_values_by_variable_id = {variable_id: [] for variable_id in batch_variable_ids}
+            for value, year, entity_id, variable_id in read_batch_data_values(batch_index, batch_variable_ids):
+                data_values_by_variable_id[variable_id].append((entity_id, year, value))
+            for variable_id in batch_variable_ids:
+                for key, count in db.sync_data_values(variable_id, data_values_by_variable_id[variable_id]).items():
+                    sync_totals[key] += count
+
+        else:
 
-        total_inserted += len(data_values_to_insert)
+            db.execute_until_empty("""
+                DELETE FROM data_values
+                WHERE variableId IN %s
+                LIMIT 100000
+            """, [batch_variable_ids])
 
-        if finished:
-            message = "Inserted {} data_values rows.".format(total_inserted)
+            # The parallel writers would wait on the locks of the deleted rows
+            if pool is not None:
+                connection.commit()
+
+            # With --bulk-load-mode, the unique and foreign key checks are
+            # turned off while the batch is loaded, and the loaded rows are
+            # checked before the checkpoint commits them
+            with db.bulk_load_mode(enabled=args.bulk_load_mode):
+                load_stats = db.load_data_values(read_batch_data_values(batch_index, batch_variable_ids), pool=pool)
+
+            total_inserted += load_stats['rows']
+
+            message = "Inserted {} data_values rows at {:.0f} rows/s using {}, {} inserted so far.".format(
+                load_stats['rows'], load_stats['rows_per_second'], load_stats['method'], total_inserted)
             logger.info(message)
-            print("\n" + message)
+            print(message, end='\r')
 
-    c.execute("""
-        INSERT INTO importer_importhistory (import_type, import_time, import_notes, import_state)
-        VALUES ('wdi', NOW(), %(notes)s, %(state)s)
-    """, {
-        'notes': '',
-        'state': json.dumps({ 'file_checksum': file_checksum(excel_filepath) })
-    })
+        db.checkpoint(
+            DATASET_NAMESPACE, run,
+            'variables %d-%d of %d' % (batch_start + 1, batch_start + len(batch_variable_ids), len(changed_variable_ids)),
+            input_checksum,
+            variable_ids=batch_variable_ids
+        )
+
+        batch_start += len(batch_variable_ids)
+
+    spilled_data_values.close()
+
+    if pool is not None:
+        pool.close()
+
+    if args.sync:
+        info("Synced data_values: {inserted} inserted, {updated} updated, {deleted} deleted, {unchanged} unchanged.".format(**sync_totals))
+    else:
+        info("\nInserted {} data_values rows.".format(total_inserted))
+
+    db.note_import(
+        import_type=DATASET_NAMESPACE,
+        import_notes='',
+        import_state=json.dumps({
+            'file_checksum': input_checksum,
+            'download_hash': download.hash,
+            'variable_fingerprints': fingerprints.hexdigests()
+        })
+    )
+
+    if args.instrument:
+        info("\nTime spent per statement:\n%s" % db.format_statement_stats())
 
 info("\nSuccessfully imported the whole spreadsheet... I mean, the whole thing is now in the database!")
 if var_ids_to_discontinue:
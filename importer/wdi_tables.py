@@ -0,0 +1,161 @@
+import io
+import csv
+import json
+import time
+import zipfile
+
+from xlsx_reader import XlsxReader, cast_number
+from utils import extract_short_unit, get_row_values, default
+
+# Reads the Series, Data and Country tables of a WDI release, either from the
+# Excel workbook or from the CSV bundle, which hold the same tables. Kept apart
+# from wdi.py, which talks to the database as soon as it is run, so that the
+# two sources can be compared, see test_wdi_tables.py at the root.
+
+FIRST_YEAR = 1960
+
+EXCEL_ZIP_FILE_URL = 'http://databank.worldbank.org/data/download/WDI_excel.zip'
+CSV_ZIP_FILE_URL = 'http://databank.worldbank.org/data/download/WDI_csv.zip'
+
+# The members of the CSV bundle holding each table
+CSV_FILENAMES = {
+    'Series': 'WDISeries.csv',
+    'Data': 'WDIData.csv',
+    'Country': 'WDICountry.csv'
+}
+
+DEFAULT_SOURCE_DESCRIPTION = {
+    'dataPublishedBy': 'World Bank – World Development Indicators',
+    'link': 'http://data.worldbank.org/data-catalog/world-development-indicators',
+    'retrievedDate': time.strftime('%d-%B-%y')
+}
+
+# The column headers we expect the sheets to have.
+# We will only check that the headers begin with the columns listed here, if
+# there are additional columns, that's fine and it shouldn't affect our script.
+SERIES_EXPECTED_HEADERS = ('Series Code', 'Topic', 'Indicator Name', 'Short definition', 'Long definition', 'Unit of measure', 'Periodicity', 'Base Period', 'Other notes', 'Aggregation method', 'Limitations and exceptions', 'Notes from original source', 'General comments', 'Source', 'Statistical concept and methodology', 'Development relevance', 'Related source links', 'Other web links', 'Related indicators', 'License Type')
+DATA_EXPECTED_HEADERS = ('Country Name', 'Country Code', 'Indicator Name', 'Indicator Code', str(FIRST_YEAR))
+COUNTRY_EXPECTED_HEADERS = ('Country Code', 'Short Name', 'Table Name', 'Long Name', '2-alpha code', 'Currency Unit', 'Special Notes', 'Region', 'Income Group', 'WB-2 code', 'National accounts base year', 'National accounts reference year', 'SNA price valuation', 'Lending category', 'Other groups', 'System of National Accounts', 'Alternative conversion factor', 'PPP survey year', 'Balance of Payments Manual in use', 'External debt Reporting status', 'System of trade', 'Government Accounting concept', 'IMF data dissemination standard', 'Latest population census', 'Latest household survey', 'Source of most recent Income and expenditure data', 'Vital registration complete', 'Latest agricultural census', 'Latest industrial data', 'Latest trade data')
+
+# The first column of the Data table holding a year's values
+DATA_FIRST_YEAR_INDEX = 4
+
+def dataset_name_from_category(category):
+    return 'World Development Indicators - ' + category
+
+def normalise_indicator_code(code):
+    return code.upper().strip()
+
+# Returns the (series, data, country) rows of the Excel workbook. Each is an
+# iterator of tuples of values, the first of which holds the headers.
+def open_excel_tables(excel_filepath):
+    wb = XlsxReader(excel_filepath)
+    return wb['Series'].rows, wb['Data'].rows, wb['Country'].rows
+
+# Returns the same rows as open_excel_tables(), read from the CSV bundle. The
+# CSVs are streamed from the zip archive without being extracted.
+def open_csv_tables(zip_filepath):
+    archive = zipfile.ZipFile(zip_filepath)
+    return (
+        csv_table_rows(archive, CSV_FILENAMES['Series']),
+        csv_table_rows(archive, CSV_FILENAMES['Data'], first_number_index=DATA_FIRST_YEAR_INDEX),
+        csv_table_rows(archive, CSV_FILENAMES['Country'])
+    )
+
+# The CSVs differ from the sheets in ways we undo here, so that both sources
+# give the same rows:
+#   - they start with a byte order mark
+#   - every line ends with a comma, which adds an empty column
+#   - empty cells are empty strings rather than None
+#   - numbers are text, they are cast like the workbook's numbers are
+def csv_table_rows(archive, member, first_number_index=None):
+    with archive.open(member) as f:
+        reader = csv.reader(io.TextIOWrapper(f, encoding='utf-8-sig', newline=''))
+        headers = next(reader)
+        while headers and headers[-1] == '':
+            headers.pop()
+        width = len(headers)
+        yield tuple(headers)
+
+        number_indexes = range(first_number_index, width) if first_number_index is not None else range(0)
+
+        for row in reader:
+            values = [value if value != '' else None for value in row[:width]]
+            if len(values) < width:
+                values.extend([None] * (width - len(values)))
+            for index in number_indexes:
+                if values[index] is not None:
+                    values[index] = cast_number(values[index])
+            yield tuple(values)
+
+# Extract indicator from row in Series worksheet
+def indicator_from_row(row):
+    values = get_row_values(row)
+
+    code = normalise_indicator_code(values[0])
+    category = values[1].split(':')[0]
+    name = values[2]
+
+    source_description = {
+        **DEFAULT_SOURCE_DESCRIPTION,
+        'dataPublisherSource': values[13],
+        'additionalInfo': '\n'.join([
+            title + ': ' + content
+            for (title, content) in [
+                ('Limitations and exceptions', values[10]),
+                ('Notes from original source', values[11]),
+                ('General comments', values[12]),
+                ('Statistical concept and methodology', values[14]),
+                ('Related source links', values[16]),
+                ('Other web links', values[17])
+            ]
+            if content
+        ])
+    }
+
+    # override dataPublishedBy if from the IEA
+    if 'iea.org' in json.dumps(source_description).lower() or 'iea stat' in json.dumps(source_description).lower() or 'iea 2014' in json.dumps(source_description).lower():
+        source_description['dataPublishedBy'] = 'International Energy Agency (IEA) via The World Bank'
+
+    indicator = {
+        'variableId': None,
+        'datasetId': None,
+        'sourceId': None,
+        'code': code,
+        'category': category,
+        'datasetName': dataset_name_from_category(category),
+        'name': name,
+        'description': default(values[4], ''),
+        'unit': default(values[5], ''),
+        'shortUnit': None, # derived below
+        'source': {
+            'name': 'World Bank - WDI: ' + name,
+            'description': json.dumps(source_description)
+        }
+    }
+    # if no unit is specified, try to derive it from the name
+    if not indicator['unit'] and '(' in indicator['name'] and ')' in indicator['name']:
+        indicator['unit'] = indicator['name'][
+            indicator['name'].rfind('(') + 1:
+            indicator['name'].rfind(')')
+        ]
+    # derive the short unit
+    indicator['shortUnit'] = extract_short_unit(indicator['unit'])
+    return indicator
+
+def read_indicators(series_rows):
+    return [
+        indicator_from_row(row)
+        for row in series_rows
+    ]
+
+def read_country_name_by_code(country_rows):
+    country_name_by_code = dict(
+        (get_row_values(row)[0].upper().strip(), get_row_values(row)[2])
+        for row in country_rows
+    )
+
+    # Data sheet uses INX for 'Not classified', but Country sheet does not list it.
+    country_name_by_code['INX'] = 'Not classified'
+
+    return country_name_by_code
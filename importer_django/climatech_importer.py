@@ -16,6 +16,10 @@ from django.conf import settings
 from django.db import connection, transaction
 from django.utils import timezone
 from grapher_admin.views import write_dataset_csv
+from governor import Governor
+from units import short_unit_extract
+
+governor = Governor.from_env()
 
 
 # we will use the file checksum to check if the downloaded file has changed since we last saw it
@@ -30,33 +34,6 @@ def file_checksum(filename, blocksize=2**20):
     return m.hexdigest()
 
 
-def short_unit_extract(unit: str):
-    common_short_units = ['$', '£', '€', '%']  # used for extracting short forms of units of measurement
-    short_unit = None
-    if unit:
-        if ' per ' in unit:
-            short_form = unit.split(' per ')[0]
-            if any(w in short_form for w in common_short_units):
-                for x in common_short_units:
-                    if x in short_form:
-                        short_unit = x
-                        break
-            else:
-                short_unit = short_form
-        elif any(x in unit for x in common_short_units):
-            for y in common_short_units:
-                if y in unit:
-                    short_unit = y
-                    break
-        elif 'percentage' in unit:
-            short_unit = '%'
-        elif 'percent' in unit.lower():
-            short_unit = '%'
-        elif len(unit) < 9:  # this length is sort of arbitrary at this point, taken from the unit 'hectares'
-            short_unit = unit
-    return short_unit
-
-
 source_description = {
     'dataPublishedBy': "World Bank Climate Change Data",
     'link': "https://data.worldbank.org/data-catalog/climate-change",
@@ -278,8 +255,7 @@ with transaction.atomic():
                                         data_values_tuple_list = []
 
                 column_number = 0
-                if row_number % 10 == 0:
-                    time.sleep(0.001)  # this is done in order to not keep the CPU busy all the time, the delay after each 10th row is 1 millisecond
+                governor.tick()
 
         if len(data_values_tuple_list):  # insert any leftover data_values
             with connection.cursor() as c:
@@ -602,8 +578,7 @@ with transaction.atomic():
                                         logger.info("Dumping data values...")
                                         data_values_tuple_list = []
                 column_number = 0
-                if row_number % 10 == 0:
-                    time.sleep(0.001)  # this is done in order to not keep the CPU busy all the time, the delay after each 10th row is 1 millisecond
+                governor.tick()
 
         if len(data_values_tuple_list):  # insert any leftover data_values
             with connection.cursor() as c:
@@ -4,23 +4,24 @@ import csv
 import hashlib
 import json
 import glob
-import unidecode
 import lxml.html
-import re
 import requests
 import time
 import urllib.parse
 sys.path.insert(1, os.path.join(sys.path[0], '..'))
 import grapher_admin.wsgi
 import django.db
-from grapher_admin.models import Entity, DatasetSubcategory, DatasetCategory, Dataset, Source, Variable, VariableType, DataValue
+from grapher_admin.models import DatasetSubcategory, DatasetCategory, Dataset, Source, Variable, VariableType, DataValue
 from importer.models import ImportHistory
-from country_name_tool.models import CountryName
 from django.conf import settings
 from django.db import connection, transaction
 from django.utils import timezone
 from grapher_admin.views import write_dataset_csv
 from openpyxl import load_workbook
+from download_cache import DownloadCache, DownloadError
+from entity_resolver import EntityResolver
+
+download_cache = DownloadCache()
 
 
 # we will use the file checksum to check if the downloaded file has changed since we last saw it
@@ -129,15 +130,16 @@ for page in range(1, number_of_pages + 1):
             # now downloading the files
             for one_url in file_url:
                 download_url = base_dataverse_url + lxml.html.fromstring(one_url.decode('utf-8')).xpath('//redirect/@url')[0]
-                file_download = requests.get(download_url, stream=True)
+                try:
+                    file_download = download_cache.fetch(download_url)
+                except DownloadError as e:
+                    print(e)
+                    continue
                 # we wouldn't want to make too many requests in a short amount of time
                 time.sleep(2)
-                fname = re.findall("filename=(.+)", file_download.headers['content-disposition'])[0].replace('"', '')
-                if 'xlsx' in fname:
-                    with open(os.path.join(files_save_location, fname), 'wb') as ff:
-                        for chunk in file_download.iter_content(chunk_size=1024):
-                            if chunk:
-                                ff.write(chunk)
+                fname = file_download.filename
+                if fname and 'xlsx' in fname:
+                    file_download.link_to(os.path.join(files_save_location, fname))
                     filename_to_pagelink[fname] = base_dataverse_url + each_link
 
 dataset_to_category = {}
@@ -163,15 +165,7 @@ with transaction.atomic():
     existing_subcategories = DatasetSubcategory.objects.filter(categoryId=the_category.pk).values('name')
     existing_subcategories_list = {item['name'] for item in existing_subcategories}
 
-    existing_entities = Entity.objects.values('name')
-    existing_entities_list = {item['name'].lower() for item in existing_entities}
-
-    country_tool_names = CountryName.objects.all()
-    country_tool_names_dict = {}
-    for each in country_tool_names:
-        country_tool_names_dict[each.country_name.lower()] = each.owid_country
-
-    country_name_entity_ref = {}  # this dict will hold the country names and the appropriate entity object (this is used when saving the variables and their values)
+    entity_resolver = EntityResolver(entity_names_first=True)
 
     insert_string = 'INSERT into data_values (value, year, entityId, variableId) VALUES (%s, %s, %s, %s)'  # this is used for constructing the query for mass inserting to the data_values table
 
@@ -251,33 +245,28 @@ with transaction.atomic():
                         if row_number > 3:
                             if column_number == 4 and cell.value is not None:
                                 countryname = cell.value
-                                if countryname not in country_name_entity_ref:
-                                    if countryname.lower() in existing_entities_list:
-                                        newentity = Entity.objects.get(name=countryname)
-                                    elif country_tool_names_dict.get(unidecode.unidecode(countryname.lower()), 0):
-                                        newentity = Entity.objects.get(
-                                            name=country_tool_names_dict[
-                                                unidecode.unidecode(countryname.lower())].owid_name)
-                                    else:
-                                        newentity = Entity(name=countryname, validated=False)
-                                        newentity.save()
-                                    country_name_entity_ref[countryname] = newentity
 
                             if column_number > 6 and cell.value is not None:
                                 try:
                                     value = float(cell.value)
                                 except ValueError:
                                     continue
-                                if data_values_dict.get(country_name_entity_ref[countryname].pk):
-                                    data_values_dict[country_name_entity_ref[countryname].pk][column_to_year[column_number]] = str(value)
+                                if data_values_dict.get(countryname):
+                                    data_values_dict[countryname][column_to_year[column_number]] = str(value)
                                 else:
-                                    data_values_dict[country_name_entity_ref[countryname].pk] = {}
-                                    data_values_dict[country_name_entity_ref[countryname].pk][column_to_year[column_number]] = str(value)
+                                    data_values_dict[countryname] = {}
+                                    data_values_dict[countryname][column_to_year[column_number]] = str(value)
 
                     column_number = 0
 
+                # the entities of the file's countries are resolved, and the new ones
+                # created, all at once
+                entity_id_by_name = entity_resolver.entity_ids({countryname: countryname for countryname in data_values_dict})
+                data_values_by_entity_id = {}
+                for countryname, data_value in data_values_dict.items():
+                    data_values_by_entity_id.setdefault(entity_id_by_name[countryname], {}).update(data_value)
                 data_values_tuple_list = []
-                for country, data_value in data_values_dict.items():
+                for country, data_value in data_values_by_entity_id.items():
                     for year, value in data_value.items():
                         data_values_tuple_list.append((value, year, country, newvariable.pk))
 
@@ -376,35 +365,30 @@ with transaction.atomic():
                             if row_number > 3:
                                 if column_number == 4 and cell.value is not None:
                                     countryname = cell.value
-                                    if countryname not in country_name_entity_ref:
-                                        if countryname.lower() in existing_entities_list:
-                                            newentity = Entity.objects.get(name=countryname)
-                                        elif country_tool_names_dict.get(unidecode.unidecode(countryname.lower()), 0):
-                                            newentity = Entity.objects.get(
-                                                name=country_tool_names_dict[
-                                                    unidecode.unidecode(countryname.lower())].owid_name)
-                                        else:
-                                            newentity = Entity(name=countryname, validated=False)
-                                            newentity.save()
-                                        country_name_entity_ref[countryname] = newentity
 
                                 if column_number > 6 and cell.value is not None:
                                     try:
                                         value = float(cell.value)
                                     except ValueError:
                                         continue
-                                    if data_values_dict.get(country_name_entity_ref[countryname].pk):
-                                        data_values_dict[country_name_entity_ref[countryname].pk][
+                                    if data_values_dict.get(countryname):
+                                        data_values_dict[countryname][
                                             column_to_year[column_number]] = str(value)
                                     else:
-                                        data_values_dict[country_name_entity_ref[countryname].pk] = {}
-                                        data_values_dict[country_name_entity_ref[countryname].pk][
+                                        data_values_dict[countryname] = {}
+                                        data_values_dict[countryname][
                                             column_to_year[column_number]] = str(value)
 
                         column_number = 0
 
+                    # the entities of the file's countries are resolved, and the new ones
+                    # created, all at once
+                    entity_id_by_name = entity_resolver.entity_ids({countryname: countryname for countryname in data_values_dict})
+                    data_values_by_entity_id = {}
+                    for countryname, data_value in data_values_dict.items():
+                        data_values_by_entity_id.setdefault(entity_id_by_name[countryname], {}).update(data_value)
                     data_values_tuple_list = []
-                    for country, data_value in data_values_dict.items():
+                    for country, data_value in data_values_by_entity_id.items():
                         for year, value in data_value.items():
                             data_values_tuple_list.append((value, year, country, newvariable.pk))
 
@@ -0,0 +1,62 @@
+import logging
+import unidecode
+from grapher_admin.models import Entity
+from country_name_tool.models import CountryName
+
+logger = logging.getLogger('importer')
+
+
+# Finds the entities of the country names an importer reads. The entities and
+# the country tool's names are loaded once, and the entities that don't exist
+# yet are created with one bulk_create(), so that resolving the few hundred
+# countries of a file takes a handful of queries instead of one or two per
+# country:
+#
+#   resolver = EntityResolver()
+#   entity_id_by_code = resolver.entity_ids(country_name_by_code)
+#
+# A country name is looked up in the country tool first, and the name of its
+# OWID country is used if it has one, otherwise the name itself is used. The
+# entity with that name, ignoring case, is the country's entity. With
+# entity_names_first, a name that already is an entity's is used as it is.
+class EntityResolver:
+
+    # aliases: names to use instead of the ones in the file or in the country
+    # tool, e.g. {'Global': 'World'}
+    def __init__(self, aliases=None, entity_names_first=False):
+        self.aliases = aliases or {}
+        self.entity_names_first = entity_names_first
+        self.entity_id_by_name = {
+            name.lower(): entity_id
+            for name, entity_id in Entity.objects.values_list('name', 'id')
+        }
+        self.owid_name_by_country_name = {
+            country_name.lower(): owid_name
+            for country_name, owid_name in CountryName.objects.values_list('country_name', 'owid_country__owid_name')
+        }
+
+    # The name of the entity of a country
+    def entity_name(self, country_name):
+        name = self.aliases.get(country_name, country_name)
+        if self.entity_names_first and name.lower() in self.entity_id_by_name:
+            return name
+        name = self.owid_name_by_country_name.get(unidecode.unidecode(name.lower()), name)
+        return self.aliases.get(name, name)
+
+    # The entity id of every key of a dict of country names
+    def entity_ids(self, country_name_by_key):
+        entity_name_by_key = {key: self.entity_name(country_name) for key, country_name in country_name_by_key.items()}
+
+        new_names = {}
+        for name in entity_name_by_key.values():
+            if name.lower() not in self.entity_id_by_name:
+                new_names.setdefault(name.lower(), name)
+        if new_names:
+            Entity.objects.bulk_create([Entity(name=name, validated=False) for name in new_names.values()])
+            for name in new_names.values():
+                logger.info("Inserting a country %s." % name)
+            # MySQL doesn't give the ids of bulk-created rows back
+            for name, entity_id in Entity.objects.filter(name__in=list(new_names.values())).values_list('name', 'id'):
+                self.entity_id_by_name[name.lower()] = entity_id
+
+        return {key: self.entity_id_by_name[name.lower()] for key, name in entity_name_by_key.items()}
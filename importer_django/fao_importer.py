@@ -18,6 +18,9 @@ from django.conf import settings
 from django.db import connection, transaction
 from django.utils import timezone
 from grapher_admin.views import write_dataset_csv
+from governor import Governor
+
+governor = Governor.from_env()
 
 start_time = datetime.now()
 # IMPORTANT: FAOSTAT's large bulk dataset download is a collection of 70+ zip files
@@ -452,8 +455,7 @@ def process_csv_file_update(filename_to_process: str, original_filename: str):
                     if row['Year'] == 'Year':
                         continue
                     row_counter += 1
-                    if row_counter % 300 == 0:
-                        time.sleep(0.001)  # this is done in order to not keep the CPU busy all the time
+                    governor.tick()
                     if filecolumns == column_types[5]:
                         variablename = oneiteration['varname_format'] % row['Item']
                     if filecolumns == column_types[6]:
@@ -683,8 +685,7 @@ def process_csv_file_insert(filename_to_process: str, original_filename: str):
                     if row['Year'] == 'Year':
                         continue
                     row_counter += 1
-                    if row_counter % 300 == 0:
-                        time.sleep(0.001)  # this is done in order to not keep the CPU busy all the time
+                    governor.tick()
                     if filecolumns == column_types[5]:
                         variablename = oneiteration['varname_format'] % row['Item']
                     if filecolumns == column_types[6]:
@@ -709,8 +710,7 @@ def process_csv_file_insert(filename_to_process: str, original_filename: str):
                     if row['Year'] == 'Year':
                         continue
                     row_counter += 1
-                    if row_counter % 300 == 0:
-                        time.sleep(0.001)  # this is done in order to not keep the CPU busy all the time
+                    governor.tick()
                     if filecolumns == column_types[5]:
                         variablename = oneiteration['varname_format'] % row['Item']
                         variablecode = row['Item Code']
@@ -745,8 +745,7 @@ def process_csv_file_insert(filename_to_process: str, original_filename: str):
                         row_counter = 0
                         for row in separate_file_reader:
                             row_counter += 1
-                            if row_counter % 300 == 0:
-                                time.sleep(0.001)  # this is done in order to not keep the CPU busy all the time
+                            governor.tick()
                             countryname = row['Country']
                             variablecode = row['Varcode']
                             variableunit = row['Unit']
@@ -785,8 +784,7 @@ def process_one_row(year, value, countryname, variablecode, variablename, existi
     global vars_to_delete
 
     processed_values += 1
-    if processed_values % 300 == 0:
-        time.sleep(0.001)  # this is done in order to not keep the CPU busy all the time
+    governor.tick()
 
     insert_string = 'INSERT into data_values (value, year, entityId, variableId) VALUES (%s, %s, %s, %s)'  # this is used for constructing the query for mass inserting to the data_values table
 
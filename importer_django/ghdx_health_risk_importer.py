@@ -16,6 +16,10 @@ from django.db import connection, transaction
 from django.utils import timezone
 from grapher_admin.views import write_dataset_csv
 import zipfile
+import io
+from governor import Governor
+
+governor = Governor.from_env()
 
 
 ###############################################################
@@ -90,9 +94,9 @@ with transaction.atomic():
         z = zipfile.ZipFile(file)
         for each in z.namelist():
             if '.csv' in each:
-                csv_filename = ghdx_downloads_save_location + each
-        z.extractall(ghdx_downloads_save_location)
-        with open(csv_filename, 'r', encoding='utf8') as f:
+                csv_filename = each
+        # the CSV is streamed from the archive instead of being extracted next to it
+        with io.TextIOWrapper(z.open(csv_filename), encoding='utf8') as f:
             print('Processing: %s' % file)
             reader = csv.DictReader(f)
             for row in reader:
@@ -179,16 +183,13 @@ with transaction.atomic():
                             c.executemany(insert_string, data_values_tuple_list)
                         data_values_tuple_list = []
 
-                if row_number % 100 == 0:
-                    time.sleep(0.001)  # this is done in order to not keep the CPU busy all the time, the delay after each 100th row is 1 millisecond
+                governor.tick()
 
         if len(data_values_tuple_list):  # insert any leftover data_values
             with connection.cursor() as c:
                 c.executemany(insert_string, data_values_tuple_list)
             data_values_tuple_list = []
 
-        os.remove(csv_filename)
-
 # for dataset in existing_datasets_list:
 #     write_dataset_csv(dataset.pk, dataset.name, dataset.name, 'gbd_risk_fetcher', '')
 # for dataset in new_datasets_list:
@@ -14,6 +14,9 @@ from django.conf import settings
 from django.db import connection, transaction
 from django.utils import timezone
 from grapher_admin.views import write_dataset_csv
+from governor import Governor
+
+governor = Governor.from_env()
 
 
 ihme_sdg_downloads_save_location = settings.BASE_DIR + '/data/ihme_sdg/'
@@ -160,8 +163,7 @@ with transaction.atomic():
                         c.executemany(insert_string, data_values_tuple_list)
                     data_values_tuple_list = []
 
-                if row_number % 100 == 0:
-                    time.sleep(0.001)  # this is done in order to not keep the CPU busy all the time, the delay after each 100th row is 1 millisecond
+                governor.tick()
 
         if len(data_values_tuple_list):  # insert any leftover data_values
             with connection.cursor() as c:
@@ -4,7 +4,6 @@ import hashlib
 import io
 import json
 import requests
-import unidecode
 import shutil
 import time
 import csv
@@ -14,15 +13,19 @@ import gzip
 sys.path.insert(1, os.path.join(sys.path[0], '..'))
 import grapher_admin.wsgi
 from openpyxl import load_workbook
-from grapher_admin.models import Entity, DatasetSubcategory, DatasetCategory, Dataset, Source, Variable, VariableType, DataValue
+from grapher_admin.models import DatasetSubcategory, DatasetCategory, Dataset, Source, Variable, VariableType, DataValue
 from importer.models import ImportHistory
-from country_name_tool.models import CountryName
 from django.conf import settings
 from django.db import connection, transaction
 from django.utils import timezone
 from django.urls import reverse
 from grapher_admin.views import write_dataset_csv
 import lxml.html
+from governor import Governor
+from entity_resolver import EntityResolver
+from units import short_unit_extract
+
+governor = Governor.from_env()
 
 # IMPORTANT: The files in the ILOSTAT dataset contain many values for the same variable, country and year but from
 # different sources. There is no easy way to split these datasets by sources, and this makes importing the values
@@ -42,59 +45,6 @@ def file_checksum(filename, blocksize=2**20):
     return m.hexdigest()
 
 
-def short_unit_extract(unit: str):
-    common_short_units = ['$', '£', '€', '%']  # used for extracting short forms of units of measurement
-    short_unit = None
-    if unit:
-        if ' per ' in unit:
-            short_form = unit.split(' per ')[0]
-            if any(w in short_form for w in common_short_units):
-                for x in common_short_units:
-                    if x in short_form:
-                        short_unit = x
-                        break
-            else:
-                short_unit = short_form
-        elif any(x in unit for x in common_short_units):
-            for y in common_short_units:
-                if y in unit:
-                    short_unit = y
-                    break
-        elif 'percentage' in unit:
-            short_unit = '%'
-        elif 'percent' in unit.lower():
-            short_unit = '%'
-        elif len(unit) < 9:  # this length is sort of arbitrary at this point, taken from the unit 'hectares'
-            short_unit = unit
-    return short_unit
-
-
-def process_entities(country_names_dictionary):
-    existing_entities = Entity.objects.values('name')
-    existing_entities_list = {item['name'].lower() for item in existing_entities}
-
-    country_tool_names = CountryName.objects.all()
-    country_tool_names_dict = {}
-
-    for each_country in country_tool_names:
-        country_tool_names_dict[each_country.country_name.lower()] = each_country.owid_country
-
-    c_name_entity_ref = {}  # this dict will hold the country names from excel and the appropriate entity object (this is used when saving the variables and their values)
-
-    for c_code, country_name in country_names_dictionary.items():
-        if country_tool_names_dict.get(unidecode.unidecode(country_name.lower()), 0):
-            newentity = Entity.objects.get(
-                name=country_tool_names_dict[unidecode.unidecode(country_name.lower())].owid_name)
-        elif country_name.lower() in existing_entities_list:
-            newentity = Entity.objects.get(name__iexact=country_name)
-        else:
-            newentity = Entity(name=country_name, validated=False)
-            newentity.save()
-        c_name_entity_ref[c_code] = newentity
-
-    return c_name_entity_ref
-
-
 # only the files listed here will be imported
 list_of_files_to_import = ['EAP_2EAP_SEX_AGE_NB_A','EAP_2WAF_NOC_RT_A','EAP_2WAM_NOC_RT_A','EAP_2WAP_NOC_RT_A','EAP_2WAP_SEX_AGE_RT_A','EAP_DWAF_NOC_RT_A','EAP_DWAM_NOC_RT_A','EAP_DWAP_NOC_RT_A','EAP_DYAF_NOC_RT_A','EAP_DYAM_NOC_RT_A','EAP_DYAP_NOC_RT_A','EAR_4HPM_NOC_NB_A','EAR_4HPT_NOC_NB_A','EAR_4HPW_NOC_NB_A','EAR_4MMN_CUR_NB_A','EAR_4MNP_NOC_NB_A','EAR_4MPM_NOC_NB_A','EAR_4MPT_NOC_NB_A','EAR_4MPW_NOC_NB_A','EAR_FEAR_NOC_NB_A','EAR_GGAP_NOC_RT_A','EAR_INEE_NOC_NB_A','EAR_MEAR_NOC_NB_A','EAR_MREE_NOC_GR_A','EAR_TEAR_NOC_NB_A','EAR_XFLS_NOC_RT_A','EAR_XMFG_NOC_NB_A','EES_3048_NOC_RT_A','EES_FG48_NOC_RT_A','EES_FNAG_NOC_RT_A','EES_LT30_NOC_RT_A','EES_MG48_NOC_RT_A','EES_MNAG_NOC_RT_A','EES_TG48_NOC_RT_A','EES_TNAG_NOC_RT_A','EES_TNAG_SEX_RT_A','EES_XTMP_SEX_RT_A','EIP_2EIP_SEX_AGE_NB_A','EIP_FNEE_NOC_RT_A','EIP_MNEE_NOC_RT_A','EIP_NEET_SEX_NB_A','EIP_NEET_SEX_RT_A','EIP_TNEE_NOC_RT_A','EMP_2AGR_NOC_RT_A','EMP_2CFW_NOC_RT_A','EMP_2EER_NOC_RT_A','EMP_2EES_NOC_RT_A','EMP_2IND_NOC_RT_A','EMP_2MEP_NOC_RT_A','EMP_2OAW_NOC_RT_A','EMP_2SRV_NOC_RT_A','EMP_2WAP_NOC_RT_A','EMP_2WEP_NOC_RT_A','EMP_2YEP_NOC_RT_A','EMP_DWAF_NOC_RT_A','EMP_DWAM_NOC_RT_A','EMP_DWAP_NOC_RT_A','EMP_FAGR_NOC_RT_A','EMP_FCFW_NOC_RT_A','EMP_FEER_NOC_RT_A','EMP_FIND_NOC_RT_A','EMP_FOAW_NOC_RT_A','EMP_FSRV_NOC_RT_A','EMP_MCFW_NOC_RT_A','EMP_MEER_NOC_RT_A','EMP_MOAW_NOC_RT_A','EMP_PTER_SEX_RT_A','EMP_TAGR_NOC_RT_A','EMP_TCFW_NOC_RT_A','EMP_TEER_NOC_RT_A','EMP_TIND_NOC_RT_A','EMP_TOAW_NOC_RT_A','EMP_TSRV_NOC_RT_A','EMP_XFMG_NOC_RT_A','GDP_205U_NOC_NB_A','GDP_211P_NOC_NB_A','HOW_TEMP_NOC_NB_A','IFL_IECN_SEX_ECO_NB_A','ILR_CBCT_NOC_RT_A','ILR_TUMT_NOC_RT_A','INJ_TLPI_NOC_NB_A','LAC_TLAC_NOC_NB_A','LAC_XMFG_NOC_NB_A','LAI_INDE_NOC_RT_A','LAP_DGVA_NOC_RT_A','MFL_TEMP_OCU_NB_A','MST_TPOP_COU_NB_A','MST_TPOP_SEX_MIG_NB_A','POP_2FLF_NOC_RT_A','POP_2LDR_NOC_RT_A','POP_2MLF_NOC_RT_A','POP_2POP_GEO_NB_A','POP_2TLF_NOC_RT_A','POP_AEDA_NOC_RT_A','POV_DEMF_NOC_RT_A','POV_DEMM_NOC_RT_A','POV_DEMP_NOC_RT_A','POV_GT13_NOC_RT_A','POV_P2T3_NOC_RT_A','POV_P3T5_NOC_RT_A','POV_PLT1_NOC_RT_A','SDG_0111_SEX_AGE_RT_A','SDG_0131_SEX_SOC_RT_A','SDG_0552_OCU_RT_A','SDG_0821_NOC_RT_A','SDG_0851_SEX_OCU_NB_A','SDG_0852_SEX_AGE_RT_A','SDG_0861_SEX_RT_A','SDG_0871_SEX_AGE_NB_A','SDG_0871_SEX_AGE_RT_A','SDG_0922_NOC_RT_A','SDG_1041_NOC_RT_A','SDG_A831_SEX_RT_A','SDG_B831_SEX_RT_A','SDG_F881_SEX_MIG_RT_A','SDG_N881_SEX_MIG_RT_A','SOC_PEXN_NOC_RT_A','SOC_PPNT_NOC_RT_A','SOC_SOCT_NOC_RT_A','UNE_2EAP_NOC_RT_A','UNE_2URM_NOC_RT_A','UNE_2URW_NOC_RT_A','UNE_2YAP_NOC_RT_A','UNE_DEAF_NOC_RT_A','UNE_DEAM_NOC_RT_A','UNE_DEAP_NOC_RT_A','UNE_DYAF_NOC_RT_A','UNE_DYAM_NOC_RT_A','UNE_DYAP_NOC_RT_A','UNE_EDAD_NOC_RT_A','UNE_EDBS_NOC_RT_A','UNE_EDIN_NOC_RT_A','UNE_LGTD_NOC_RT_A']
 
@@ -224,9 +174,7 @@ for file in glob.glob(ilostat_downloads_indicator + "/*.gz"):
                     else:
                         data[var_code][row['ref_area']][source_abbr] += 1
 
-            if row_number % 100 == 0:
-                time.sleep(
-                    0.001)  # this is done in order to not keep the CPU busy all the time, the delay after each 100th row is 1 millisecond
+            governor.tick()
 
 preffered_sources = {}
 # selecting the most used source for each variable
@@ -291,7 +239,7 @@ with transaction.atomic():
         if country_code_names_dict[country_code] == 'Yugoslavia, The former Socialist Fed. Rep. of':
             country_code_names_dict[country_code] = 'Macedonia'
 
-    country_code_entity_object_ref = process_entities(country_code_names_dict)
+    entity_id_by_code = EntityResolver().entity_ids(country_code_names_dict)
 
     for file in glob.glob(ilostat_downloads_indicator + "/*.gz"):
         one_file = os.path.basename(file)
@@ -422,9 +370,7 @@ with transaction.atomic():
                             for eachnoteindicator in note_indicators_list:
                                 variables[variable_name]['note_indicator'].add(metadata['note_indicator'][eachnoteindicator]['note_indicator.label'])
 
-                    if row_number % 100 == 0:
-                        time.sleep(
-                                0.001)  # this is done in order to not keep the CPU busy all the time, the delay after each 100th row is 1 millisecond
+                    governor.tick()
 
                 varcode_to_object = {}
                 for varname, sourcedata in variables.items():
@@ -497,7 +443,7 @@ with transaction.atomic():
                                 varcode += ' ' + row['sex']
                             try:
                                 the_tuple = (str(float(row['obs_value'])), int(row['time']),
-                                                               country_code_entity_object_ref[row['ref_area']].pk, varcode_to_object[varcode].pk)
+                                                               entity_id_by_code[row['ref_area']], varcode_to_object[varcode].pk)
                                 if row['ref_area'] != 'DE1' and row['ref_area'] != 'DE2' and row['ref_area'] != 'YU1':
                                     # these country names cause duplicate errors
                                     data_values_tuple_list.append(the_tuple)
@@ -508,9 +454,7 @@ with transaction.atomic():
                                     c.executemany(insert_string, data_values_tuple_list)
                                 data_values_tuple_list = []
 
-                        if row_number % 100 == 0:
-                            time.sleep(
-                                0.001)  # this is done in order to not keep the CPU busy all the time, the delay after each 100th row is 1 millisecond
+                        governor.tick()
 
                 if len(data_values_tuple_list):  # insert any leftover data_values
                     with connection.cursor() as c:
@@ -654,9 +598,7 @@ with transaction.atomic():
                                     variables[variable_name]['note_indicator'].add(
                                         metadata['note_indicator'][eachnoteindicator]['note_indicator.label'])
 
-                        if row_number % 100 == 0:
-                            time.sleep(
-                                0.001)  # this is done in order to not keep the CPU busy all the time, the delay after each 100th row is 1 millisecond
+                        governor.tick()
 
                     varcode_to_object = {}
                     existing_sources = Source.objects.filter(datasetId__in=Dataset.objects.filter(namespace='ilostat'))
@@ -757,7 +699,7 @@ with transaction.atomic():
                                     varcode += ' ' + row['sex']
                                 try:
                                     the_tuple = (str(float(row['obs_value'])), int(row['time']),
-                                                 country_code_entity_object_ref[row['ref_area']].pk,
+                                                 entity_id_by_code[row['ref_area']],
                                                  varcode_to_object[varcode].pk)
                                     if row['ref_area'] != 'DE1' and row['ref_area'] != 'DE2' and row[
                                         'ref_area'] != 'YU1':
@@ -770,9 +712,7 @@ with transaction.atomic():
                                         c.executemany(insert_string, data_values_tuple_list)
                                     data_values_tuple_list = []
 
-                            if row_number % 100 == 0:
-                                time.sleep(
-                                    0.001)  # this is done in order to not keep the CPU busy all the time, the delay after each 100th row is 1 millisecond
+                            governor.tick()
 
                     if len(data_values_tuple_list):  # insert any leftover data_values
                         with connection.cursor() as c:
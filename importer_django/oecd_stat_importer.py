@@ -16,6 +16,9 @@ from django.utils import timezone
 from grapher_admin.views import write_dataset_csv
 import datetime
 from openpyxl import load_workbook
+from governor import Governor
+
+governor = Governor.from_env()
 
 
 oecd_downloads_save_location = settings.BASE_DIR + '/data/OECD/'
@@ -340,8 +343,7 @@ with transaction.atomic():
                                 c.executemany(insert_string, data_values_tuple_list)
                             data_values_tuple_list = []
 
-                        if row_number % 100 == 0:
-                            time.sleep(0.001)  # this is done in order to not keep the CPU busy all the time, the delay after each 100th row is 1 millisecond
+                        governor.tick()
 
             else:
                 varname_n_country_to_values = {}
@@ -598,9 +600,7 @@ with transaction.atomic():
                                     c.executemany(insert_string, data_values_tuple_list)
                                 data_values_tuple_list = []
 
-                            if row_number % 100 == 0:
-                                time.sleep(
-                                    0.001)  # this is done in order to not keep the CPU busy all the time, the delay after each 100th row is 1 millisecond
+                            governor.tick()
 
 
         if file_name not in ['EAG_FIN_RATIO_CATEGORY', 'EAG_NEAC', 'JOBQ', 'PAG']:
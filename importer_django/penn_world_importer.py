@@ -13,7 +13,8 @@ from django.db import connection, transaction
 from django.utils import timezone
 from grapher_admin.views import write_dataset_csv
 import datetime
-from openpyxl import load_workbook
+from xlsx_reader import XlsxReader
+from reshape import ROWS, COLUMNS, blocks, value_block, present_mask, wide_to_long
 
 
 penn_world_downloads_file = settings.BASE_DIR + '/data/penn_world/pwt_edited.xlsx'
@@ -70,13 +71,8 @@ with transaction.atomic():
 
     insert_string = 'INSERT into data_values (value, year, entityId, variableId) VALUES (%s, %s, %s, %s)'  # this is used for constructing the query for mass inserting to the data_values table
 
-    data_values_tuple_list = []
+    ws_rows = XlsxReader(penn_world_downloads_file)['Data'].rows
 
-    wb = load_workbook(filename=penn_world_downloads_file, read_only=True)
-    ws = wb['Data']
-
-    row_number = 0
-    column_number = 0
     col_number_to_var = {}
 
     subcategory_name = 'Penn World Table'
@@ -104,105 +100,105 @@ with transaction.atomic():
     else:
         newdataset = Dataset.objects.get(name=subcategory_name, categoryId=the_category)
 
-    for row in ws.rows:
-        row_number += 1
-        for cell in row:
-            column_number += 1
-
-            if row_number == 2 and column_number > 3:
-                if cell.value:
-                    col_number_to_var[column_number] = {
-                        "varname": cell.value,
-                        "unit": ''
-                    }
-
-            if row_number == 3 and column_number > 3:
-                if cell.value:
-                    col_number_to_var[column_number]['unit'] = cell.value
-
-            if row_number == 4 and column_number == 1:
-                for key, value in col_number_to_var.items():
-                    source_name = value['varname']
-                    if source_name == 'Productivity (GDP per hour worked)':
-                        source_description['additionalInfo'] = 'This variable has been calculated by Our World in Data, using Penn metrics for total GDP, the number of the given population engaged in work, and the average hours per worker engaged'
-                    else:
-                        source_description['additionalInfo'] = None
-                    if source_name not in source_name_to_object:
-                        newsource = Source(name=source_name,
-                                           description=json.dumps(source_description),
-                                           datasetId=newdataset.pk)
-                        newsource.save()
-                        source_name_to_object[source_name] = newsource
-                    else:
-                        newsource = Source.objects.get(name=source_name, datasetId=newdataset.pk)
-                        newsource.description = json.dumps(source_description)
-                        newsource.save()
-                        source_name_to_object[source_name] = newsource
-
-                    variable_name = value['varname']
-                    if variable_name.lower() not in existing_variables_list:
-                        newvariable = Variable(name=variable_name,
-                                               unit=value['unit'],
-                                               code=None,
-                                               datasetId=newdataset, variableTypeId=VariableType.objects.get(pk=4),
-                                               sourceId=source_name_to_object[source_name])
-                        newvariable.save()
-                        variable_name_to_object[variable_name.lower()] = newvariable
-                        existing_variables_list.add(newvariable.name.lower())
-                    else:
-                        if variable_name.lower() not in variable_name_to_object:
-                            newvariable = Variable.objects.get(name=variable_name, datasetId=newdataset)
-                            while DataValue.objects.filter(variableId__pk=newvariable.pk).first():
-                                with connection.cursor() as c:  # if we don't limit the deleted values, the db might just hang
-                                    c.execute('DELETE FROM %s WHERE variableId = %s LIMIT 10000;' %
-                                              (DataValue._meta.db_table, newvariable.pk))
-                            variable_name_to_object[variable_name.lower()] = newvariable
-
-            if row_number > 3:
-                if column_number == 2:
-                    country_col = cell.value
-                if column_number == 3:
-                    year = cell.value
-                if column_number > 3:
-                    if cell.value:
-                        data_value = float(cell.value)
-                        if country_col not in c_name_entity_ref:
-                            if country_col == 'Global':
-                                newentity = Entity.objects.get(name='World')
-                            elif country_col == 'D.R. of the Congo':
-                                newentity = Entity.objects.get(name='Democratic Republic of Congo')
-                            elif country_col == 'U.R. of Tanzania: Mainland':
-                                newentity = Entity.objects.get(name='Tanzania')
-                            elif country_col == 'TFYR of Macedonia':
-                                newentity = Entity.objects.get(name='Macedonia')
-                            elif country_col == 'Lao People\'s DR':
-                                newentity = Entity.objects.get(name='Laos')
-                            elif country_tool_names_dict.get(unidecode.unidecode(country_col.lower()), 0):
-                                newentity = Entity.objects.get(
-                                    name=country_tool_names_dict[unidecode.unidecode(country_col.lower())].owid_name)
-                            elif country_col.lower() in existing_entities_list:
-                                newentity = Entity.objects.get(name__iexact=country_col)
-                            else:
-                                newentity = Entity(name=country_col, validated=False)
-                                newentity.save()
-                            c_name_entity_ref[country_col] = newentity
-
-                        data_values_tuple_list.append((str(data_value), int(year),
-                                                       c_name_entity_ref[country_col].pk,
-                                                       variable_name_to_object[col_number_to_var[column_number]['varname'].lower()].pk))
-
-                        if len(data_values_tuple_list) > 3000:  # insert when the length of the list goes over 3000
-
-                            with connection.cursor() as c:
-                                c.executemany(insert_string, data_values_tuple_list)
-                            data_values_tuple_list = []
-
-        column_number = 0
-
-    if len(data_values_tuple_list):  # insert any leftover data_values
-        with connection.cursor() as c:
-            c.executemany(insert_string, data_values_tuple_list)
-        data_values_tuple_list = []
+    next(ws_rows)  # the first row holds the title of the table
+    for column_number, value in enumerate(next(ws_rows)):
+        if column_number > 2:
+            if value:
+                col_number_to_var[column_number] = {
+                    "varname": value,
+                    "unit": ''
+                }
+
+    for column_number, value in enumerate(next(ws_rows)):
+        if column_number > 2:
+            if value:
+                col_number_to_var[column_number]['unit'] = value
+
+    for key, value in col_number_to_var.items():
+        source_name = value['varname']
+        if source_name == 'Productivity (GDP per hour worked)':
+            source_description['additionalInfo'] = 'This variable has been calculated by Our World in Data, using Penn metrics for total GDP, the number of the given population engaged in work, and the average hours per worker engaged'
+        else:
+            source_description['additionalInfo'] = None
+        if source_name not in source_name_to_object:
+            newsource = Source(name=source_name,
+                               description=json.dumps(source_description),
+                               datasetId=newdataset.pk)
+            newsource.save()
+            source_name_to_object[source_name] = newsource
+        else:
+            newsource = Source.objects.get(name=source_name, datasetId=newdataset.pk)
+            newsource.description = json.dumps(source_description)
+            newsource.save()
+            source_name_to_object[source_name] = newsource
+
+        variable_name = value['varname']
+        if variable_name.lower() not in existing_variables_list:
+            newvariable = Variable(name=variable_name,
+                                   unit=value['unit'],
+                                   code=None,
+                                   datasetId=newdataset, variableTypeId=VariableType.objects.get(pk=4),
+                                   sourceId=source_name_to_object[source_name])
+            newvariable.save()
+            variable_name_to_object[variable_name.lower()] = newvariable
+            existing_variables_list.add(newvariable.name.lower())
+        else:
+            if variable_name.lower() not in variable_name_to_object:
+                newvariable = Variable.objects.get(name=variable_name, datasetId=newdataset)
+                while DataValue.objects.filter(variableId__pk=newvariable.pk).first():
+                    with connection.cursor() as c:  # if we don't limit the deleted values, the db might just hang
+                        c.execute('DELETE FROM %s WHERE variableId = %s LIMIT 10000;' %
+                                  (DataValue._meta.db_table, newvariable.pk))
+                variable_name_to_object[variable_name.lower()] = newvariable
+
+    var_columns = sorted(col_number_to_var)
+    var_ids = [variable_name_to_object[col_number_to_var[column_number]['varname'].lower()].pk
+               for column_number in var_columns]
+
+    # the rest of the rows hold a country and a year, and a column for each
+    # variable; they are reshaped a block at a time, see reshape.py
+    for rows in blocks(ws_rows):
+        values = value_block(rows, columns=var_columns)
+        rows_with_values = [any(present) for present in present_mask(values, missing=(None, '', 0))]
+        entity_ids = []
+        for row, has_values in zip(rows, rows_with_values):
+            if not has_values:
+                entity_ids.append(None)
+                continue
+            country_col = row[1]
+            if country_col not in c_name_entity_ref:
+                if country_col == 'Global':
+                    newentity = Entity.objects.get(name='World')
+                elif country_col == 'D.R. of the Congo':
+                    newentity = Entity.objects.get(name='Democratic Republic of Congo')
+                elif country_col == 'U.R. of Tanzania: Mainland':
+                    newentity = Entity.objects.get(name='Tanzania')
+                elif country_col == 'TFYR of Macedonia':
+                    newentity = Entity.objects.get(name='Macedonia')
+                elif country_col == 'Lao People\'s DR':
+                    newentity = Entity.objects.get(name='Laos')
+                elif country_tool_names_dict.get(unidecode.unidecode(country_col.lower()), 0):
+                    newentity = Entity.objects.get(
+                        name=country_tool_names_dict[unidecode.unidecode(country_col.lower())].owid_name)
+                elif country_col.lower() in existing_entities_list:
+                    newentity = Entity.objects.get(name__iexact=country_col)
+                else:
+                    newentity = Entity(name=country_col, validated=False)
+                    newentity.save()
+                c_name_entity_ref[country_col] = newentity
+            entity_ids.append(c_name_entity_ref[country_col].pk)
+
+        data_values_tuple_list = [
+            (str(float(value)), int(year), entity_id, variable_id)
+            for value, year, entity_id, variable_id in wide_to_long(
+                values, (ROWS, [row[2] for row in rows]), (ROWS, entity_ids), (COLUMNS, var_ids),
+                missing=(None, '', 0)
+            )
+        ]
+
+        for i in range(0, len(data_values_tuple_list), 3000):  # insert 3000 at a time
+            with connection.cursor() as c:
+                c.executemany(insert_string, data_values_tuple_list[i:i + 3000])
 
 # for dataset in existing_datasets_list:
 #     write_dataset_csv(dataset.pk, dataset.name, dataset.name, 'gbd_cause_fetcher', '')
@@ -4,20 +4,23 @@ import os
 import hashlib
 import json
 import logging
-import requests
-import unidecode
-import shutil
 import time
 import django.db.utils
 sys.path.insert(1, os.path.join(sys.path[0], '..'))
 import grapher_admin.wsgi
-from grapher_admin.models import Entity, DatasetSubcategory, DatasetCategory, Dataset, Source, Variable, VariableType, DataValue, ChartDimension
+from grapher_admin.models import DatasetSubcategory, DatasetCategory, Dataset, Source, Variable, VariableType, DataValue, ChartDimension
 from importer.models import ImportHistory
-from country_name_tool.models import CountryName
 from django.conf import settings
 from django.db import connection, transaction
 from django.utils import timezone
 from grapher_admin.views import write_dataset_csv
+from governor import Governor
+from download_cache import DownloadCache, DownloadError
+from reshape import ROWS, COLUMNS, blocks, value_block, wide_to_long
+from entity_resolver import EntityResolver
+
+governor = Governor.from_env()
+download_cache = DownloadCache()
 
 
 # we will use the file checksum to check if the downloaded file has changed since we last saw it
@@ -32,6 +35,36 @@ def file_checksum(filename, blocksize=2**20):
     return m.hexdigest()
 
 
+# Inserts the data values of the csv file, which has a column for each
+# variable, and returns how many were inserted. The rows are reshaped a block
+# at a time, see reshape.py.
+def insert_data_values(entity_id_by_name, vars_ref_models):
+    insert_string = 'INSERT into data_values (value, year, entityId, variableId) VALUES (%s, %s, %s, %s)'  # this is used for constructing the query for mass inserting to the data_values table
+    total_data_values = 0
+    with open(qog_downloads_save_location + 'qog.csv') as csvfile:
+        reader = csv.reader(csvfile)
+        headers = next(reader)
+        year_column = headers.index('year')
+        cname_column = headers.index('cname')
+        var_columns = [column for column, header in enumerate(headers)
+                       if header not in not_var_fields and header in vars_ref_models]
+        var_ids = [vars_ref_models[headers[column]].pk for column in var_columns]
+        for rows in blocks(reader):
+            data_values_tuple_list = wide_to_long(
+                value_block(rows, columns=var_columns),
+                (ROWS, [row[year_column] for row in rows]),
+                (ROWS, [entity_id_by_name[row[cname_column]] for row in rows]),
+                (COLUMNS, var_ids)
+            )
+            for i in range(0, len(data_values_tuple_list), 3000):  # insert 3000 at a time
+                with connection.cursor() as dbconnection:
+                    dbconnection.executemany(insert_string, data_values_tuple_list[i:i + 3000])
+                logger.info("Dumping data values...")
+            total_data_values += len(data_values_tuple_list)
+            governor.tick(len(rows))
+    return total_data_values
+
+
 source_description = {
     'dataPublishedBy': "The Quality of Government Institute",
     'retrievedDate': timezone.now().strftime("%d-%B-%y")
@@ -42,28 +75,27 @@ qog_metadata_file = settings.BASE_DIR + '/data/qog/metadata/qog_metadata.csv'  #
 qog_downloads_save_location = settings.BASE_DIR + '/data/qog/downloads/'
 
 # create a directory for holding the downloads
-# if the directory exists, delete it and recreate it
 
 if not os.path.exists(qog_downloads_save_location):
     os.makedirs(qog_downloads_save_location)
-else:
-    shutil.rmtree(qog_downloads_save_location)
-    os.makedirs(qog_downloads_save_location)
 
 logger = logging.getLogger('importer')
 start_time = time.time()
 
 logger.info("Getting the csv file")
 request_header = {'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_10_1) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/39.0.2171.95 Safari/537.36'}
-r = requests.get(qog_file_url, stream=True, headers=request_header)
-if r.ok:
-    with open(qog_downloads_save_location + 'qog.csv', 'wb') as out_file:
-        shutil.copyfileobj(r.raw, out_file)
-    r = None  # we do not need the request anymore
-else:
+try:
+    download = download_cache.fetch(qog_file_url, path=qog_downloads_save_location + 'qog.csv', headers=request_header)
+except DownloadError:
     logger.error("The file could not be downloaded. Stopping the script...")
     sys.exit("Could not download file.")
 
+# stop before parsing anything if the last import was of the same file
+last_import = ImportHistory.objects.filter(import_type='qog').last()
+if last_import and download.unchanged_since(json.loads(last_import.import_state).get('file_hash')):
+    logger.info("No new data available. Exiting...")
+    sys.exit('No updates available.')
+
 
 # apart from the main data file itself, we need QoG's metadata file that contains source and variable information
 if not os.path.isfile(qog_metadata_file):
@@ -167,15 +199,7 @@ with transaction.atomic():
                 the_subcategory = DatasetSubcategory.objects.get(name=value, categoryId=the_category)
             categories_ref_models[value] = the_subcategory
 
-        existing_entities = Entity.objects.values('name')
-        existing_entities_list = {item['name'] for item in existing_entities}
-
-        country_tool_names = CountryName.objects.all()
-        country_tool_names_dict = {}
-        for each in country_tool_names:
-            country_tool_names_dict[each.country_name.lower()] = each.owid_country
-
-        country_name_entity_ref = {}  # this dict will hold the country names from csv and the appropriate entity object (this is used when saving the variables and their values)
+        country_names_from_csv = {}  # the country names in the csv file, and the names of their entities
         country_list_from_csv = {}  # the list of countries taken from the csv file
 
         with open(qog_downloads_save_location + 'qog.csv') as csvfile:
@@ -192,17 +216,9 @@ with transaction.atomic():
                                            '').strip()  # removing the parenthesis and year from current country names
             else:
                 country_name = key
+            country_names_from_csv[key] = country_name
 
-            if country_tool_names_dict.get(unidecode.unidecode(country_name.lower()), 0):
-                newentity = Entity.objects.get(
-                    name=country_tool_names_dict[unidecode.unidecode(country_name.lower())].owid_name)
-            elif country_name in existing_entities_list:
-                newentity = Entity.objects.get(name=country_name)
-            else:
-                newentity = Entity(name=country_name, validated=False)
-                newentity.save()
-                logger.info("Inserting a country %s." % newentity.name.encode('utf8'))
-            country_name_entity_ref[key] = newentity
+        entity_id_by_name = EntityResolver().entity_ids(country_names_from_csv)  # the entity of every country name in the csv file
 
         for key, category in abbr_category_names.items():
             newdataset = Dataset(name='QoG - ' + category,
@@ -269,33 +285,8 @@ with transaction.atomic():
             logger.info("Inserting a variable %s." % newvariable.name.encode('utf8'))
             vars_ref_models[varcode] = newvariable
 
-        insert_string = 'INSERT into data_values (value, year, entityId, variableId) VALUES (%s, %s, %s, %s)'  # this is used for constructing the query for mass inserting to the data_values table
-        data_values_tuple_list = []
-
         # now saving the data values
-        with open(qog_downloads_save_location + 'qog.csv') as csvfile:
-            reader = csv.DictReader(csvfile)
-            headers = reader.fieldnames
-            for row in reader:
-                for header in headers:
-                    if (header not in not_var_fields) and (row[header]):
-                        data_values_tuple_list.append((row[header], row['year'],
-                                                       country_name_entity_ref[row['cname']].pk,
-                                                       vars_ref_models[header].pk))
-                        total_data_values += 1
-                if len(data_values_tuple_list) > 3000:  # insert when the length of the list goes over 3000
-                    with connection.cursor() as dbconnection:
-                        dbconnection.executemany(insert_string, data_values_tuple_list)
-                    logger.info("Dumping data values...")
-                    data_values_tuple_list = []
-
-                if reader.line_num % 10 == 0:
-                    time.sleep(0.001)  # this is done in order to not keep the CPU busy all the time, the delay after each 10th row is 1 millisecond
-
-        if len(data_values_tuple_list):  # insert any leftover data_values
-            with connection.cursor() as dbconnection:
-                dbconnection.executemany(insert_string, data_values_tuple_list)
-                logger.info("Dumping data values...")
+        total_data_values += insert_data_values(entity_id_by_name, vars_ref_models)
 
         logger.info("Imported a total of %s data values." % total_data_values)
 
@@ -399,15 +390,7 @@ with transaction.atomic():
                 the_subcategory = DatasetSubcategory.objects.get(name=value, categoryId=the_category)
             categories_ref_models[value] = the_subcategory
 
-        existing_entities = Entity.objects.values('name')
-        existing_entities_list = {item['name'] for item in existing_entities}
-
-        country_tool_names = CountryName.objects.all()
-        country_tool_names_dict = {}
-        for each in country_tool_names:
-            country_tool_names_dict[each.country_name.lower()] = each.owid_country
-
-        country_name_entity_ref = {}  # this dict will hold the country names from csv and the appropriate entity object (this is used when saving the variables and their values)
+        country_names_from_csv = {}  # the country names in the csv file, and the names of their entities
         country_list_from_csv = {}  # the list of countries taken from the csv file
 
         with open(qog_downloads_save_location + 'qog.csv') as csvfile:
@@ -424,17 +407,9 @@ with transaction.atomic():
                                            '').strip()  # removing the parenthesis and year from current country names
             else:
                 country_name = key
+            country_names_from_csv[key] = country_name
 
-            if country_tool_names_dict.get(unidecode.unidecode(country_name.lower()), 0):
-                newentity = Entity.objects.get(
-                    name=country_tool_names_dict[unidecode.unidecode(country_name.lower())].owid_name)
-            elif country_name in existing_entities_list:
-                newentity = Entity.objects.get(name=country_name)
-            else:
-                newentity = Entity(name=country_name, validated=False)
-                newentity.save()
-                logger.info("Inserting a country %s." % newentity.name.encode('utf8'))
-            country_name_entity_ref[key] = newentity
+        entity_id_by_name = EntityResolver().entity_ids(country_names_from_csv)  # the entity of every country name in the csv file
 
         for key, category in abbr_category_names.items():
             if category not in existing_subcategories_list:
@@ -659,33 +634,8 @@ with transaction.atomic():
                         c.execute('DELETE FROM %s WHERE variableId = %s LIMIT 10000;' %
                                   (DataValue._meta.db_table, variable.pk))
 
-        insert_string = 'INSERT into data_values (value, year, entityId, variableId) VALUES (%s, %s, %s, %s)'  # this is used for constructing the query for mass inserting to the data_values table
-        data_values_tuple_list = []
-
         # now saving the data values
-        with open(qog_downloads_save_location + 'qog.csv') as csvfile:
-            reader = csv.DictReader(csvfile)
-            headers = reader.fieldnames
-            for row in reader:
-                for header in headers:
-                    if (header not in not_var_fields) and (row[header]):
-                        data_values_tuple_list.append((row[header], row['year'],
-                                                       country_name_entity_ref[row['cname']].pk,
-                                                       vars_ref_models[header].pk))
-                        total_data_values += 1
-                if len(data_values_tuple_list) > 3000:  # insert when the length of the list goes over 3000
-                    with connection.cursor() as dbconnection:
-                        dbconnection.executemany(insert_string, data_values_tuple_list)
-                    logger.info("Dumping data values...")
-                    data_values_tuple_list = []
-
-                if reader.line_num % 10 == 0:
-                    time.sleep(0.001)  # this is done in order to not keep the CPU busy all the time, the delay after each 10th row is 1 millisecond
-
-        if len(data_values_tuple_list):  # insert any leftover data_values
-            with connection.cursor() as dbconnection:
-                dbconnection.executemany(insert_string, data_values_tuple_list)
-                logger.info("Dumping data values...")
+        total_data_values += insert_data_values(entity_id_by_name, vars_ref_models)
 
         # now deleting subcategories and datasets that are empty (that don't contain any variables), if any
 
@@ -1,3 +1,167 @@
+import os
+import sys
+import shutil
+import tempfile
 from django.test import TestCase
+from openpyxl import Workbook
+from grapher_admin.models import Dataset, DataValue, Entity, Tag, Variable
+from country_name_tool.models import CountryData, CountryName
 
-# Create your tests here.
+# the importers import their modules from this directory
+sys.path.insert(1, os.path.dirname(os.path.realpath(__file__)))
+from xlsx_reader import XlsxReader
+from entity_resolver import EntityResolver
+from worldbank_engine import WorldBankImporter, SERIES_EXPECTED_HEADERS, DATA_EXPECTED_HEADERS
+
+# A small databank workbook: two indicators of the Series sheet, and a Data
+# sheet with a row for an indicator that the Series sheet doesn't have
+def series_row(code, topic, name):
+    row = dict.fromkeys(SERIES_EXPECTED_HEADERS)
+    row.update({
+        'Series Code': code,
+        'Topic': topic,
+        'Indicator Name': name,
+        'Long definition': 'The definition of %s' % name,
+        'Source': 'The source of %s' % name,
+    })
+    return tuple(row[header] for header in SERIES_EXPECTED_HEADERS)
+
+SERIES_ROWS = [
+    SERIES_EXPECTED_HEADERS,
+    series_row('SP.POP.TOTL', 'Health: Population: Structure', 'Population, total'),
+    series_row('NY.GDP.MKTP.CD', 'Economic Policy & Debt: National accounts', 'GDP (current US$)'),
+]
+DATA_ROWS = [
+    DATA_EXPECTED_HEADERS + ('1990', '1991'),
+    ('Chad', 'TCD', 'Population, total', 'SP.POP.TOTL', 100, 110),
+    ('Chad', 'TCD', 'GDP (current US$)', 'NY.GDP.MKTP.CD', None, 2.5),
+    ('Peru', 'PER', 'Population, total', 'SP.POP.TOTL', 200, None),
+    ('Peru', 'PER', 'An indicator that is not in the Series sheet', 'XX.UNKNOWN', 1, 2),
+]
+
+
+class WorldBankImporterTests(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.importer = WorldBankImporter(
+            namespace='testbank',
+            tag_name='Test Bank',
+            zip_file_url='http://databank.example.com/testbank.zip',
+            label='Test Bank',
+            published_by='World Bank Test Bank',
+            link='http://databank.example.com',
+            split_topics=True,
+        )
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def import_workbook(self, data_rows):
+        filepath = os.path.join(self.directory, 'testbank.xlsx')
+        wb = Workbook()
+        wb.remove(wb.active)
+        for title, rows in (('Series', SERIES_ROWS), ('Data', data_rows)):
+            ws = wb.create_sheet(title)
+            for row in rows:
+                ws.append(row)
+        wb.save(filepath)
+        with XlsxReader(filepath) as reader:
+            return self.importer.import_workbook(reader)
+
+    def data_values(self):
+        return set(DataValue.objects.filter(variableId__datasetId__namespace='testbank').values_list(
+            'entityId__name', 'variableId__code', 'year', 'value'
+        ))
+
+    def test_import_workbook(self):
+        self.assertEqual(self.import_workbook(DATA_ROWS), 4)
+
+        self.assertEqual(self.data_values(), {
+            ('Chad', 'SP.POP.TOTL', 1990, '100'),
+            ('Chad', 'SP.POP.TOTL', 1991, '110'),
+            ('Chad', 'NY.GDP.MKTP.CD', 1991, '2.5'),
+            ('Peru', 'SP.POP.TOTL', 1990, '200'),
+        })
+        self.assertEqual(
+            set(Variable.objects.filter(datasetId__namespace='testbank').values_list('code', 'unit', 'short_unit', 'datasetId__name')),
+            {
+                ('SP.POP.TOTL', '', None, 'Test Bank - Health'),
+                ('NY.GDP.MKTP.CD', 'current US$', '$', 'Test Bank - Economic Policy & Debt'),
+            }
+        )
+        self.assertEqual(
+            set(Dataset.objects.filter(namespace='testbank').values_list('name', flat=True)),
+            set(Tag.objects.filter(parent_id__name='Test Bank').values_list('name', flat=True))
+        )
+
+    def test_reimport_replaces_the_data_values(self):
+        self.import_workbook(DATA_ROWS)
+        variable_ids = dict(Variable.objects.filter(datasetId__namespace='testbank').values_list('code', 'id'))
+
+        self.assertEqual(self.import_workbook([
+            DATA_ROWS[0],
+            ('Chad', 'TCD', 'Population, total', 'SP.POP.TOTL', 100, 120),
+            ('Chad', 'TCD', 'GDP (current US$)', 'NY.GDP.MKTP.CD', None, 2.5),
+        ]), 3)
+
+        self.assertEqual(self.data_values(), {
+            ('Chad', 'SP.POP.TOTL', 1990, '100'),
+            ('Chad', 'SP.POP.TOTL', 1991, '120'),
+            ('Chad', 'NY.GDP.MKTP.CD', 1991, '2.5'),
+        })
+        # the variables are matched by code, and keep their ids
+        self.assertEqual(dict(Variable.objects.filter(datasetId__namespace='testbank').values_list('code', 'id')), variable_ids)
+
+
+class EntityResolverTests(TestCase):
+
+    def setUp(self):
+        self.entity_ids = {}
+        for name in ('Chad', 'Peru', 'World', 'Congo', 'Democratic Republic of Congo'):
+            self.entity_ids[name] = Entity.objects.create(name=name, validated=True).pk
+        for country_name, owid_name in (('Republic of Chad', 'Chad'), ('Congo', 'Democratic Republic of Congo')):
+            owid_country, _ = CountryData.objects.get_or_create(owid_name=owid_name)
+            CountryName.objects.create(country_name=country_name, owid_country=owid_country)
+
+    def test_country_tool_names(self):
+        self.assertEqual(EntityResolver().entity_ids({'TCD': 'Republic of Chad', 'COD': 'Congo'}), {
+            'TCD': self.entity_ids['Chad'],
+            'COD': self.entity_ids['Democratic Republic of Congo'],
+        })
+
+    def test_ignores_case(self):
+        self.assertEqual(EntityResolver().entity_ids({'PER': 'PERU', 'TCD': 'republic of chad'}), {
+            'PER': self.entity_ids['Peru'],
+            'TCD': self.entity_ids['Chad'],
+        })
+
+    def test_entity_names_first(self):
+        resolver = EntityResolver(entity_names_first=True)
+        self.assertEqual(resolver.entity_ids({'COG': 'Congo', 'TCD': 'Republic of Chad'}), {
+            'COG': self.entity_ids['Congo'],
+            'TCD': self.entity_ids['Chad'],
+        })
+
+    def test_aliases(self):
+        resolver = EntityResolver(aliases={'Global': 'World', 'Democratic Republic of Congo': 'Peru'})
+        self.assertEqual(resolver.entity_ids({'WLD': 'Global', 'COD': 'Congo'}), {
+            'WLD': self.entity_ids['World'],
+            'COD': self.entity_ids['Peru'],
+        })
+
+    def test_creates_the_missing_entities_at_once(self):
+        resolver = EntityResolver()
+        with self.assertNumQueries(2):
+            entity_ids = resolver.entity_ids({'ATL': 'Atlantis', 'atl': 'ATLANTIS', 'LMR': 'Lemuria', 'TCD': 'Chad'})
+        new_entities = dict(Entity.objects.filter(name__in=['Atlantis', 'Lemuria']).values_list('name', 'pk'))
+        self.assertEqual(entity_ids, {
+            'ATL': new_entities['Atlantis'],
+            'atl': new_entities['Atlantis'],
+            'LMR': new_entities['Lemuria'],
+            'TCD': self.entity_ids['Chad'],
+        })
+        self.assertFalse(Entity.objects.get(name='Atlantis').validated)
+        # and they are not created again
+        with self.assertNumQueries(0):
+            self.assertEqual(resolver.entity_ids({'ATL': 'atlantis'}), {'ATL': new_entities['Atlantis']})
@@ -14,6 +14,9 @@ from django.db import connection, transaction
 from django.utils import timezone
 from grapher_admin.views import write_dataset_csv
 from openpyxl import load_workbook
+from governor import Governor
+
+governor = Governor.from_env()
 
 files_to_process = ['forest_biomass_above_ground','waste_municipal_total','glob_amph_critical','glob_amph_endangered','glob_amph_evaluated','glob_amph_percent','glob_amph_threatened','glob_amph_vulnerable','glob_animals_evaluated','glob_animals_percent','glob_animals_threatened','aquacult_prod_freshwater_fish','aquacult_prod_freshwater_value','aquacult_prod_marine_fish','aquacult_prod_marine_value','aquacult_prod_total','aquacult_prod_total_value','area_salinized','carbon_soil','forest_biomass_below_ground','glob_bird_critical','glob_bird_endangered','glob_bird_evaluated','glob_bird_percent','glob_bird_threatened','glob_bird_vulnerable','blue_water','forest_carbon_above_ground','forest_carbon_below_ground','reg_bod_tot_gems','reg_nitro_tot_gems','pm10_country','conservation_agriculture','ozone_all','ozone_ctc','ozone_cfc','ozone_halon','ozone_hcfc','ozone_meth_bromide','ozone_meth_chloro','continental_shelf','cnty_area','glob_crust_evaluated','glob_crust_percent','glob_crust_threatened','water_desalinated','mortality_resp_infections','active_pop','pop_agriculture','pop_agriculture_female','pop_agriculture_male','ele_distri','ele_dom','ele_nucl','ele_prod','ele_tps','ele_resid','ele_trans','emissions_so2_total_rivm','so2_unfccc_exc','so2_unfccc_inc','energy_road_total','energy_transport_total','prod_biodiesel','prod_biogasoline','energy_prod_comb_renew','energy_prod_crudeoil','energy_prod_hydro','energy_prod_naturalgas','energy_prod_nuclear','prod_biofuels_other','energy_prod_indig','efz','fish_catch_freshwater','fish_catch_marine','fish_catch','glob_fish_stock_fexp','glob_fish_stock_nexp','glob_fish_stock_oexp','fish_fresh_prod','fish_marine_value','fish_total_prod','glob_fishes_critical','glob_fishes_endangered','glob_fishes_evaluated','glob_fishes_percent','glob_fishes_threatened','glob_fishes_vulnerable','forest_area','forest_extent_change_tot','forest_fire_extent','forest_rate','forest_plantation_change','forest_plantation_extent','forest_cons','forest_prod','forest_prot','forest_fsc_extent','forest_pefc_area','forest_pefc_nb','glob_temperature','glob_temp_changes','glob_ghg_atm_live','glob_land_surface_temperature_live','glob_sea_level','glob_sea_level_live','glob_sea_level_uc','glob_sea_surface_temperature_live','green_water','grey_water','groundwater_recharge_int','forest_stock','pesticide_hazardous_export','pesticide_hazardous_import','glob_insects_critical','glob_insects_endangered','glob_insects_evaluated','glob_insects_percent','glob_insects_threatened','glob_insects_vulnerable','coastline_length','glob_living_planet_freshwater','glob_living_planet','glob_living_planet_marine','glob_living_planet_temperate','glob_living_planet_terrestrial','glob_living_planet_tropical','glob_mam_critical','glob_mam_endangered','glob_mam_evaluated','glob_mam_percent','glob_mam_threatened','glob_mam_vulnerable','mangroves_total','glob_mollusc_critical','glob_mollusc_endangered','glob_mollusc_evaluated','glob_mollusc_percent','glob_mollusc_threatened','glob_mollusc_vulnerable','waste_munic','reactors_op_pow','reactors_op_nb','reactors_cons_pow','reactors_cons_nb','reactors_op_pow','reactors_op_nb','reactors_cons_pow','reactors_cons_nb','unhcr_asylum','unhcr_idps','glob_all_treaties','unhcr_refugees','basel','cbd','cites','cms','kyoto','ramsar_convention','rotterdam','stockholm','unclos','unccd','unfccc','ozone_treaty','heritage_convention','food_production_variability','food_supply_variability','pesticide_cons_fong_bact','pesticide_consump_herbicides','pesticide_consump_insecticides','pesticide_consump_oils','pesticide_consump_plant','pesticide_consump_rodenticides','glob_plants_critical','glob_plants_endangered','glob_plants_evaluated','glob_plants_percent','glob_plants_threatened','glob_plants_vulnerable','glob_plastic_prod','pop_100km_coast','forest_primary_change','forest_primary_extent','water_waste_muni','marine_uncl_prot_ratio','marine_uncl_prot_tot','land_uncl_prot_ratio','land_uncl_prot_tot','terr_prot_ratio','terr_protected_tot','rail_km','rails_good','railways_passenger','refugees_asylum_tot','refugees_origine_total','glob_en_supply_index_biof','glob_en_supply_index_geo','glob_en_supply_index_hydro','glob_en_supply_index_solar','glob_en_supply_index_tiw','glob_en_supply_index_wind','glob_en_supply_index_wind','cholera_cases_nb','cholera_deaths_nb','glob_reptile_critical','glob_reptile_endangered','glob_reptile_evaluated','glob_reptile_percent','glob_reptile_threatened','glob_reptile_vulnerable','glob_sea_ice_area_north_live','glob_sea_ice_area_south_live','glob_sea_ice_extent_north_live','glob_sea_ice_extent_south_live','glob_sea_ice_extent','surface_water','dam_tot_cap','forest_total_extent','tpes_coal','tpes_comb_renew_waste','tpes_crude_oil','tpes_geotherm','tpes_hydro','tpes_natgas','tpes_nuclear','tpes_petroleum','tpes_solar','tpes_total','water_ground_renew','water_surface_water_renew','water_waste_muni_treated','wat_treat_waste_res','waste_glass','waste_paper','water_footprint','water_footprint_agri','water_footprint_ind','water_footprint_dom','water_dep_ratio','surface_groundwater','water_tot_exploit','water_tot_ext','water_external_renewable','water_resources_total','water_tot_renev','water_use_agri','water_use_agri_perc_renew','water_use_agri_perc_withdrawal','water_use_perc_renew','water_use_ind','water_use_ind_perc_withdrawal','water_use_dom','water_use_muni_perc_withdrawal','groundwat_withdraw_tot','surfacewater_withdrawal','water_use_total','ramsar_area','ramsar_number','whs_number']
 
@@ -277,9 +280,7 @@ with transaction.atomic():
                                 c.executemany(insert_string, data_values_tuple_list)
                             data_values_tuple_list = []
 
-                        if row_number % 100 == 0:
-                            time.sleep(
-                                0.001)  # this is done in order to not keep the CPU busy all the time, the delay after each 100th row is 1 millisecond
+                        governor.tick()
 
         if len(data_values_tuple_list):  # insert any leftover data_values
             with connection.cursor() as c:
@@ -1,21 +1,24 @@
 import sys
 import os
 import json
-import unidecode
 import time
 import csv
 import glob
 sys.path.insert(1, os.path.join(sys.path[0], '..'))
 import grapher_admin.wsgi
-from grapher_admin.models import Entity, DatasetSubcategory, DatasetCategory, Dataset, Source, Variable, VariableType, DataValue
+from grapher_admin.models import DatasetSubcategory, DatasetCategory, Dataset, Source, Variable, VariableType, DataValue
 from importer.models import ImportHistory
-from country_name_tool.models import CountryName
 from django.conf import settings
 from django.db import connection, transaction
 from django.utils import timezone
 from grapher_admin.views import write_dataset_csv
 import requests
 import lxml.html
+from governor import Governor
+from entity_resolver import EntityResolver
+
+governor = Governor.from_env()
+
 # import pdfminer.high_level
 # import pdfminer.settings
 # pdfminer.settings.STRICT = False
@@ -128,16 +131,8 @@ with transaction.atomic():
 
     variable_name_to_object = {}
 
-    existing_entities = Entity.objects.values('name')
-    existing_entities_list = {item['name'].lower() for item in existing_entities}
-
-    country_tool_names = CountryName.objects.all()
-    country_tool_names_dict = {}
-
-    for each_country in country_tool_names:
-        country_tool_names_dict[each_country.country_name.lower()] = each_country.owid_country
-
-    c_name_entity_ref = {}  # this dict will hold the country names from excel and the appropriate entity object (this is used when saving the variables and their values)
+    # the country tool has lost the accents of these names
+    entity_resolver = EntityResolver(aliases={'Global': 'World', 'Saint Barthlemy': 'Saint Barthélemy', 'land Islands': 'Åland Islands'})
 
     insert_string = 'INSERT into data_values (value, year, entityId, variableId) VALUES (%s, %s, %s, %s)'  # this is used for constructing the query for mass inserting to the data_values table
 
@@ -158,11 +153,13 @@ with transaction.atomic():
 
         columns_to_include = []
         varnames = []
+        country_names = set()
 
         with open(file, 'r', encoding='utf8') as f:
 
             reader = csv.DictReader(f)
             for row in reader:
+                country_names.add(row['Country or Area Name'])
                 if row['Series Code'] not in row_name_to_values['Series Code']:
                     row_name_to_values['Series Code'].append(row['Series Code'])
                 if row['Age group'] not in row_name_to_values['Age group']:
@@ -183,6 +180,10 @@ with transaction.atomic():
                 if len(value) > 1:
                     columns_to_include.append(key)
 
+        # the entities of the file's countries are resolved, and the new ones
+        # created, all at once
+        entity_id_by_name = entity_resolver.entity_ids({name: name for name in country_names})
+
         # now we are going to read the metadata files
         metadata_string = ''
 
@@ -300,31 +301,12 @@ with transaction.atomic():
                                           (DataValue._meta.db_table, newvariable.pk))
                         variable_name_to_object[variable_name] = newvariable
 
-                if row['Country or Area Name'] not in c_name_entity_ref:
-                    if row['Country or Area Name'] == 'Global':
-                        newentity = Entity.objects.get(name='World')
-                    elif country_tool_names_dict.get(unidecode.unidecode(row['Country or Area Name'].lower()), 0):
-                        #print(country_tool_names_dict[unidecode.unidecode(row['Country or Area Name'].lower())].owid_name)
-                        if country_tool_names_dict[unidecode.unidecode(row['Country or Area Name'].lower())].owid_name == 'Saint Barthlemy':
-                            newentity = Entity.objects.get(name='Saint Barthélemy')
-                        elif country_tool_names_dict[unidecode.unidecode(row['Country or Area Name'].lower())].owid_name == 'land Islands':
-                            newentity = Entity.objects.get(name='Åland Islands')
-                        else:
-                            newentity = Entity.objects.get(
-                                name=country_tool_names_dict[unidecode.unidecode(row['Country or Area Name'].lower())].owid_name)
-                    elif row['Country or Area Name'].lower() in existing_entities_list:
-                        newentity = Entity.objects.get(name__iexact=row['Country or Area Name'])
-                    else:
-                        newentity = Entity(name=row['Country or Area Name'], validated=False)
-                        newentity.save()
-                    c_name_entity_ref[row['Country or Area Name']] = newentity
-
                 for i in range(1000, 2020):
                     if str(i) in reader.fieldnames:
                         if row[str(i)]:
                             try:
                                 data_values_tuple_list.append((str(float(row[str(i)])), i,
-                                                   c_name_entity_ref[row['Country or Area Name']].pk, variable_name_to_object[variable_name].pk))
+                                                   entity_id_by_name[row['Country or Area Name']], variable_name_to_object[variable_name].pk))
                             except:
                                 pass
 
@@ -334,8 +316,7 @@ with transaction.atomic():
                         c.executemany(insert_string, data_values_tuple_list)
                     data_values_tuple_list = []
 
-                if row_number % 100 == 0:
-                    time.sleep(0.001)  # this is done in order to not keep the CPU busy all the time, the delay after each 100th row is 1 millisecond
+                governor.tick()
 
         if len(data_values_tuple_list):  # insert any leftover data_values
             with connection.cursor() as c:
@@ -3,19 +3,20 @@ import sys
 sys.path.insert(1, os.path.join(sys.path[0], '..'))
 import grapher_admin.wsgi
 import hashlib
+import itertools
 import json
 import requests
-import shutil
-import unidecode
 from urllib.parse import quote
 from django.conf import settings
 from django.db import connection, transaction
 from django.utils import timezone
 from openpyxl import load_workbook
 from importer.models import ImportHistory
-from country_name_tool.models import CountryName
-from grapher_admin.models import Entity, DatasetSubcategory, DatasetCategory, Dataset, Source, Variable, VariableType, DataValue, ChartDimension
+from grapher_admin.models import DatasetSubcategory, DatasetCategory, Dataset, Source, Variable, VariableType, DataValue, ChartDimension
 from grapher_admin.views import write_dataset_csv
+from download_cache import DownloadCache, DownloadError
+from reshape import ROWS, COLUMNS, blocks, value_block, wide_to_long
+from entity_resolver import EntityResolver
 
 
 # IMPORTANT: Unlike World Bank and QoG Institute, which have their datasets as a single file,
@@ -33,9 +34,7 @@ file_to_parse = 'WPP2017_INT_F02C_1_ANNUAL_POPULATION_INDICATORS_DEPENDENCY_RATI
 un_wpp_data_page_url = 'https://esa.un.org/unpd/wpp/Download/Standard/Population/'
 un_wpp_root_url = 'https://esa.un.org/'
 wpp_downloads_save_location = settings.BASE_DIR + '/data/un_wpp_downloads/'
-
-# create a directory for holding the downloads
-# if the directory exists, delete it and recreate it
+download_cache = DownloadCache()
 
 source_description = {
     'dataPublishedBy': "United Nations, Department of Economic and Social Affairs, Population Division (2017). World Population Prospects: The 2017 Revision, DVD Edition.",
@@ -55,11 +54,29 @@ def file_checksum(filename, blocksize=2**20):
             m.update(buffer)
     return m.hexdigest()
 
+def is_number(value):
+    try:
+        float(value)
+        return True
+    except ValueError:
+        return False
+
+# The rows below the headers of a sheet, reshaped a block at a time, see
+# reshape.py. Yields the (value, row, key) of every cell holding a number, for
+# the columns that `column_keys` maps (by column_number) to a key.
+def numbers_by_column(ws_rows, column_keys):
+    column_numbers = sorted(column_keys)
+    if not column_numbers:
+        return
+    keys = [column_keys[column_number] for column_number in column_numbers]
+    for rows in blocks(tuple(cell.value for cell in row) for row in ws_rows):
+        values = value_block(rows, columns=[column_number - 1 for column_number in column_numbers])
+        for value, row_index, key in wide_to_long(values, (ROWS, range(len(rows))), (COLUMNS, keys), missing=(None, '', 0)):
+            if is_number(value):
+                yield value, rows[row_index], key
+
 if not os.path.exists(wpp_downloads_save_location):
     os.makedirs(wpp_downloads_save_location)
-else:
-    shutil.rmtree(wpp_downloads_save_location)
-    os.makedirs(wpp_downloads_save_location)
 
 
 def short_unit_extract(unit: str):
@@ -85,32 +102,6 @@ def short_unit_extract(unit: str):
     return short_unit
 
 
-def process_entities(country_names_dictionary):
-    existing_entities = Entity.objects.values('name')
-    existing_entities_list = {item['name'].lower() for item in existing_entities}
-
-    country_tool_names = CountryName.objects.all()
-    country_tool_names_dict = {}
-
-    for each_country in country_tool_names:
-        country_tool_names_dict[each_country.country_name.lower()] = each_country.owid_country
-
-    c_name_entity_ref = {}  # this dict will hold the country names from excel and the appropriate entity object (this is used when saving the variables and their values)
-
-    for c_code, country_name in country_names_dictionary.items():
-        if country_tool_names_dict.get(unidecode.unidecode(country_name.lower()), 0):
-            newentity = Entity.objects.get(
-                name=country_tool_names_dict[unidecode.unidecode(country_name.lower())].owid_name)
-        elif country_name.lower() in existing_entities_list:
-            newentity = Entity.objects.get(name__iexact=country_name)
-        else:
-            newentity = Entity(name=country_name, validated=False)
-            newentity.save()
-        c_name_entity_ref[c_code] = newentity
-
-    return c_name_entity_ref
-
-
 request_header = {'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_10_1) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/39.0.2171.95 Safari/537.36'}
 r = requests.get(un_wpp_data_page_url, headers=request_header)
 dataset_info = {}  # will contain filename, and category name and description for the file
@@ -128,22 +119,31 @@ if r.ok:
             # Population, Mortality, Fertility, Migration and Interpolated indicators
             # we also want to exclude the abridged files
             if '.xlsx' in each['File1_Path'] and '1_Indicators (Standard)' in each['File1_Path'] and 'ABRIDGED' not in each['File1_Path'] and file_to_parse in each['File1_Path']:
-                r = requests.get(un_wpp_root_url + quote(each['File1_Path']), stream=True, headers=request_header)
                 file_found = True
-                if r.ok:
-                    with open(wpp_downloads_save_location + os.path.basename(un_wpp_root_url + each['File1_Path']), 'wb') as out_file:
-                        shutil.copyfileobj(r.raw, out_file)
-                    dataset_info['filename'] = file_to_parse
-                    dataset_info['category'] = '%s - %s' % (each['MajorGroup'], each['SubGroup'])
-                    dataset_info['description'] = each['Description']
-                else:
+                try:
+                    download = download_cache.fetch(un_wpp_root_url + quote(each['File1_Path']),
+                                                    path=wpp_downloads_save_location + os.path.basename(un_wpp_root_url + each['File1_Path']),
+                                                    headers=request_header)
+                except DownloadError:
                     sys.exit('Could not download %s. Exiting now...' % each['File1_Path'])
+                dataset_info['filename'] = file_to_parse
+                dataset_info['category'] = '%s - %s' % (each['MajorGroup'], each['SubGroup'])
+                dataset_info['description'] = each['Description']
 else:
     sys.exit('Could not download the contents of the json file from the server. Exiting now...')
 
 if not file_found:
     sys.exit('The file you requested was not found on the server. Exiting now...')
 
+# stop before parsing the file if its last import was of the same version
+imported_before_hashes = [
+    json.loads(oneimport.import_state)['file_hash']
+    for oneimport in ImportHistory.objects.filter(import_type='unwpp')
+    if json.loads(oneimport.import_state)['file_name'] == file_to_parse
+]
+if imported_before_hashes and download.unchanged_since(imported_before_hashes[-1]):
+    sys.exit('No updates available.')
+
 un_wpp_category_name_in_db = 'United Nations World Population Prospects'  # set the name of the root category of all data that will be imported by this script
 
 
@@ -245,7 +245,7 @@ with transaction.atomic():
     # if unwpp imports for this file were never performed
     if not file_imported_before:
 
-        country_name_entity_ref = process_entities(country_names_dict)
+        entity_id_by_code = EntityResolver().entity_ids(country_names_dict)
 
         existing_categories = DatasetCategory.objects.values('name')
         existing_categories_list = {item['name'] for item in existing_categories}
@@ -283,7 +283,8 @@ with transaction.atomic():
 
                 insert_string = 'INSERT into data_values (value, year, entityId, variableId) VALUES (%s, %s, %s, %s)'  # this is used for constructing the query for mass inserting to the data_values table
 
-                for row in wb[sheet]:
+                ws_rows = iter(wb[sheet])
+                for row in itertools.islice(ws_rows, 17):  # the headers
                     row_number += 1
                     for cell in row:
                         column_number += 1
@@ -303,60 +304,47 @@ with transaction.atomic():
                                 if cell.value:
                                     var_to_add_dict[column_number] = '%s: %s - %s' % (variant, main_var_name, cell.value)
 
-                        if row_number == 18:
-                            if not dataset_saved:
-                                newdataset = Dataset(name='UN WPP - %s' % dataset_name,
-                                                     description='This is a dataset imported by the automated fetcher',
-                                                     namespace='unwpp', categoryId=the_category,
-                                                     subcategoryId=the_subcategory)
-                                newdataset.save()
-                                dataset_saved = True
-                                source_description['additionalInfo'] = dataset_info['description']
-                                newsource = Source(name='United Nations – Population Division (2017 Revision)',
-                                                   description=json.dumps(source_description),
-                                                   datasetId=newdataset.pk)
-                                newsource.save()
-
-                            if not variables_saved:
-                                for columnnum, varname in var_to_add_dict.items():
-                                    if '(' not in varname:
-                                        unit_of_measure = ''
-                                    else:
-                                        unit_of_measure = varname[varname.index('('):varname.index(')') + 1].replace('(', '').replace(')','')
-                                        s_unit = short_unit_extract(unit_of_measure)
-                                    newvariable = Variable(name=varname,
-                                                           unit=unit_of_measure,
-                                                           short_unit=s_unit,
-                                                           description='',
-                                                           code=None,
-                                                           timespan=timespan,
-                                                           datasetId=newdataset,
-                                                           variableTypeId=VariableType.objects.get(pk=4),
-                                                           sourceId=newsource)
-                                    newvariable.save()
-
-                                    column_var_dict[columnnum] = newvariable
-
-                                variables_saved = True
-
-                        if row_number > 17:
-                            if column_number == 5:
-                                country_code = cell.value
-                            if column_number == 6:
-                                year = cell.value
-                            if column_number > 6:
-                                if cell.value:
-                                    try:
-                                        the_value = float(cell.value)
-                                        data_values_tuple_list.append((cell.value, year,
-                                                                        country_name_entity_ref[country_code].pk,
-                                                                        column_var_dict[column_number].pk))
-                                    except ValueError:
-                                        # the cell value does not contain a number
-                                        pass
-
                     column_number = 0
 
+                # the dataset, source and variables of the sheet, now that its headers are read
+                if not dataset_saved:
+                    newdataset = Dataset(name='UN WPP - %s' % dataset_name,
+                                         description='This is a dataset imported by the automated fetcher',
+                                         namespace='unwpp', categoryId=the_category,
+                                         subcategoryId=the_subcategory)
+                    newdataset.save()
+                    dataset_saved = True
+                    source_description['additionalInfo'] = dataset_info['description']
+                    newsource = Source(name='United Nations – Population Division (2017 Revision)',
+                                       description=json.dumps(source_description),
+                                       datasetId=newdataset.pk)
+                    newsource.save()
+
+                if not variables_saved:
+                    for columnnum, varname in var_to_add_dict.items():
+                        if '(' not in varname:
+                            unit_of_measure = ''
+                        else:
+                            unit_of_measure = varname[varname.index('('):varname.index(')') + 1].replace('(', '').replace(')','')
+                            s_unit = short_unit_extract(unit_of_measure)
+                        newvariable = Variable(name=varname,
+                                               unit=unit_of_measure,
+                                               short_unit=s_unit,
+                                               description='',
+                                               code=None,
+                                               timespan=timespan,
+                                               datasetId=newdataset,
+                                               variableTypeId=VariableType.objects.get(pk=4),
+                                               sourceId=newsource)
+                        newvariable.save()
+
+                        column_var_dict[columnnum] = newvariable
+
+                    variables_saved = True
+
+                # the data rows are reshaped a block at a time, see reshape.py
+                for value, row, variable in numbers_by_column(ws_rows, column_var_dict):
+                    data_values_tuple_list.append((value, row[5], entity_id_by_code[row[4]], variable.pk))
                     if len(data_values_tuple_list) > 3000:  # insert when the length of the list goes over 3000
                         with connection.cursor() as c:
                             c.executemany(insert_string, data_values_tuple_list)
@@ -377,7 +365,8 @@ with transaction.atomic():
 
                 insert_string = 'INSERT into data_values (value, year, entityId, variableId) VALUES (%s, %s, %s, %s)'  # this is used for constructing the query for mass inserting to the data_values table
 
-                for row in wb[sheet]:
+                ws_rows = iter(wb[sheet])
+                for row in itertools.islice(ws_rows, 17):  # the headers
                     row_number += 1
                     for cell in row:
                         column_number += 1
@@ -397,55 +386,44 @@ with transaction.atomic():
                                 if cell.value:
                                     column_to_year[column_number] = cell.value
 
-                        if row_number == 18:
-                            if not dataset_saved:
-                                newdataset = Dataset(name='UN WPP - %s' % dataset_name,
-                                                     description='This is a dataset imported by the automated fetcher',
-                                                     namespace='unwpp', categoryId=the_category,
-                                                     subcategoryId=the_subcategory)
-                                newdataset.save()
-                                dataset_saved = True
-                                source_description['additionalInfo'] = dataset_info['description']
-                                newsource = Source(name='United Nations – Population Division (2017 Revision)',
-                                                   description=json.dumps(source_description),
-                                                   datasetId=newdataset.pk)
-                                newsource.save()
-
-                            if not variables_saved:
-                                if '(' not in var_name:
-                                    unit_of_measure = ''
-                                else:
-                                    unit_of_measure = var_name[var_name.index('('):var_name.index(')') + 1].replace('(', '').replace(')','')
-                                    s_unit = short_unit_extract(unit_of_measure)
-                                newvariable = Variable(name='%s: %s' % (variant, var_name),
-                                                       unit=unit_of_measure,
-                                                       short_unit=s_unit,
-                                                       description='',
-                                                       code=None,
-                                                       timespan=timespan,
-                                                       datasetId=newdataset,
-                                                       variableTypeId=VariableType.objects.get(pk=4),
-                                                       sourceId=newsource)
-                                newvariable.save()
-
-                                variables_saved = True
-
-                        if row_number > 17:
-                            if column_number == 5:
-                                country_code = cell.value
-                            if column_number > 5:
-                                if cell.value:
-                                    try:
-                                        the_value = float(cell.value)
-                                        data_values_tuple_list.append((cell.value, column_to_year[column_number],
-                                                                       country_name_entity_ref[country_code].pk,
-                                                                       newvariable.pk))
-                                    except ValueError:
-                                        # the cell value does not contain a number
-                                        pass
-
                     column_number = 0
 
+                # the dataset, source and variables of the sheet, now that its headers are read
+                if not dataset_saved:
+                    newdataset = Dataset(name='UN WPP - %s' % dataset_name,
+                                         description='This is a dataset imported by the automated fetcher',
+                                         namespace='unwpp', categoryId=the_category,
+                                         subcategoryId=the_subcategory)
+                    newdataset.save()
+                    dataset_saved = True
+                    source_description['additionalInfo'] = dataset_info['description']
+                    newsource = Source(name='United Nations – Population Division (2017 Revision)',
+                                       description=json.dumps(source_description),
+                                       datasetId=newdataset.pk)
+                    newsource.save()
+
+                if not variables_saved:
+                    if '(' not in var_name:
+                        unit_of_measure = ''
+                    else:
+                        unit_of_measure = var_name[var_name.index('('):var_name.index(')') + 1].replace('(', '').replace(')','')
+                        s_unit = short_unit_extract(unit_of_measure)
+                    newvariable = Variable(name='%s: %s' % (variant, var_name),
+                                           unit=unit_of_measure,
+                                           short_unit=s_unit,
+                                           description='',
+                                           code=None,
+                                           timespan=timespan,
+                                           datasetId=newdataset,
+                                           variableTypeId=VariableType.objects.get(pk=4),
+                                           sourceId=newsource)
+                    newvariable.save()
+
+                    variables_saved = True
+
+                # the data rows are reshaped a block at a time, see reshape.py
+                for value, row, year in numbers_by_column(ws_rows, column_to_year):
+                    data_values_tuple_list.append((value, year, entity_id_by_code[row[4]], newvariable.pk))
                     if len(data_values_tuple_list) > 3000:  # insert when the length of the list goes over 3000
                         with connection.cursor() as c:
                             c.executemany(insert_string, data_values_tuple_list)
@@ -469,7 +447,7 @@ with transaction.atomic():
         if imported_before_hash == file_checksum(os.path.join(wpp_downloads_save_location, file_to_parse)):
             sys.exit('No updates available.')
 
-        country_name_entity_ref = process_entities(country_names_dict)
+        entity_id_by_code = EntityResolver().entity_ids(country_names_dict)
 
         existing_categories = DatasetCategory.objects.values('name')
         existing_categories_list = {item['name'] for item in existing_categories}
@@ -501,7 +479,7 @@ with transaction.atomic():
                 column_number = 0
                 row_number = 0
 
-                for row in wb[sheet]:
+                for row in itertools.islice(wb[sheet], 17):  # only the headers are needed here
                     row_number += 1
                     for cell in row:
                         column_number += 1
@@ -567,7 +545,8 @@ with transaction.atomic():
 
                 insert_string = 'INSERT into data_values (value, year, entityId, variableId) VALUES (%s, %s, %s, %s)'  # this is used for constructing the query for mass inserting to the data_values table
 
-                for row in wb[sheet]:
+                ws_rows = iter(wb[sheet])
+                for row in itertools.islice(ws_rows, 17):  # the headers
                     row_number += 1
                     for cell in row:
                         column_number += 1
@@ -587,68 +566,55 @@ with transaction.atomic():
                                 if cell.value:
                                     var_to_add_dict[column_number] = '%s: %s - %s' % (variant, main_var_name, cell.value)
 
-                        if row_number == 18:
-                            if not dataset_saved:
-                                newdataset = Dataset.objects.get(name='UN WPP - %s' % dataset_name, namespace__contains='unwpp')
-                                newdataset.categoryId = the_category
-                                newdataset.subcategoryId = the_subcategory
-                                newdataset.save()
-                                dataset_saved = True
-
-                                source_description['additionalInfo'] = dataset_info['description']
-                                newsource = Source.objects.get(datasetId=newdataset.pk)
-                                newsource.description = json.dumps(source_description)
-                                newsource.save()
-
-                            if not variables_saved:
-
-                                for columnnum, varname in var_to_add_dict.items():
-                                    if varname in vars_to_add:
-                                        if '(' not in varname:
-                                            unit_of_measure = ''
-                                        else:
-                                            unit_of_measure = varname[varname.index('('):varname.index(')') + 1].replace('(', '').replace(')','')
-                                            s_unit = short_unit_extract(unit_of_measure)
-                                        newvariable = Variable(name=varname,
-                                                               unit=unit_of_measure,
-                                                               short_unit=s_unit,
-                                                               description='',
-                                                               code=None,
-                                                               timespan=timespan,
-                                                               datasetId=newdataset,
-                                                               variableTypeId=VariableType.objects.get(pk=4),
-                                                               sourceId=newsource)
-                                        newvariable.save()
-                                    else:
-                                        newvariable = Variable.objects.get(name=varname, datasetId=newdataset)
-                                        while DataValue.objects.filter(
-                                            variableId__pk=existing_variables_name_id[varname]).first():
-                                            with connection.cursor() as c:  # if we don't limit the deleted values, the db might just hang
-                                                c.execute('DELETE FROM %s WHERE variableId = %s LIMIT 10000;' %
-                                                          (DataValue._meta.db_table, existing_variables_name_id[varname]))
-
-                                    column_var_dict[columnnum] = newvariable
-
-                                variables_saved = True
-
-                        if row_number > 17:
-                            if column_number == 5:
-                                country_code = cell.value
-                            if column_number == 6:
-                                year = cell.value
-                            if column_number > 6:
-                                if cell.value:
-                                    try:
-                                        the_value = float(cell.value)
-                                        data_values_tuple_list.append((cell.value, year,
-                                                                        country_name_entity_ref[country_code].pk,
-                                                                        column_var_dict[column_number].pk))
-                                    except ValueError:
-                                        # the cell value does not contain a number
-                                        pass
-
                     column_number = 0
 
+                # the dataset, source and variables of the sheet, now that its headers are read
+                if not dataset_saved:
+                    newdataset = Dataset.objects.get(name='UN WPP - %s' % dataset_name, namespace__contains='unwpp')
+                    newdataset.categoryId = the_category
+                    newdataset.subcategoryId = the_subcategory
+                    newdataset.save()
+                    dataset_saved = True
+
+                    source_description['additionalInfo'] = dataset_info['description']
+                    newsource = Source.objects.get(datasetId=newdataset.pk)
+                    newsource.description = json.dumps(source_description)
+                    newsource.save()
+
+                if not variables_saved:
+
+                    for columnnum, varname in var_to_add_dict.items():
+                        if varname in vars_to_add:
+                            if '(' not in varname:
+                                unit_of_measure = ''
+                            else:
+                                unit_of_measure = varname[varname.index('('):varname.index(')') + 1].replace('(', '').replace(')','')
+                                s_unit = short_unit_extract(unit_of_measure)
+                            newvariable = Variable(name=varname,
+                                                   unit=unit_of_measure,
+                                                   short_unit=s_unit,
+                                                   description='',
+                                                   code=None,
+                                                   timespan=timespan,
+                                                   datasetId=newdataset,
+                                                   variableTypeId=VariableType.objects.get(pk=4),
+                                                   sourceId=newsource)
+                            newvariable.save()
+                        else:
+                            newvariable = Variable.objects.get(name=varname, datasetId=newdataset)
+                            while DataValue.objects.filter(
+                                variableId__pk=existing_variables_name_id[varname]).first():
+                                with connection.cursor() as c:  # if we don't limit the deleted values, the db might just hang
+                                    c.execute('DELETE FROM %s WHERE variableId = %s LIMIT 10000;' %
+                                              (DataValue._meta.db_table, existing_variables_name_id[varname]))
+
+                        column_var_dict[columnnum] = newvariable
+
+                    variables_saved = True
+
+                # the data rows are reshaped a block at a time, see reshape.py
+                for value, row, variable in numbers_by_column(ws_rows, column_var_dict):
+                    data_values_tuple_list.append((value, row[5], entity_id_by_code[row[4]], variable.pk))
                     if len(data_values_tuple_list) > 3000:  # insert when the length of the list goes over 3000
                         with connection.cursor() as c:
                             c.executemany(insert_string, data_values_tuple_list)
@@ -664,7 +630,7 @@ with transaction.atomic():
                 column_number = 0
                 row_number = 0
 
-                for row in wb[sheet]:
+                for row in itertools.islice(wb[sheet], 16):  # only the headers are needed here
                     row_number += 1
                     for cell in row:
                         column_number += 1
@@ -726,7 +692,8 @@ with transaction.atomic():
 
                 insert_string = 'INSERT into data_values (value, year, entityId, variableId) VALUES (%s, %s, %s, %s)'  # this is used for constructing the query for mass inserting to the data_values table
 
-                for row in wb[sheet]:
+                ws_rows = iter(wb[sheet])
+                for row in itertools.islice(ws_rows, 17):  # the headers
                     row_number += 1
                     for cell in row:
                         column_number += 1
@@ -746,62 +713,51 @@ with transaction.atomic():
                                 if cell.value:
                                     column_to_year[column_number] = cell.value
 
-                        if row_number == 18:
-                            if not dataset_saved:
-                                newdataset = Dataset.objects.get(name='UN WPP - %s' % dataset_name, namespace__contains='unwpp')
-                                newdataset.categoryId = the_category
-                                newdataset.subcategoryId = the_subcategory
-                                newdataset.save()
-                                dataset_saved = True
-
-                                source_description['additionalInfo'] = dataset_info['description']
-                                newsource = Source.objects.get(datasetId=newdataset.pk)
-                                newsource.description = json.dumps(source_description)
-                                newsource.save()
-
-                            if not variables_saved:
-                                if var_name in vars_to_add:
-                                    if '(' not in var_name:
-                                        unit_of_measure = ''
-                                    else:
-                                        unit_of_measure = var_name[var_name.index('('):var_name.index(')') + 1].replace('(', '').replace(')','')
-                                        s_unit = short_unit_extract(unit_of_measure)
-                                    newvariable = Variable(name=var_name,
-                                                           unit=unit_of_measure,
-                                                           short_unit=s_unit,
-                                                           description='',
-                                                           code=None,
-                                                           timespan=timespan,
-                                                           datasetId=newdataset,
-                                                           variableTypeId=VariableType.objects.get(pk=4),
-                                                           sourceId=newsource)
-                                    newvariable.save()
-                                else:
-                                    newvariable = Variable.objects.get(name=var_name, datasetId=newdataset)
-                                    while DataValue.objects.filter(
-                                        variableId__pk=existing_variables_name_id[var_name]).first():
-                                        with connection.cursor() as c:  # if we don't limit the deleted values, the db might just hang
-                                            c.execute('DELETE FROM %s WHERE variableId = %s LIMIT 10000;' %
-                                                      (DataValue._meta.db_table, existing_variables_name_id[var_name]))
-
-                                variables_saved = True
-
-                        if row_number > 17:
-                            if column_number == 5:
-                                country_code = cell.value
-                            if column_number > 5:
-                                if cell.value:
-                                    try:
-                                        the_value = float(cell.value)
-                                        data_values_tuple_list.append((cell.value, column_to_year[column_number],
-                                                                        country_name_entity_ref[country_code].pk,
-                                                                        newvariable.pk))
-                                    except ValueError:
-                                        # the cell value does not contain a number
-                                        pass
-
                     column_number = 0
 
+                # the dataset, source and variables of the sheet, now that its headers are read
+                if not dataset_saved:
+                    newdataset = Dataset.objects.get(name='UN WPP - %s' % dataset_name, namespace__contains='unwpp')
+                    newdataset.categoryId = the_category
+                    newdataset.subcategoryId = the_subcategory
+                    newdataset.save()
+                    dataset_saved = True
+
+                    source_description['additionalInfo'] = dataset_info['description']
+                    newsource = Source.objects.get(datasetId=newdataset.pk)
+                    newsource.description = json.dumps(source_description)
+                    newsource.save()
+
+                if not variables_saved:
+                    if var_name in vars_to_add:
+                        if '(' not in var_name:
+                            unit_of_measure = ''
+                        else:
+                            unit_of_measure = var_name[var_name.index('('):var_name.index(')') + 1].replace('(', '').replace(')','')
+                            s_unit = short_unit_extract(unit_of_measure)
+                        newvariable = Variable(name=var_name,
+                                               unit=unit_of_measure,
+                                               short_unit=s_unit,
+                                               description='',
+                                               code=None,
+                                               timespan=timespan,
+                                               datasetId=newdataset,
+                                               variableTypeId=VariableType.objects.get(pk=4),
+                                               sourceId=newsource)
+                        newvariable.save()
+                    else:
+                        newvariable = Variable.objects.get(name=var_name, datasetId=newdataset)
+                        while DataValue.objects.filter(
+                            variableId__pk=existing_variables_name_id[var_name]).first():
+                            with connection.cursor() as c:  # if we don't limit the deleted values, the db might just hang
+                                c.execute('DELETE FROM %s WHERE variableId = %s LIMIT 10000;' %
+                                          (DataValue._meta.db_table, existing_variables_name_id[var_name]))
+
+                    variables_saved = True
+
+                # the data rows are reshaped a block at a time, see reshape.py
+                for value, row, year in numbers_by_column(ws_rows, column_to_year):
+                    data_values_tuple_list.append((value, year, entity_id_by_code[row[4]], newvariable.pk))
                     if len(data_values_tuple_list) > 3000:  # insert when the length of the list goes over 3000
                         with connection.cursor() as c:
                             c.executemany(insert_string, data_values_tuple_list)
@@ -0,0 +1,28 @@
+# The short form of a unit of measurement, shown next to the values in the
+# charts, e.g. '%' for 'percent of GDP' or '$' for 'current US$'. Units of up
+# to 8 characters are their own short form.
+def short_unit_extract(unit: str):
+    common_short_units = ['$', '£', '€', '%']  # used for extracting short forms of units of measurement
+    short_unit = None
+    if unit:
+        if ' per ' in unit:
+            short_form = unit.split(' per ')[0]
+            if any(w in short_form for w in common_short_units):
+                for x in common_short_units:
+                    if x in short_form:
+                        short_unit = x
+                        break
+            else:
+                short_unit = short_form
+        elif any(x in unit for x in common_short_units):
+            for y in common_short_units:
+                if y in unit:
+                    short_unit = y
+                    break
+        elif 'percentage' in unit:
+            short_unit = '%'
+        elif 'percent' in unit.lower():
+            short_unit = '%'
+        elif len(unit) < 9:  # this length is sort of arbitrary at this point, taken from the unit 'hectares'
+            short_unit = unit
+    return short_unit
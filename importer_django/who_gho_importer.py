@@ -18,6 +18,9 @@ from grapher_admin.views import write_dataset_csv
 import requests
 import lxml.html
 from lxml import etree as ET
+from governor import Governor
+
+governor = Governor.from_env()
 
 ####################################################################################################
 # the files for WHO GHO datasets should be downloaded before running this script,
@@ -244,8 +247,7 @@ with transaction.atomic():
                             c.executemany(insert_string, data_values_tuple_list)
                         data_values_tuple_list = []
 
-                    if row_number % 100 == 0:
-                        time.sleep(0.001)  # this is done in order to not keep the CPU busy all the time, the delay after each 100th row is 1 millisecond
+                    governor.tick()
 
         if len(data_values_tuple_list):  # insert any leftover data_values
             with connection.cursor() as c:
@@ -0,0 +1,554 @@
+import sys
+import os
+import json
+import logging
+import time
+import zipfile
+from grapher_admin.models import Dataset, DatasetTag
+from importer.models import ImportHistory, AdditionalCountryInfo
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+from django.urls import reverse
+from grapher_admin.views import write_dataset_csv
+from governor import Governor
+from download_cache import DownloadCache, DownloadError
+from xlsx_reader import XlsxReader
+from reshape import ROWS, COLUMNS, blocks, value_block, wide_to_long
+from entity_resolver import EntityResolver
+from units import short_unit_extract
+
+# the data_values are loaded by the loader of the importer scripts
+sys.path.insert(1, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', 'importer'))
+from db_utils import DBUtils
+
+# The importer of the World Bank's databank workbooks (WDI, EdStats, Gender
+# Statistics, HNP...), which all share the same layout: a Series sheet with an
+# indicator per row, a Data sheet with a row per country and indicator and a
+# column per year, and usually a Country sheet. Each *_importer.py script only
+# says where its workbook is and how it differs from the others:
+#
+#   WorldBankImporter(
+#       namespace='hnpstats',
+#       tag_name='World Bank Health Nutrition and Population Statistics',
+#       zip_file_url='http://databank.worldbank.org/data/download/hnp_stats_excel.zip',
+#       ...
+#   ).run()
+#
+# The sheets are read once each with XlsxReader, the metadata of all the
+# indicators is upserted with a few executemany() statements, and the
+# data_values are reshaped a block of rows at a time (see reshape.py) and
+# loaded with DBUtils.bulk_load_data_values().
+
+governor = Governor.from_env()
+download_cache = DownloadCache()
+
+logger = logging.getLogger('importer')
+
+request_header = {'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_10_1) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/39.0.2171.95 Safari/537.36'}
+
+# The column headers we expect the sheets to begin with. Every databank
+# workbook has at least these, an importer can expect more of them.
+SERIES_EXPECTED_HEADERS = ('Series Code', 'Topic', 'Indicator Name', 'Short definition', 'Long definition', 'Unit of measure', 'Periodicity', 'Base Period', 'Other notes', 'Aggregation method', 'Limitations and exceptions', 'Notes from original source', 'General comments', 'Source', 'Statistical concept and methodology', 'Development relevance', 'Related source links', 'Other web links')
+DATA_EXPECTED_HEADERS = ('Country Name', 'Country Code', 'Indicator Name', 'Indicator Code')
+COUNTRY_EXPECTED_HEADERS = ('Country Code', 'Short Name', 'Table Name', 'Long Name', '2-alpha code', 'Currency Unit', 'Special Notes', 'Region', 'Income Group', 'WB-2 code', 'National accounts base year', 'National accounts reference year', 'SNA price valuation', 'Lending category', 'Other groups', 'System of National Accounts', 'Alternative conversion factor', 'PPP survey year', 'Balance of Payments Manual in use', 'External debt Reporting status', 'System of trade', 'Government Accounting concept', 'IMF data dissemination standard', 'Latest population census', 'Latest household survey', 'Source of most recent Income and expenditure data')
+
+# The sections of a source's additionalInfo, and the indicator fields they
+# are taken from
+ADDITIONAL_INFO_SECTIONS = [
+    ("Limitations and exceptions", 'limitations'),
+    ("Notes from original source", 'sourcenotes'),
+    ("General comments", 'comments'),
+    ("Statistical concept and methodology", 'concept'),
+    ("Related source links", 'sourcelinks'),
+    ("Other web links", 'weblinks'),
+]
+
+# Some workbooks put a '.' in the unit column when there is no unit
+MISSING_UNITS = (None, '', '.')
+
+DELETE_BATCH_SIZE = 100000  # if we don't limit the deleted values, the db might just hang
+
+
+def terminate(message):
+    logger.error(message)
+    sys.exit(message)
+
+
+# Reads the header row of a sheet and stops the import if it doesn't begin
+# with the expected headers. Returns the index of every header.
+def check_headers(rows, sheet_name, expected_headers):
+    headers = tuple(next(rows, ()))
+    if headers[:len(expected_headers)] != tuple(expected_headers):
+        terminate("Headers mismatch on '%s' worksheet" % sheet_name)
+    return {header: index for index, header in enumerate(headers)}
+
+
+def year_or_none(header):
+    try:
+        return int(header)
+    except (TypeError, ValueError):
+        return None
+
+
+class WorldBankImporter:
+
+    # namespace: the namespace of the datasets, also the import_type of the
+    #   import history and the name of the downloaded zip file
+    # tag_name: the parent tag of the datasets, and the prefix of their names
+    # label: how the imports are called in the logs and the import notes
+    # source_name_prefix: the prefix of the sources' names, tag_name if None
+    # country_info_url_name: the view serving the Country sheet, linked from
+    #   every source, or None if the workbook has no Country sheet
+    # split_topics: only use the part of the topic before the ':' as the
+    #   category, i.e. 'Health: Mortality' is imported as 'Health'
+    # timespan: set the variables' timespan to the years of the Data sheet
+    # use_unit_column: read the unit from the Series sheet, otherwise it is
+    #   always taken from the parentheses in the indicator's name
+    # max_unit_length: units this long or longer are left out
+    # country_name_header: the Country sheet column with the country names
+    # publisher_for: called with the description of a source, returns who
+    #   published its data if not published_by
+    # csv_committer: the committer of the exported dataset csvs, or None to
+    #   not export them
+    def __init__(self, namespace, tag_name, zip_file_url, label, published_by, link,
+                 source_name_prefix=None, country_info_url_name=None, split_topics=False, timespan=False,
+                 use_unit_column=True, max_unit_length=None, country_name_header='Table Name',
+                 series_headers=SERIES_EXPECTED_HEADERS, data_headers=DATA_EXPECTED_HEADERS,
+                 country_headers=COUNTRY_EXPECTED_HEADERS, publisher_for=None, csv_committer=None):
+        self.namespace = namespace
+        self.tag_name = tag_name
+        self.zip_file_url = zip_file_url
+        self.label = label
+        self.published_by = published_by
+        self.link = link
+        self.source_name_prefix = source_name_prefix or tag_name
+        self.country_info_url_name = country_info_url_name
+        self.split_topics = split_topics
+        self.timespan = timespan
+        self.use_unit_column = use_unit_column
+        self.max_unit_length = max_unit_length
+        self.country_name_header = country_name_header
+        self.series_headers = series_headers
+        self.data_headers = data_headers
+        self.country_headers = country_headers
+        self.publisher_for = publisher_for
+        self.csv_committer = csv_committer
+        self.downloads_path = settings.BASE_DIR + '/data/%s_downloads/' % namespace
+        self.retrieved_date = timezone.now().strftime("%d-%B-%y")
+        self.existing_dataset_ids = set()  # the datasets that were there before this import
+
+    def run(self):
+        start_time = time.time()
+
+        # create a directory for holding the downloads
+        if not os.path.exists(self.downloads_path):
+            os.makedirs(self.downloads_path)
+
+        logger.info("Getting the zip file")
+        try:
+            download = download_cache.fetch(self.zip_file_url, path=self.downloads_path + self.namespace + '.zip', headers=request_header)
+        except DownloadError:
+            logger.error("The file could not be downloaded. Stopping the script...")
+            sys.exit("Could not download file.")
+        logger.info("Saved the zip file to disk.")
+
+        # stop before extracting and parsing anything if the last import was of the same file
+        last_import = ImportHistory.objects.filter(import_type=self.namespace).last()
+        if last_import and download.unchanged_since(json.loads(last_import.import_state).get('file_hash')):
+            logger.info('No updates available.')
+            sys.exit('No updates available.')
+
+        if last_import:
+            logger.info('New data is available.')
+        else:
+            logger.info("This is the very first %s data import." % self.label)
+
+        with zipfile.ZipFile(download.path) as z:
+            excel_filename = next(name for name in z.namelist() if name.lower().endswith('.xlsx'))
+            z.extract(excel_filename, self.downloads_path)
+        logger.info("Successfully extracted the zip file")
+
+        with transaction.atomic(), XlsxReader(self.downloads_path + excel_filename) as wb:
+            total_values = self.import_workbook(wb)
+
+            if last_import:
+                import_notes = 'Imported a total of %s data values.' % total_values
+            else:
+                import_notes = 'Initial import of %s' % self.label
+            ImportHistory(import_type=self.namespace, import_time=timezone.now().strftime('%Y-%m-%d %H:%M:%S'),
+                          import_notes=import_notes,
+                          import_state=json.dumps({'file_hash': download.hash})).save()
+
+        # now exporting csvs to the repo
+        if self.csv_committer:
+            for dataset in Dataset.objects.filter(namespace=self.namespace):
+                old_name = dataset.name if dataset.pk in self.existing_dataset_ids else None
+                write_dataset_csv(dataset.pk, dataset.name, old_name, self.csv_committer, '')
+
+        logger.info("Import complete.")
+        print("--- %s seconds ---" % (time.time() - start_time))
+
+    def import_workbook(self, wb):
+        series_rows = wb['Series'].rows
+        data_rows = wb['Data'].rows
+        series_columns = check_headers(series_rows, 'Series', self.series_headers)
+        data_columns = check_headers(data_rows, 'Data', self.data_headers)
+
+        indicators = {}  # global catalog of indicators, by code
+        for row in series_rows:
+            if row[series_columns['Series Code']]:
+                indicator = self.read_indicator(row, series_columns)
+                indicators[indicator['code']] = indicator
+
+        year_by_column = {
+            column: year_or_none(header)
+            for header, column in data_columns.items()
+            if year_or_none(header) is not None
+        }
+        year_columns = sorted(year_by_column)
+        if not year_columns:
+            terminate("No years on 'Data' worksheet")
+        years = [year_by_column[column] for column in year_columns]
+        timespan = '%s-%s' % (years[0], years[-1]) if self.timespan else ''
+
+        with connection.cursor() as c:
+            self.remove_unpublished_variables(c, indicators)
+            variable_id_by_code = self.upsert_metadata(c, indicators, timespan)
+
+            if self.country_info_url_name:
+                country_name_by_code = self.import_country_info(wb['Country'].rows)
+            else:
+                country_name_by_code = {}
+            entity_resolver = EntityResolver()
+            entity_id_by_code = entity_resolver.entity_ids(country_name_by_code)
+
+            # the data_values of the published variables are replaced with the
+            # ones in the Data sheet
+            variable_ids = list(variable_id_by_code.values())
+            for start in range(0, len(variable_ids), 100):
+                while c.execute('DELETE FROM data_values WHERE variableId IN %s LIMIT %s',
+                                [variable_ids[start:start + 100], DELETE_BATCH_SIZE]):
+                    pass
+            logger.info("Deleted the old data values.")
+
+            country_name_column = data_columns['Country Name']
+            country_code_column = data_columns['Country Code']
+            indicator_code_column = data_columns['Indicator Code']
+            total_values = 0
+
+            # LOAD DATA LOCAL INFILE where the server allows it, otherwise
+            # executemany(). The loader gets a cursor of the underlying
+            # connection, in the same transaction, because Django's cursor
+            # turns the MySQL errors that the loader falls back on into its own.
+            loader = DBUtils(connection.connection.cursor())
+
+            # The Data sheet is read once, and reshaped a block of rows at a
+            # time, see reshape.py. The rows of indicators that are not in the
+            # Series sheet are skipped.
+            for rows in blocks(data_rows):
+                governor.tick(len(rows))
+                rows = [row for row in rows if row[indicator_code_column] and row[indicator_code_column].upper().strip() in variable_id_by_code]
+                if not rows:
+                    continue
+                # the countries missing from the Country sheet are looked up by
+                # the name they have in the Data sheet
+                missing_countries = {
+                    row[country_code_column]: row[country_name_column]
+                    for row in rows
+                    if row[country_code_column] not in entity_id_by_code
+                }
+                if missing_countries:
+                    entity_id_by_code.update(entity_resolver.entity_ids(missing_countries))
+                data_values_tuple_list = wide_to_long(
+                    value_block(rows, columns=year_columns),
+                    (COLUMNS, years),
+                    (ROWS, [entity_id_by_code[row[country_code_column]] for row in rows]),
+                    (ROWS, [variable_id_by_code[row[indicator_code_column].upper().strip()] for row in rows])
+                )
+                total_values += loader.bulk_load_data_values(data_values_tuple_list)['rows']
+                logger.info("Dumping data values... %s so far" % total_values)
+
+            self.remove_empty_datasets(c)
+        return total_values
+
+    # Reads an indicator from its row of the Series sheet
+    def read_indicator(self, row, columns):
+        def text(header):
+            return row[columns[header]] or ''
+
+        category = text('Topic')
+        if self.split_topics:
+            category = category.split(':')[0]
+        name = text('Indicator Name')
+        unit = text('Unit of measure') if self.use_unit_column and row[columns['Unit of measure']] not in MISSING_UNITS else ''
+        # if no unit is specified, try to derive it from the name
+        if not unit and '(' in name:
+            unit = name[name.rfind('(') + 1:name.rfind(')')]
+        if self.max_unit_length and len(unit) >= self.max_unit_length:
+            unit = ''
+        return {
+            'code': text('Series Code').upper().strip(),
+            'category': category,
+            'name': name,
+            'description': row[columns['Long definition']],
+            'unit': unit,
+            'short_unit': short_unit_extract(unit),
+            'limitations': text('Limitations and exceptions'),
+            'sourcenotes': text('Notes from original source'),
+            'comments': text('General comments'),
+            'source': row[columns['Source']],
+            'concept': text('Statistical concept and methodology'),
+            'sourcelinks': text('Related source links'),
+            'weblinks': text('Other web links'),
+        }
+
+    def source_description(self, indicator):
+        source_description = {
+            'dataPublishedBy': self.published_by,
+            'link': self.link,
+            'retrievedDate': self.retrieved_date,
+            'additionalInfo': '',
+            'dataPublisherSource': indicator['source'],
+        }
+        if self.country_info_url_name:
+            source_description['additionalInfo'] += "Definitions and characteristics of countries and other territories: " + "https://ourworldindata.org" + reverse(self.country_info_url_name) + "\n"
+        for title, field in ADDITIONAL_INFO_SECTIONS:
+            if indicator[field]:
+                source_description['additionalInfo'] += title + ":\n" + indicator[field] + "\n"
+        if self.publisher_for:
+            source_description['dataPublishedBy'] = self.publisher_for(source_description) or self.published_by
+        return json.dumps(source_description)
+
+    # Variables that are no longer published are removed, along with their
+    # data_values and sources, unless a chart uses them
+    def remove_unpublished_variables(self, c, indicators):
+        c.execute("""
+            SELECT DISTINCT
+                variables.id,
+                variables.code,
+                variables.sourceId,
+                chart_dimensions.id IS NOT NULL
+            FROM variables
+            JOIN datasets ON datasets.id = variables.datasetId
+            LEFT JOIN chart_dimensions ON chart_dimensions.variableId = variables.id
+            WHERE datasets.namespace = %s
+        """, [self.namespace])
+        unpublished = [(var_id, code, source_id) for var_id, code, source_id, is_used in c.fetchall()
+                       if code not in indicators and not is_used]
+        if not unpublished:
+            return
+
+        var_ids_to_remove = [var_id for var_id, _, _ in unpublished]
+        for var_id, code, _ in unpublished:
+            logger.info("Deleting the variable: %s" % code)
+            while c.execute('DELETE FROM data_values WHERE variableId = %s LIMIT %s', [var_id, DELETE_BATCH_SIZE]):
+                pass
+        c.execute('DELETE FROM variables WHERE id IN %s', [var_ids_to_remove])
+        # only delete the sources if there are no variables referencing them
+        c.execute("""
+            DELETE sources
+            FROM sources
+            LEFT JOIN variables ON variables.sourceId = sources.id
+            WHERE variables.id IS NULL AND sources.id IN %s
+        """, [[source_id for _, _, source_id in unpublished]])
+
+    # Upserts the tags, datasets, sources and variables of the indicators, and
+    # returns the id of every indicator's variable, by code
+    def upsert_metadata(self, c, indicators, timespan):
+        categories = list(dict.fromkeys(indicator['category'] for indicator in indicators.values()))
+
+        c.execute('SELECT id FROM tags WHERE name = %s', [self.tag_name])
+        parent_tag = c.fetchone()
+        if parent_tag is None:
+            c.execute('INSERT INTO tags (name, createdAt, updatedAt, isBulkImport) VALUES (%s, NOW(), NOW(), TRUE)', [self.tag_name])
+            logger.info("Inserting a category %s." % self.tag_name)
+            c.execute('SELECT id FROM tags WHERE name = %s', [self.tag_name])
+            parent_tag = c.fetchone()
+        parent_tag_id = parent_tag[0]
+
+        # a tag for every category, under the parent tag. Tag names are unique
+        # across all importers, and the databanks share categories such as
+        # 'Health', so a category's tag is named after its dataset.
+        tag_names = [self.dataset_name(category) for category in categories]
+        c.executemany("""
+            INSERT INTO
+                tags (name, parentId, createdAt, updatedAt, isBulkImport)
+            VALUES
+                (%s, %s, NOW(), NOW(), TRUE)
+            ON DUPLICATE KEY UPDATE
+                updatedAt = VALUES(updatedAt)
+        """, [(tag_name, parent_tag_id) for tag_name in tag_names])
+        c.execute('SELECT name, id FROM tags WHERE name IN %s', [tag_names])
+        tag_id_by_name = dict(c.fetchall())
+
+        # a dataset for every category
+        dataset_id_by_name = {
+            dataset.name: dataset.pk for dataset in Dataset.objects.filter(namespace=self.namespace)
+        }
+        self.existing_dataset_ids = set(dataset_id_by_name.values())
+        new_categories = [category for category in categories if self.dataset_name(category) not in dataset_id_by_name]
+        if new_categories:
+            Dataset.objects.bulk_create([
+                Dataset(name=self.dataset_name(category),
+                        description='This is a dataset imported by the automated fetcher',
+                        namespace=self.namespace)
+                for category in new_categories
+            ])
+            dataset_id_by_name = {
+                dataset.name: dataset.pk for dataset in Dataset.objects.filter(namespace=self.namespace)
+            }
+            DatasetTag.objects.bulk_create([
+                DatasetTag(dataset_id_id=dataset_id_by_name[self.dataset_name(category)], tag_id_id=tag_id_by_name[self.dataset_name(category)])
+                for category in new_categories
+            ])
+            logger.info("Inserted %s datasets." % len(new_categories))
+
+        # the variables are matched by code, and keep their source
+        c.execute("""
+            SELECT variables.code, variables.id, variables.sourceId
+            FROM variables
+            JOIN datasets ON datasets.id = variables.datasetId
+            WHERE datasets.namespace = %s
+        """, [self.namespace])
+        existing_variables = {code: (var_id, source_id) for code, var_id, source_id in c.fetchall()}
+
+        rows = []
+        for indicator in indicators.values():
+            var_id, source_id = existing_variables.get(indicator['code'], (None, None))
+            rows.append((indicator, var_id, source_id, dataset_id_by_name[self.dataset_name(indicator['category'])]))
+
+        # This is actually a bulk UPDATE of the existing sources, since the
+        # primary key always clashes
+        c.executemany("""
+            INSERT INTO
+                sources (id, name, description, datasetId, createdAt, updatedAt)
+            VALUES
+                (%s, %s, %s, %s, NOW(), NOW())
+            ON DUPLICATE KEY UPDATE
+                name = VALUES(name),
+                description = VALUES(description),
+                datasetId = VALUES(datasetId),
+                updatedAt = VALUES(updatedAt)
+        """, [
+            (source_id, self.source_name(indicator), self.source_description(indicator), dataset_id)
+            for indicator, var_id, source_id, dataset_id in rows if source_id
+        ])
+        c.executemany("""
+            INSERT INTO
+                sources (name, description, datasetId, createdAt, updatedAt)
+            VALUES
+                (%s, %s, %s, NOW(), NOW())
+        """, [
+            (self.source_name(indicator), self.source_description(indicator), dataset_id)
+            for indicator, var_id, source_id, dataset_id in rows if not source_id
+        ])
+        c.execute("""
+            SELECT sources.name, sources.datasetId, sources.id
+            FROM sources
+            JOIN datasets ON datasets.id = sources.datasetId
+            WHERE datasets.namespace = %s
+        """, [self.namespace])
+        source_id_by_key = {(name, dataset_id): source_id for name, dataset_id, source_id in c.fetchall()}
+
+        variable_rows = [
+            (indicator['name'], indicator['unit'], indicator['short_unit'], indicator['description'], indicator['code'],
+             timespan, dataset_id, source_id or source_id_by_key[(self.source_name(indicator), dataset_id)])
+            for indicator, var_id, source_id, dataset_id in rows
+        ]
+        c.executemany("""
+            INSERT INTO
+                variables (id, name, unit, shortUnit, description, code, timespan, datasetId, sourceId, coverage, display, createdAt, updatedAt)
+            VALUES
+                (%s, %s, %s, %s, %s, %s, %s, %s, %s, '', '{}', NOW(), NOW())
+            ON DUPLICATE KEY UPDATE
+                name = VALUES(name),
+                unit = VALUES(unit),
+                shortUnit = VALUES(shortUnit),
+                description = VALUES(description),
+                timespan = VALUES(timespan),
+                datasetId = VALUES(datasetId),
+                sourceId = VALUES(sourceId),
+                updatedAt = VALUES(updatedAt)
+        """, [
+            (var_id,) + variable_row
+            for (indicator, var_id, source_id, dataset_id), variable_row in zip(rows, variable_rows) if var_id
+        ])
+        c.executemany("""
+            INSERT INTO
+                variables (name, unit, shortUnit, description, code, timespan, datasetId, sourceId, coverage, display, createdAt, updatedAt)
+            VALUES
+                (%s, %s, %s, %s, %s, %s, %s, %s, '', '{}', NOW(), NOW())
+        """, [
+            variable_row
+            for (indicator, var_id, source_id, dataset_id), variable_row in zip(rows, variable_rows) if not var_id
+        ])
+        logger.info("Upserted %s variables, %s of them new." % (len(rows), sum(1 for row in rows if not row[1])))
+
+        c.execute("""
+            SELECT variables.code, variables.id
+            FROM variables
+            JOIN datasets ON datasets.id = variables.datasetId
+            WHERE datasets.namespace = %s
+        """, [self.namespace])
+        return {code: var_id for code, var_id in c.fetchall() if code in indicators}
+
+    def dataset_name(self, category):
+        return self.tag_name + ' - ' + category
+
+    def source_name(self, indicator):
+        return self.source_name_prefix + ': ' + indicator['name']
+
+    # Replaces the additional country info of the namespace with the Country
+    # sheet's, and returns the country names by code
+    def import_country_info(self, rows):
+        columns = check_headers(rows, 'Country', self.country_headers)
+        country_name_by_code = {}
+        country_infos = []
+        for row in rows:
+            country_code = row[columns['Country Code']]
+            if not country_code:
+                continue
+            country_name_by_code[country_code] = row[columns[self.country_name_header]]
+            country_infos.append(AdditionalCountryInfo(
+                country_code=country_code,
+                country_name=row[columns[self.country_name_header]],
+                country_wb_region=row[columns['Region']],
+                country_wb_income_group=row[columns['Income Group']],
+                country_special_notes=row[columns['Special Notes']],
+                country_latest_census=row[columns['Latest population census']],
+                country_latest_survey=row[columns['Latest household survey']],
+                country_recent_income_source=row[columns['Source of most recent Income and expenditure data']],
+                dataset=self.namespace
+            ))
+        AdditionalCountryInfo.objects.filter(dataset=self.namespace).delete()  # We will load new additional country data now
+        AdditionalCountryInfo.objects.bulk_create(country_infos)
+        return country_name_by_code
+
+    # Deletes the datasets that don't have any variables anymore, and the
+    # tags of their categories
+    def remove_empty_datasets(self, c):
+        c.execute("""
+            SELECT datasets.id, datasets.name, dataset_tags.tagId
+            FROM datasets
+            LEFT JOIN variables ON variables.datasetId = datasets.id
+            LEFT JOIN dataset_tags ON dataset_tags.datasetId = datasets.id
+            WHERE datasets.namespace = %s AND variables.id IS NULL
+        """, [self.namespace])
+        empty_datasets = c.fetchall()
+        if not empty_datasets:
+            return
+        for dataset_id, name, tag_id in empty_datasets:
+            logger.info("Deleting empty dataset %s." % name)
+        dataset_ids = [dataset_id for dataset_id, _, _ in empty_datasets]
+        tag_ids = [tag_id for _, _, tag_id in empty_datasets if tag_id is not None]
+        c.execute('DELETE FROM sources WHERE datasetId IN %s', [dataset_ids])
+        c.execute('DELETE FROM dataset_tags WHERE datasetId IN %s', [dataset_ids])
+        c.execute('DELETE FROM datasets WHERE id IN %s', [dataset_ids])
+        if tag_ids:
+            c.execute("""
+                DELETE tags
+                FROM tags
+                LEFT JOIN dataset_tags ON dataset_tags.tagId = tags.id
+                WHERE dataset_tags.tagId IS NULL AND tags.id IN %s
+            """, [tag_ids])
@@ -0,0 +1,98 @@
+import itertools
+
+# Turns wide rows, which hold one column per year (or per variable), into the
+# long (value, year, entityId, variableId) rows of data_values. The rows are
+# read a block at a time, and the long rows of the whole block are put
+# together in one pass over its cells, with the keys of every row and column
+# looked up once, instead of through a state machine that looks at every cell
+# with the row and column numbers it has counted.
+#
+#   for block in blocks(rows):
+#       values = value_block(block, start=4)
+#       entity_ids = [entity_id_by_code[row[1]] for row in block]
+#       for value, year, entity_id in wide_to_long(values, (COLUMNS, years), (ROWS, entity_ids)):
+#           ...
+
+BLOCK_SIZE = 10000  # rows
+
+# The cells that hold no value. 0 is a value, unless the importer says
+# otherwise with the `missing` argument of wide_to_long().
+MISSING_VALUES = (None, '')
+
+# Which of the row indexes and column indexes of a block a key follows
+ROWS = 0
+COLUMNS = 1
+
+# Splits an iterator of rows into lists of at most `size` rows
+def blocks(rows, size=BLOCK_SIZE):
+    rows = iter(rows)
+    while True:
+        block = list(itertools.islice(rows, size))
+        if not block:
+            return
+        yield block
+
+# The cells start:stop of every row, or the cells of the given `columns` (in
+# that order), as a list of tuples of the same length. Rows shorter than the
+# others are padded with None. The values are kept as the Python objects they
+# were read as (ints stay ints and text stays text).
+def value_block(rows, start=0, stop=None, columns=None):
+    if columns is not None:
+        columns = list(columns)
+        width = max(columns) + 1 if columns else 0
+        return [
+            tuple(row[column] for column in columns) if len(row) >= width
+            else tuple(row[column] if column < len(row) else None for column in columns)
+            for row in rows
+        ]
+    if stop is None:
+        stop = max((len(row) for row in rows), default=start)
+    width = max(stop - start, 0)
+    block = []
+    for row in rows:
+        cells = tuple(row[start:stop])
+        if len(cells) < width:
+            cells += (None,) * (width - len(cells))
+        block.append(cells)
+    return block
+
+# Where the block holds a value. The cells are compared with the values' own
+# ==, so a missing 0 also matches 0.0.
+def present_mask(block, missing=MISSING_VALUES):
+    return [[value not in missing for value in row] for row in block]
+
+# The long rows of a block: the value of each cell that holds one, followed by
+# its keys, in the order the cells were read in (row by row). Every key is
+# given as (ROWS, a key per row of the block) or (COLUMNS, a key per column of
+# the block). The keys of the rows can come before or after the keys of the
+# columns, but not in between them.
+def wide_to_long(block, *keys, missing=MISSING_VALUES):
+    if not block:
+        return []
+    axes = [axis for axis, _ in keys]
+    columns_first = axes == sorted(axes, reverse=True)
+    if not columns_first and axes != sorted(axes):
+        raise ValueError('The keys of the rows and of the columns are interleaved')
+
+    # the keys of every row and of every column, as tuples
+    width = len(block[0])
+    column_keys = [key_values for axis, key_values in keys if axis == COLUMNS]
+    keys_by_column = list(zip(*column_keys)) if column_keys else [()] * width
+    row_keys = [key_values for axis, key_values in keys if axis == ROWS]
+    keys_by_row = list(zip(*row_keys)) if row_keys else [()] * len(block)
+
+    long_rows = []
+    for row, row_key in zip(block, keys_by_row):
+        if columns_first:
+            long_rows.extend([
+                (value,) + column_key + row_key
+                for value, column_key in zip(row, keys_by_column)
+                if value not in missing
+            ])
+        else:
+            long_rows.extend([
+                (value,) + row_key + column_key
+                for value, column_key in zip(row, keys_by_column)
+                if value not in missing
+            ])
+    return long_rows
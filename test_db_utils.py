@@ -0,0 +1,401 @@
+import os
+import sys
+import json
+import threading
+import unittest
+from contextlib import contextmanager
+import pymysql.cursors
+from pymysql.err import OperationalError
+
+# the importer scripts import their modules from the importer directory
+sys.path.insert(1, os.path.join(os.path.dirname(os.path.realpath(__file__)), 'importer'))
+from db_utils import DBUtils, BulkLoadCheckFailed, DuplicateDataValues, parse_tsv_field
+
+class FakeConnection:
+
+    def __init__(self, results=()):
+        self.results = results
+        self.commits = 0
+        self.cursor_classes = []
+
+    def cursor(self, cursor_class=None):
+        self.cursor_classes.append(cursor_class)
+        cursor = FakeCursor(self.results)
+        cursor.connection = self
+        return cursor
+
+    def commit(self):
+        self.commits += 1
+
+    def rollback(self):
+        pass
+
+# Stands in for a pymysql cursor. Every statement is recorded with its
+# whitespace collapsed, and a statement returns the rows of the first of
+# `results` whose fragment it contains, given as a list or as a function of
+# the statement's arguments. Its rowcount is the number of those rows, or 1
+# for a statement without results that isn't a SELECT.
+class FakeCursor:
+
+    def __init__(self, results=()):
+        self.results = list(results)
+        self.statements = []
+        self.rows = []
+        self.rowcount = 0
+        self.connection = FakeConnection(self.results)
+
+    def execute(self, query, args=None):
+        query = ' '.join(query.split())
+        self.statements.append((query, args))
+        self.rows = []
+        self.rowcount = 0 if query.startswith('SELECT') else 1
+        for fragment, rows in self.results:
+            if fragment in query:
+                self.rows = list(rows(args) if callable(rows) else rows)
+                self.rowcount = len(self.rows)
+                break
+
+    def executemany(self, query, args):
+        args = list(args)
+        self.statements.append((' '.join(query.split()), args))
+        self.rows = []
+        self.rowcount = len(args)
+
+    def fetchall(self):
+        return tuple(self.rows)
+
+    def fetchone(self):
+        return self.rows[0] if self.rows else None
+
+    def fetchall_unbuffered(self):
+        return iter(self.rows)
+
+    def close(self):
+        pass
+
+    def queries(self, fragment):
+        return [(query, args) for query, args in self.statements if fragment in query]
+
+class ResolveEntitiesTests(unittest.TestCase):
+
+    def test_new_entities_are_inserted_once(self):
+        cursor = FakeCursor([
+            ('country_name_tool_countryname', [
+                ("cote d'ivoire", "cote d'ivoire", 2),
+                ('ivory coast', "cote d'ivoire", 2),
+                (None, 'france', 1)
+            ]),
+            ('SELECT name, id FROM entities', [('Narnia', 3)])
+        ])
+        db = DBUtils(cursor)
+        entity_id_by_name = db.resolve_entities(['France', 'Ivory Coast', "Côte d'Ivoire", 'Narnia', 'NARNIA', 'France'])
+        self.assertEqual(entity_id_by_name, {'France': 1, 'Ivory Coast': 2, "Côte d'Ivoire": 2, 'Narnia': 3, 'NARNIA': 3})
+        ((query, args),) = cursor.queries('INSERT INTO entities')
+        self.assertEqual(args, ['Narnia'])
+        self.assertEqual(db.get_counts()['entities_inserted'], 1)
+
+    def test_cached_names_need_no_queries(self):
+        cursor = FakeCursor([('country_name_tool_countryname', [(None, 'france', 1)])])
+        db = DBUtils(cursor)
+        db.resolve_entities(['France'])
+        num_statements = len(cursor.statements)
+        self.assertEqual(db.get_or_create_entity('FRANCE'), 1)
+        self.assertEqual(len(cursor.statements), num_statements)
+
+class UpsertManyTests(unittest.TestCase):
+
+    def test_sources_are_updated_or_inserted(self):
+        sources = [
+            {'name': 'Deaths', 'description': '{}', 'dataset_id': 1},
+            {'name': 'Births', 'description': '{}', 'dataset_id': 1},
+            {'name': 'Deaths', 'description': '{}', 'dataset_id': 1}
+        ]
+        fetches = iter([
+            [('Deaths', 1, 10)],
+            [('Deaths', 1, 10), ('Births', 1, 11)]
+        ])
+        cursor = FakeCursor([('FROM sources', lambda args: next(fetches))])
+        db = DBUtils(cursor)
+        self.assertEqual(db.upsert_sources_many('gbd', sources), [10, 11, 10])
+        ((_, updated),) = cursor.queries('INSERT INTO sources (id,')
+        self.assertEqual(updated, [(10, 'Deaths', '{}', 1)])
+        ((_, inserted),) = cursor.queries('INSERT INTO sources (name,')
+        self.assertEqual(inserted, [('Births', '{}', 1)])
+
+    def test_variables_fetch_only_the_upserted_ones(self):
+        variables = [
+            {'name': 'Deaths - Both sexes', 'code': None, 'unit': 'deaths', 'short_unit': None, 'source_id': 10, 'dataset_id': 1},
+            {'name': 'Deaths - Female', 'code': 'D-F', 'unit': 'deaths', 'short_unit': None, 'source_id': 10, 'dataset_id': 2}
+        ]
+        cursor = FakeCursor([('FROM variables', [('Deaths - Both sexes', 1, 100), ('Deaths - Female', 2, 101)])])
+        db = DBUtils(cursor)
+        self.assertEqual(db.upsert_variables_many('gbd', variables), [100, 101])
+        ((query, args),) = cursor.queries('FROM variables')
+        self.assertNotIn('namespace', query)
+        self.assertEqual(sorted(args[0]), [1, 2])
+        self.assertEqual(sorted(args[1]), ['Deaths - Both sexes', 'Deaths - Female'])
+        self.assertEqual(db.upsert_variables_many('gbd', []), [])
+
+# The rows of a TSV file written for LOAD DATA, read back the way MySQL reads them
+def read_tsv(path):
+    with open(path, encoding='utf8', newline='') as tsv_file:
+        return [
+            tuple(parse_tsv_field(field) for field in line.rstrip('\n').split('\t'))
+            for line in tsv_file
+        ]
+
+DATA_VALUES = [
+    (0.1, 2000, 1, 10),
+    ('1,5', 2001, 1, 10),
+    (None, 2002, 1, 10),
+    ('tab\there', 2000, 2, 10),
+    ('two\nlines', 2000, 3, 10),
+    ('back\\slash \\N', 2000, 4, 10)
+]
+
+# What MySQL stores for DATA_VALUES, every field of which is a string
+STORED_DATA_VALUES = [
+    tuple(None if field is None else repr(field) if isinstance(field, float) else str(field) for field in row)
+    for row in DATA_VALUES
+]
+
+class BulkLoadDataValuesTests(unittest.TestCase):
+
+    def test_tsv_round_trips(self):
+        loaded = []
+        def load(args):
+            loaded.extend(read_tsv(args[0]))
+            return loaded
+        db = DBUtils(FakeCursor([('LOAD DATA LOCAL INFILE', load)]))
+        stats = db.bulk_load_data_values(iter(DATA_VALUES))
+        self.assertEqual(loaded, STORED_DATA_VALUES)
+        self.assertEqual((stats['method'], stats['rows']), ('load_data_local_infile', len(DATA_VALUES)))
+
+    def test_skipped_rows_fail_the_load(self):
+        cursor = FakeCursor([('LOAD DATA LOCAL INFILE', lambda args: read_tsv(args[0])[1:])])
+        db = DBUtils(cursor)
+        with self.assertRaises(DuplicateDataValues):
+            db.bulk_load_data_values(DATA_VALUES)
+        ((query, _),) = cursor.queries('LOAD DATA')
+        self.assertNotIn('IGNORE', query)
+        # replaced rows count twice, so they aren't checked
+        cursor.results = [('LOAD DATA LOCAL INFILE', [])]
+        self.assertEqual(db.bulk_load_data_values(DATA_VALUES, replace=True)['rows'], len(DATA_VALUES))
+
+    def test_falls_back_to_executemany(self):
+        def refuse(args):
+            raise OperationalError(1148, 'The used command is not allowed with this MySQL version')
+        cursor = FakeCursor([('LOAD DATA LOCAL INFILE', refuse)])
+        db = DBUtils(cursor)
+        stats = db.bulk_load_data_values(DATA_VALUES)
+        self.assertEqual((stats['method'], stats['rows']), ('executemany', len(DATA_VALUES)))
+        ((query, rows),) = cursor.queries('INSERT INTO data_values')
+        self.assertNotIn('IGNORE', query)
+        self.assertNotIn('ON DUPLICATE KEY', query)
+        self.assertEqual(rows, STORED_DATA_VALUES)
+        # the next load doesn't try LOAD DATA again
+        db.bulk_load_data_values(DATA_VALUES[:1])
+        self.assertEqual(len(cursor.queries('LOAD DATA')), 1)
+
+class SyncDataValuesTests(unittest.TestCase):
+
+    def sync(self, existing_rows, incoming_rows):
+        loaded = []
+        def load(args):
+            loaded.extend(read_tsv(args[0]))
+            return read_tsv(args[0])
+        cursor = FakeCursor([
+            ('SELECT entityId, year, value', existing_rows),
+            ('LOAD DATA LOCAL INFILE', load)
+        ])
+        counts = DBUtils(cursor).sync_data_values(10, incoming_rows)
+        updated = [rows for _, rows in cursor.queries('ON DUPLICATE KEY UPDATE')]
+        deleted = [args[1] for _, args in cursor.queries('DELETE FROM data_values')]
+        return counts, loaded, updated, deleted
+
+    def test_writes_only_the_differences(self):
+        counts, loaded, updated, deleted = self.sync(
+            [(1, 2000, '1.0'), (1, 2001, '2'), (2, 1990, 'a'), (2, 2000, 'x'), (4, 2000, '7')],
+            [(1, 2000, 1), ('1', '2001', '2'), (1, 2001, '3'), (2, 2000, 'x'), (3, 1999, '5'), (4, 2000, '7'), (5, 2000, 8)]
+        )
+        self.assertEqual(counts, {'inserted': 2, 'updated': 1, 'deleted': 1, 'unchanged': 3})
+        self.assertEqual(loaded, [('5', '1999', '3', '10'), ('8', '2000', '5', '10')])
+        self.assertEqual(updated, [[('3', 2001, 1, 10)]])
+        self.assertEqual(deleted, [[(2, 1990)]])
+
+    def test_empty_sides(self):
+        counts, loaded, updated, deleted = self.sync([], [(1, 2000, '1')])
+        self.assertEqual(counts, {'inserted': 1, 'updated': 0, 'deleted': 0, 'unchanged': 0})
+        self.assertEqual((updated, deleted), ([], []))
+        counts, loaded, updated, deleted = self.sync([(1, 2000, '1'), (1, 2001, '2')], [])
+        self.assertEqual(counts, {'inserted': 0, 'updated': 0, 'deleted': 2, 'unchanged': 0})
+        self.assertEqual((loaded, deleted), ([], [[(1, 2000), (1, 2001)]]))
+
+    def test_streams_the_stored_rows(self):
+        cursor = FakeCursor([('SELECT entityId, year, value', [(1, 2000, '1')])])
+        DBUtils(cursor).sync_data_values(10, [(1, 2000, '2')])
+        self.assertEqual(cursor.connection.cursor_classes, [pymysql.cursors.SSCursor])
+        self.assertEqual(cursor.queries('SELECT entityId, year, value'), [])
+
+class ImportHistoryTests(unittest.TestCase):
+
+    def test_later_fingerprints_take_precedence(self):
+        states = [
+            json.dumps({'variable_fingerprints': {'1': 'a', '2': 'b'}}),
+            'not json',
+            json.dumps({'file_name': 'Trade.zip'}),
+            json.dumps({'variable_fingerprints': {'2': 'c', '3': 'd'}})
+        ]
+        db = DBUtils(FakeCursor([('FROM importer_importhistory', [(state,) for state in states])]))
+        self.assertEqual(db.fetch_variable_fingerprints('faostat_2018'), {'1': 'a', '2': 'c', '3': 'd'})
+
+# Hands out a connection per worker, or fails to open one if `error` is given
+class FakePool:
+
+    def __init__(self, size, results=(), error=None):
+        self.size = size
+        self.results = results
+        self.error = error
+        self.connections = []
+        self.lock = threading.Lock()
+
+    @contextmanager
+    def connection(self):
+        if self.error is not None:
+            raise self.error
+        connection = FakeConnection(self.results)
+        with self.lock:
+            self.connections.append(connection)
+        yield connection
+
+class RunTests(unittest.TestCase):
+
+    def test_resumes_the_last_interrupted_run(self):
+        states = [
+            {'checkpoint': 'a.csv', 'run': 'first', 'input_hash': '1'},
+            {'file_name': 'done'},
+            {'checkpoint': 'a.csv', 'run': 'second', 'input_hash': '1'},
+            {'checkpoint': 'a.csv', 'run': 'third', 'input_hash': '2'},
+            {'checkpoint': 'b.csv', 'run': 'third', 'input_hash': '2'}
+        ]
+        cursor = FakeCursor([('FROM importer_importhistory', [(json.dumps(state),) for state in states])])
+        run, checkpoints = DBUtils(cursor).begin_run('gbd', resume=True)
+        self.assertEqual(run, 'third')
+        self.assertEqual([checkpoint['checkpoint'] for checkpoint in checkpoints], ['a.csv', 'b.csv'])
+
+    def test_completed_runs_are_not_resumed(self):
+        states = [{'checkpoint': 'a.csv', 'run': 'first', 'input_hash': '1'}, {'file_name': 'done'}]
+        cursor = FakeCursor([('FROM importer_importhistory', [(json.dumps(state),) for state in states])])
+        run, checkpoints = DBUtils(cursor).begin_run('gbd', resume=True)
+        self.assertNotEqual(run, 'first')
+        self.assertEqual(checkpoints, [])
+        cursor = FakeCursor()
+        run, checkpoints = DBUtils(cursor).begin_run('gbd', resume=False)
+        self.assertEqual((len(run), checkpoints, cursor.statements), (32, [], []))
+
+    def test_checkpoint_notes_and_commits(self):
+        cursor = FakeCursor()
+        DBUtils(cursor).checkpoint('gbd', 'third', 'b.csv', '2', touched_var_codes=['x'])
+        ((_, args),) = cursor.queries('INSERT INTO importer_importhistory')
+        self.assertEqual(args[:2], ['gbd', 'Checkpoint: b.csv'])
+        self.assertEqual(json.loads(args[2]), {'touched_var_codes': ['x'], 'checkpoint': 'b.csv', 'run': 'third', 'input_hash': '2'})
+        self.assertEqual(cursor.connection.commits, 1)
+
+class InstrumentationTests(unittest.TestCase):
+
+    def test_statements_are_labelled_with_the_outermost_method(self):
+        db = DBUtils(FakeCursor([('SELECT id FROM tags', [(5,)])]))
+        db.enable_instrumentation()
+        self.assertEqual(db.upsert_parent_tag('FAOSTAT 2018'), 5)
+        db.touch_variables([1, 2])
+        db.touch_variables([3])
+        stats = {stats['method']: stats for stats in db.get_statement_stats()}
+        self.assertEqual(set(stats), {'upsert_parent_tag', 'touch_variables'})
+        self.assertEqual(stats['touch_variables']['calls'], 2)
+        self.assertIsNone(db.statement_label)
+
+class BulkLoadModeTests(unittest.TestCase):
+
+    def cursor(self, orphaned_rows=0, duplicate_keys=0):
+        return FakeCursor([
+            ('LOAD DATA LOCAL INFILE', lambda args: read_tsv(args[0])),
+            ('LEFT JOIN entities', [(orphaned_rows,)]),
+            ('GROUP BY entityId, variableId, year', [(duplicate_keys,)]),
+            ('SELECT @@SESSION', [(1, 1, 8388608)])
+        ])
+
+    def test_only_the_loads_run_without_checks(self):
+        cursor = self.cursor()
+        db = DBUtils(cursor)
+        with db.bulk_load_mode():
+            db.bulk_load_data_values(DATA_VALUES[:3])
+            db.touch_variables([10])
+            db.bulk_load_data_values([(1, 2000, 1, 11)])
+        queries = [query.split()[0] for query, _ in cursor.statements]
+        self.assertEqual(queries[:8], ['SELECT', 'SET', 'LOAD', 'SET', 'UPDATE', 'SELECT', 'SET', 'LOAD'])
+        (_, args) = cursor.queries('SET SESSION')[-1]
+        self.assertEqual(args, [1, 1, 8388608])
+        # the loaded variables are checked on exit
+        self.assertEqual(sorted(cursor.queries('LEFT JOIN entities')[0][1][0]), [10, 11])
+        self.assertEqual(db.bulk_load_report, {'variables_checked': 2, 'orphaned_rows': 0, 'duplicate_keys': 0})
+
+    def test_failed_checks_raise_before_the_caller_commits(self):
+        cursor = self.cursor(orphaned_rows=2, duplicate_keys=1)
+        db = DBUtils(cursor)
+        with self.assertRaises(BulkLoadCheckFailed):
+            with db.bulk_load_mode():
+                db.bulk_load_data_values(DATA_VALUES)
+            cursor.connection.commit()
+        self.assertEqual(cursor.connection.commits, 0)
+        self.assertEqual(db.bulk_load_report, {'variables_checked': 1, 'orphaned_rows': 2, 'duplicate_keys': 1})
+
+    def test_disabled_mode_and_errors_skip_the_checks(self):
+        cursor = self.cursor()
+        db = DBUtils(cursor)
+        with db.bulk_load_mode(enabled=False):
+            db.bulk_load_data_values(DATA_VALUES)
+        with self.assertRaises(KeyError):
+            with db.bulk_load_mode():
+                db.bulk_load_data_values(DATA_VALUES)
+                raise KeyError('Spain')
+        self.assertEqual(cursor.queries('LEFT JOIN entities'), [])
+        self.assertIsNone(db.bulk_load_report)
+
+    def test_parallel_loads_are_refused(self):
+        db = DBUtils(self.cursor())
+        with self.assertRaises(ValueError):
+            with db.bulk_load_mode():
+                db.load_data_values(DATA_VALUES, pool=FakePool(2))
+
+class ParallelLoadDataValuesTests(unittest.TestCase):
+
+    def load_in_thread(self, db, pool, data_values):
+        outcome = {}
+        def load():
+            try:
+                outcome['stats'] = db.parallel_load_data_values(pool, data_values, batch_size=2)
+            except Exception as error:
+                outcome['error'] = error
+        thread = threading.Thread(target=load, daemon=True)
+        thread.start()
+        thread.join(10)
+        self.assertFalse(thread.is_alive(), 'the load is stuck')
+        return outcome
+
+    def test_batches_are_committed_by_the_workers(self):
+        data_values = [(str(year), year, 1, variable_id) for variable_id in range(4) for year in range(2000, 2010)]
+        pool = FakePool(3, [('LOAD DATA LOCAL INFILE', lambda args: read_tsv(args[0]))])
+        cursor = FakeCursor()
+        outcome = self.load_in_thread(DBUtils(cursor), pool, data_values)
+        self.assertEqual(outcome['stats']['rows'], len(data_values))
+        self.assertEqual(sum(connection.commits for connection in pool.connections), len(data_values) // 2)
+        # the caller's transaction is left to the caller
+        self.assertEqual(cursor.connection.commits, 0)
+
+    def test_workers_that_cannot_connect_dont_block_the_producer(self):
+        data_values = [(str(year), year, 1, 1) for year in range(2000, 2100)]
+        outcome = self.load_in_thread(DBUtils(FakeCursor()), FakePool(2, error=ConnectionError('refused')), data_values)
+        self.assertIsInstance(outcome.get('error'), ConnectionError)
+
+if __name__ == '__main__':
+    unittest.main()
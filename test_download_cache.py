@@ -0,0 +1,130 @@
+import os
+import shutil
+import hashlib
+import tempfile
+import threading
+import unittest
+from http.server import HTTPServer, BaseHTTPRequestHandler
+
+from download_cache import DownloadCache, DownloadError
+
+# Stands in for the servers the importers download from: it serves the
+# server's `content` at /data.zip with an ETag, answers conditional and Range
+# requests, and drops the connection after `fail_after` bytes when told to
+class StandInHandler(BaseHTTPRequestHandler):
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        server = self.server
+        server.requests.append(dict(self.headers))
+
+        if self.path != '/data.zip':
+            self.send_response(404)
+            self.end_headers()
+            return
+
+        etag = '"%s"' % hashlib.md5(server.content).hexdigest()
+
+        if self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.end_headers()
+            return
+
+        start = 0
+        if self.headers.get('Range') and self.headers.get('If-Range') in (None, etag):
+            start = int(self.headers['Range'].split('=')[1].split('-')[0])
+            if start >= len(server.content):
+                self.send_response(416)
+                self.end_headers()
+                return
+            self.send_response(206)
+            self.send_header('Content-Range', 'bytes %d-%d/%d' % (start, len(server.content) - 1, len(server.content)))
+        else:
+            self.send_response(200)
+
+        body = server.content[start:]
+        self.send_header('ETag', etag)
+        self.send_header('Content-Disposition', 'attachment; filename="data.zip"')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if server.fail_after is not None:
+            self.wfile.write(body[:server.fail_after])
+            server.fail_after = None
+            self.close_connection = True
+            return
+        self.wfile.write(body)
+
+class DownloadCacheTests(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.server = HTTPServer(('127.0.0.1', 0), StandInHandler)
+        self.server.content = os.urandom(300000)
+        self.server.fail_after = None
+        self.server.requests = []
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = 'http://127.0.0.1:%d/data.zip' % self.server.server_address[1]
+        self.cache = DownloadCache(os.path.join(self.directory, 'cache'), timeout=5)
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.directory)
+
+    def test_stores_content_by_hash(self):
+        path = os.path.join(self.directory, 'downloads', 'data.zip')
+        download = self.cache.fetch(self.url, path=path)
+        self.assertTrue(download.changed)
+        self.assertEqual(download.hash, hashlib.md5(self.server.content).hexdigest())
+        self.assertEqual(download.path, self.cache.blob_path(download.hash))
+        with open(path, 'rb') as f:
+            self.assertEqual(f.read(), self.server.content)
+
+    def test_not_modified(self):
+        first = self.cache.fetch(self.url)
+        second = self.cache.fetch(self.url)
+        self.assertEqual(self.server.requests[-1].get('If-None-Match'), '"%s"' % first.hash)
+        self.assertFalse(second.changed)
+        self.assertTrue(second.unchanged_since(first.hash))
+        self.assertEqual(second.path, first.path)
+        self.assertEqual(second.filename, 'data.zip')
+
+    def test_changed(self):
+        first = self.cache.fetch(self.url)
+        self.server.content = os.urandom(1000)
+        second = self.cache.fetch(self.url)
+        self.assertTrue(second.changed)
+        self.assertFalse(second.unchanged_since(first.hash))
+        # the previous content is not kept once no URL refers to it
+        self.assertFalse(os.path.exists(first.path))
+
+    def test_resumes_interrupted_download(self):
+        self.server.fail_after = 100000
+        with self.assertRaises(DownloadError):
+            self.cache.fetch(self.url)
+        download = self.cache.fetch(self.url)
+        # resumed from the last complete chunk
+        resumed_at = int(self.server.requests[-1]['Range'][len('bytes='):-1])
+        self.assertTrue(0 < resumed_at <= 100000)
+        self.assertEqual(download.hash, hashlib.md5(self.server.content).hexdigest())
+        with open(download.path, 'rb') as f:
+            self.assertEqual(f.read(), self.server.content)
+
+    def test_starts_over_when_content_changed_during_download(self):
+        self.server.fail_after = 100000
+        with self.assertRaises(DownloadError):
+            self.cache.fetch(self.url)
+        self.server.content = os.urandom(200000)
+        download = self.cache.fetch(self.url)
+        with open(download.path, 'rb') as f:
+            self.assertEqual(f.read(), self.server.content)
+
+    def test_http_error(self):
+        with self.assertRaises(DownloadError):
+            self.cache.fetch(self.url.replace('data.zip', 'missing.zip'))
+
+if __name__ == '__main__':
+    unittest.main()
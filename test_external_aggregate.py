@@ -0,0 +1,75 @@
+import os
+import pickle
+import random
+import unittest
+
+from external_aggregate import ExternalSum, SpilledRows, SpilledPartitions, BYTES_PER_ENTRY, SPILL_BATCH_SIZE
+
+def rows(count):
+    random.seed(1)
+    return [
+        (('Wheat - Export Quantity - Reporters', random.choice(['France', 'Chad', 'Peru']), random.randint(1990, 2016)), random.randint(0, 1000))
+        for _ in range(count)
+    ]
+
+def sums_in_memory(rows):
+    sums = {}
+    for key, value in rows:
+        sums[key] = sums.get(key, 0) + value
+    return sorted(sums.items())
+
+class ExternalSumTests(unittest.TestCase):
+
+    def test_same_as_in_memory(self):
+        for max_entries in [1, 7, 1000]:
+            with ExternalSum(memory_budget=max_entries * BYTES_PER_ENTRY) as sums:
+                for key, value in rows(500):
+                    sums.add(key, value)
+                spilled = len(sums.runs)
+                self.assertEqual(list(sums.sorted_sums()), sums_in_memory(rows(500)), max_entries)
+            self.assertEqual(spilled > 0, max_entries < 1000, max_entries)
+
+    def test_runs_are_closed(self):
+        sums = ExternalSum(memory_budget=BYTES_PER_ENTRY)
+        sums.add(('a',), 1)
+        sums.add(('b',), 2)
+        runs = list(sums.runs)
+        self.assertEqual(list(sums.sorted_sums()), [(('a',), 1), (('b',), 2)])
+        self.assertTrue(all(run.closed for run in runs))
+
+    def test_empty(self):
+        self.assertEqual(list(ExternalSum().sorted_sums()), [])
+
+class SpilledRowsTests(unittest.TestCase):
+
+    def test_read_again_after_pickling(self):
+        spilled = pickle.loads(pickle.dumps(SpilledRows(iter(rows(2 * SPILL_BATCH_SIZE + 1)))))
+        self.assertEqual(list(spilled), rows(2 * SPILL_BATCH_SIZE + 1))
+        self.assertEqual(list(spilled), rows(2 * SPILL_BATCH_SIZE + 1))
+        spilled.close()
+        self.assertFalse(os.path.exists(spilled.path))
+        spilled.close()
+
+    def test_empty(self):
+        spilled = SpilledRows([])
+        self.assertEqual(list(spilled), [])
+        spilled.close()
+
+class SpilledPartitionsTests(unittest.TestCase):
+
+    def test_reads_each_partition_in_order(self):
+        all_rows = rows(3 * SPILL_BATCH_SIZE)
+        with SpilledPartitions() as partitions:
+            for row in all_rows:
+                partitions.add(row[0][1], row)
+            self.assertEqual(partitions.partitions(), list(dict.fromkeys(row[0][1] for row in all_rows)))
+            for country in partitions.partitions():
+                expected = [row for row in all_rows if row[0][1] == country]
+                self.assertEqual(list(partitions.read(country)), expected)
+                # rows added after a read follow the ones read
+                partitions.add(country, all_rows[0])
+                self.assertEqual(list(partitions.read(country)), expected + [all_rows[0]])
+            self.assertEqual(list(partitions.read('Mali')), [])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,62 @@
+import os
+import sys
+import unittest
+
+# the importer scripts import their modules from the importer directory
+sys.path.insert(1, os.path.join(os.path.dirname(os.path.realpath(__file__)), 'importer'))
+from faostat_layouts import LAYOUTS, find_layout, compile_layout, history_file_name
+
+# A row for every layout, with every field named after its column
+def row_for(layout):
+    return [column.lower() for column in layout['columns']]
+
+class FaostatLayoutsTests(unittest.TestCase):
+
+    def test_every_header_finds_its_own_layout(self):
+        for layout in LAYOUTS:
+            self.assertIs(find_layout(layout['columns'] + ('Extra column',)), layout)
+        self.assertIsNone(find_layout(('Area Code', 'Area')))
+
+    def test_simple_layout(self):
+        layout = LAYOUTS[2]
+        file_layout = compile_layout(layout['columns'], 'Production_Crops_E_All_Data_(Normalized).zip', 'Crops')
+        self.assertFalse(file_layout.is_bilateral)
+        self.assertEqual(
+            file_layout.extractors[0](row_for(layout)),
+            ('area', 'Crops: item - element', 'item code - element code', 'year', 'value', 'unit')
+        )
+
+    def test_unit_in_name(self):
+        layout = LAYOUTS[2]
+        file_layout = compile_layout(layout['columns'], 'Trade_LiveAnimals_E_All_Data_(Normalized).zip', '100% Live animals')
+        self.assertEqual(file_layout.extractors[0](row_for(layout))[1], '100% Live animals: item - element - unit')
+
+    def test_bilateral_layout(self):
+        layout = LAYOUTS[7]
+        file_layout = compile_layout(layout['columns'], 'Development_Assistance_to_Agriculture_E_All_Data_(Normalized).zip', 'Development Flows to Agriculture')
+        self.assertTrue(file_layout.is_bilateral)
+        self.assertEqual(
+            [extract(row_for(layout))[:3] for extract in file_layout.extractors],
+            [
+                ('donor', 'Development Flows to Agriculture: item - purpose - Donors', 'item code - purpose code'),
+                ('recipient country', 'Development Flows to Agriculture: item - purpose - Recipients', 'item code - purpose code')
+            ]
+        )
+        self.assertTrue(file_layout.is_header(list(layout['columns'])))
+
+    def test_file_rules(self):
+        layout = LAYOUTS[3]
+        file_layout = compile_layout(layout['columns'], 'FoodBalanceSheets_E_All_Data_(Normalized).zip', 'Food Balance Sheets')
+        self.assertTrue(file_layout.rules['skip_repeated_rows'])
+        self.assertEqual(file_layout.item_code_and_name(row_for(layout)), ('item code', 'item'))
+
+    def test_legacy_file_names(self):
+        for name in ["FoodBalanceSheets_E_All_Data_(Normalized).csv", "FoodBalanceSheets_E_All_Data_(Normalized).zip"]:
+            self.assertEqual(history_file_name(name), "FoodBalanceSheets_E_All_Data_(Normalized).zip")
+        self.assertEqual(history_file_name("Trade_DetailedTradeMatrix_E_All_Data_(Normalized).csv"),
+                         "Trade_DetailedTradeMatrix_E_All_Data_(Normalized).zip")
+        self.assertEqual(history_file_name("Production_Crops_E_All_Data_(Normalized).csv"),
+                         "Production_Crops_E_All_Data_(Normalized).csv")
+
+if __name__ == '__main__':
+    unittest.main()
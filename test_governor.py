@@ -0,0 +1,121 @@
+import os
+import unittest
+from unittest import mock
+
+import governor
+from governor import Governor, Pacer
+
+# Stands in for time.time and time.sleep: the time only moves when something
+# sleeps, or when a test moves it on
+class FakeClock:
+
+    def __init__(self, now=1000.0):
+        self.now = now
+        self.sleeps = []
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+    def patch(self):
+        return mock.patch.multiple(governor.time, time=self.time, sleep=self.sleep)
+
+class PacerTests(unittest.TestCase):
+
+    def test_unlimited(self):
+        clock = FakeClock()
+        with clock.patch():
+            pacer = Pacer(None)
+            self.assertEqual(pacer.advance(10 ** 9), 0.0)
+        self.assertEqual(clock.sleeps, [])
+
+    def test_sleeps_until_the_count_is_due(self):
+        clock = FakeClock()
+        with clock.patch():
+            pacer = Pacer(10)
+            self.assertAlmostEqual(pacer.advance(1), 0.1)
+            self.assertAlmostEqual(pacer.advance(1), 0.1)
+            self.assertAlmostEqual(pacer.advance(3), 0.3)
+        self.assertAlmostEqual(sum(clock.sleeps), 0.5)
+        self.assertAlmostEqual(clock.now, 1000.5)
+
+    def test_checks_the_clock_every_twentieth_of_a_second(self):
+        clock = FakeClock()
+        with clock.patch():
+            pacer = Pacer(100)
+            pacer.advance(1)
+            # the next check is 5 counts later
+            for _ in range(4):
+                self.assertEqual(pacer.advance(1), 0.0)
+            self.assertEqual(len(clock.sleeps), 1)
+            self.assertAlmostEqual(pacer.advance(1), 0.05)
+        self.assertEqual(len(clock.sleeps), 2)
+
+    def test_does_not_sleep_when_behind(self):
+        clock = FakeClock()
+        with clock.patch():
+            pacer = Pacer(10)
+            pacer.advance(1)
+            clock.now += 60
+            self.assertEqual(pacer.advance(100), 0.0)
+        self.assertEqual(len(clock.sleeps), 1)
+
+class GovernorTests(unittest.TestCase):
+
+    def from_env(self, environ, **kwargs):
+        with mock.patch.dict(os.environ, environ), \
+            mock.patch.object(governor.os, 'nice', return_value=0) as nice, \
+            mock.patch.object(governor.subprocess, 'check_call') as check_call:
+            return Governor.from_env(report_at_exit=False, **kwargs), nice, check_call
+
+    def test_from_env(self):
+        limits, nice, check_call = self.from_env({
+            'IMPORT_MAX_ROWS_PER_SECOND': '2500',
+            'IMPORT_MAX_WRITES_PER_SECOND': '1e4',
+            'IMPORT_NICENESS': '10',
+            'IMPORT_IONICE_CLASS': '3'
+        })
+        self.assertEqual(limits.max_rows_per_second, 2500.0)
+        self.assertEqual(limits.max_writes_per_second, 10000.0)
+        self.assertEqual(limits.niceness, 10)
+        self.assertEqual(limits.ionice_class, 3)
+        self.assertTrue(limits.is_throttled())
+        nice.assert_called_with(10)
+        self.assertEqual(check_call.call_args[0][0][:3], ['ionice', '-c', '3'])
+
+    def test_arguments_take_precedence_over_the_environment(self):
+        limits, _, _ = self.from_env({'IMPORT_MAX_ROWS_PER_SECOND': '2500'}, max_rows_per_second=50)
+        self.assertEqual(limits.max_rows_per_second, 50)
+
+    def test_unset_or_empty_variables_are_unthrottled(self):
+        with mock.patch.dict(os.environ):
+            os.environ.pop('IMPORT_MAX_WRITES_PER_SECOND', None)
+            os.environ.pop('IMPORT_IONICE_CLASS', None)
+            limits, nice, check_call = self.from_env({'IMPORT_MAX_ROWS_PER_SECOND': '', 'IMPORT_NICENESS': ''})
+        self.assertIsNone(limits.max_rows_per_second)
+        self.assertIsNone(limits.niceness)
+        self.assertFalse(limits.is_throttled())
+        nice.assert_not_called()
+        check_call.assert_not_called()
+
+    def test_counts_the_time_throttled(self):
+        clock = FakeClock()
+        with clock.patch():
+            limits = Governor(max_rows_per_second=100, max_writes_per_second=1000, report_at_exit=False)
+            for _ in range(10):
+                limits.tick(10)
+            limits.wrote(500)
+            report = limits.report()
+        self.assertEqual(report['rows'], 100)
+        self.assertEqual(report['writes'], 500)
+        # a second for the rows, and as the writes are paced from the first
+        # write on, half a second for the writes
+        self.assertAlmostEqual(report['seconds_throttled'], 1.5)
+        self.assertAlmostEqual(report['seconds'], 1.5)
+        self.assertAlmostEqual(sum(clock.sleeps), 1.5)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,35 @@
+import os
+import sys
+import unittest
+
+# the importer scripts import their modules from the importer directory
+sys.path.insert(1, os.path.join(os.path.dirname(os.path.realpath(__file__)), 'importer'))
+from utils import PairSet
+
+PAIRS = [
+    ('France', '15 - 5510'),
+    ('Chad', '15 - 5510'),
+    ('France', '56 - 5312'),
+    ('France', '15 - 5510'),
+] + [('Peru', str(code)) for code in range(100)]
+
+class PairSetTests(unittest.TestCase):
+
+    def test_same_as_set(self):
+        pairs = PairSet(PAIRS)
+        self.assertEqual(len(pairs), len(set(PAIRS)))
+        for pair in PAIRS:
+            self.assertIn(pair, pairs)
+        for pair in [('Chad', '56 - 5312'), ('Peru', '100'), ('Mali', '15 - 5510'), ('France', 'Peru')]:
+            self.assertNotIn(pair, pairs)
+
+    def test_first_items_seen_before_later_second_items(self):
+        pairs = PairSet([('Chad', '0')])
+        pairs.update(('France', str(code)) for code in range(50))
+        self.assertNotIn(('Chad', '49'), pairs)
+        pairs.add(('Chad', '49'))
+        self.assertIn(('Chad', '49'), pairs)
+        self.assertEqual(len(pairs), 52)
+
+if __name__ == '__main__':
+    unittest.main()
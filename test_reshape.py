@@ -0,0 +1,69 @@
+import unittest
+
+from reshape import ROWS, COLUMNS, blocks, value_block, present_mask, wide_to_long
+
+YEARS = [1960, 1961, 1962]
+
+# Wide rows like the WDI Data table's: country, indicator, then a column per
+# year, with a short row and a trailing column that is not read
+WIDE_ROWS = [
+    ('ARB', 'SP.POP.TOTL', 92490932, 95044497.5, None, 'x'),
+    ('CIV', 'SP.POP.TOTL', None, '', 0),
+    ('CIV', 'EG.USE.PCAP.KG.OE', 1.5e-07),
+]
+
+# What reading the cells one at a time gives
+def long_rows_one_cell_at_a_time(rows, missing):
+    return [
+        (row[index], year, row[0], row[1])
+        for row in rows
+        for index, year in zip(range(2, 5), YEARS)
+        if index < len(row) and row[index] not in missing
+    ]
+
+class ReshapeTests(unittest.TestCase):
+
+    def long_rows(self, rows, missing):
+        return [
+            long_row
+            for block in blocks(rows, size=2)
+            for long_row in wide_to_long(
+                value_block(block, 2, 5),
+                (COLUMNS, YEARS), (ROWS, [row[0] for row in block]), (ROWS, [row[1] for row in block]),
+                missing=missing
+            )
+        ]
+
+    def test_same_as_one_cell_at_a_time(self):
+        for missing in [(None,), (None, ''), (None, '', 0)]:
+            self.assertEqual(
+                self.long_rows(WIDE_ROWS, missing),
+                long_rows_one_cell_at_a_time(WIDE_ROWS, missing),
+                missing
+            )
+
+    def test_values_keep_their_types(self):
+        values = [value for value, *keys in self.long_rows(WIDE_ROWS, (None, ''))]
+        self.assertEqual([type(value) for value in values], [int, float, int, float])
+
+    def test_zero_matches_zero_float(self):
+        mask = present_mask(value_block([(0.0, 0, '0', None)]), missing=(None, 0))
+        self.assertEqual(mask, [[False, False, True, False]])
+
+    def test_columns(self):
+        block = value_block(WIDE_ROWS, columns=[4, 2])
+        self.assertEqual(block, [(None, 92490932), (0, None), (None, 1.5e-07)])
+        # the keys of the rows can come first
+        self.assertEqual(
+            wide_to_long(block, (ROWS, ['ARB', 'CIV', 'CIV']), (COLUMNS, [1962, 1960]), missing=(None, 0)),
+            [(92490932, 'ARB', 1960), (1.5e-07, 'CIV', 1960)]
+        )
+        with self.assertRaises(ValueError):
+            wide_to_long(block, (ROWS, 'ABC'), (COLUMNS, [1962, 1960]), (ROWS, 'DEF'))
+
+    def test_empty(self):
+        self.assertEqual(list(blocks([])), [])
+        self.assertEqual(wide_to_long(value_block([(None, None)]), (COLUMNS, YEARS[:2])), [])
+
+if __name__ == '__main__':
+    unittest.main()
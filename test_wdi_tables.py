@@ -0,0 +1,99 @@
+import io
+import os
+import sys
+import csv
+import shutil
+import zipfile
+import tempfile
+import unittest
+from openpyxl import Workbook
+
+# the importer scripts import their modules from the importer directory
+sys.path.insert(1, os.path.join(os.path.dirname(os.path.realpath(__file__)), 'importer'))
+from utils import starts_with
+from wdi_tables import SERIES_EXPECTED_HEADERS, DATA_EXPECTED_HEADERS, COUNTRY_EXPECTED_HEADERS, CSV_FILENAMES, \
+    open_excel_tables, open_csv_tables, read_indicators, read_country_name_by_code
+
+# A small WDI release, written both as the workbook and as the CSV bundle
+SERIES_ROWS = [
+    SERIES_EXPECTED_HEADERS,
+    ('SP.POP.TOTL', 'Health: Population: Structure', 'Population, total', 'Total population', 'Total population is based on the de facto definition of population.', None, 'Annual', None, None, 'Sum', 'Estimates are "de facto".\nThey include refugees.', None, None, '(1) United Nations Population Division', None, None, None, None, None, 'CC BY-4.0'),
+    ('EG.USE.PCAP.KG.OE', 'Environment: Energy production & use', 'Energy use (kg of oil equivalent per capita)', None, 'Energy use refers to use of primary energy.', None, 'Annual', None, None, 'Weighted average', None, None, None, 'IEA Statistics © OECD/IEA 2014 (iea.org/stats)', None, None, None, None, None, 'CC BY-4.0'),
+]
+DATA_ROWS = [
+    ('Country Name', 'Country Code', 'Indicator Name', 'Indicator Code', '1960', '1961', '1962'),
+    ('Arab World', 'ARB', 'Population, total', 'SP.POP.TOTL', 92490932, 95044497.5, None),
+    ('Arab World', 'ARB', 'Energy use (kg of oil equivalent per capita)', 'EG.USE.PCAP.KG.OE', None, None, 1.5e-07),
+    ('Côte d\'Ivoire', 'CIV', 'Population, total', 'SP.POP.TOTL', 3474724, None, 3714667),
+]
+COUNTRY_ROWS = [
+    COUNTRY_EXPECTED_HEADERS,
+    ('ARB', 'Arab World', 'Arab World', 'Arab World', '1A') + (None,) * (len(COUNTRY_EXPECTED_HEADERS) - 5),
+    ('CIV', 'Côte d\'Ivoire', 'Côte d\'Ivoire', 'Republic of Côte d\'Ivoire', 'CI', 'West African CFA franc') + (None,) * (len(COUNTRY_EXPECTED_HEADERS) - 6),
+]
+
+def write_workbook(filepath):
+    wb = Workbook()
+    wb.remove(wb.active)
+    for title, rows in (('Data', DATA_ROWS), ('Country', COUNTRY_ROWS), ('Series', SERIES_ROWS)):
+        ws = wb.create_sheet(title)
+        for row in rows:
+            ws.append(row)
+    wb.save(filepath)
+
+# Written like the World Bank writes them: with a byte order mark, every field
+# quoted and a trailing comma on every line
+def write_csv_bundle(filepath):
+    with zipfile.ZipFile(filepath, 'w', zipfile.ZIP_DEFLATED) as z:
+        for table, rows in (('Data', DATA_ROWS), ('Country', COUNTRY_ROWS), ('Series', SERIES_ROWS)):
+            f = io.StringIO(newline='')
+            writer = csv.writer(f, quoting=csv.QUOTE_ALL)
+            for row in rows:
+                writer.writerow([value if value is not None else '' for value in row] + [''])
+            z.writestr(CSV_FILENAMES[table], '\ufeff' + f.getvalue())
+        z.writestr('WDIFootNote.csv', '\ufeff"CountryCode","SeriesCode","Year","DESCRIPTION",\n')
+
+class WdiTablesParityTests(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.excel_filepath = os.path.join(self.directory, 'WDIEXCEL.xlsx')
+        self.csv_filepath = os.path.join(self.directory, 'WDI_csv.zip')
+        write_workbook(self.excel_filepath)
+        write_csv_bundle(self.csv_filepath)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def read(self, tables):
+        series_rows, data_rows, country_rows = tables
+        series_headers, data_headers, country_headers = next(series_rows), next(data_rows), next(country_rows)
+        self.assertTrue(starts_with(series_headers, SERIES_EXPECTED_HEADERS))
+        self.assertTrue(starts_with(data_headers, DATA_EXPECTED_HEADERS))
+        self.assertTrue(starts_with(country_headers, COUNTRY_EXPECTED_HEADERS))
+        return {
+            'headers': (series_headers, data_headers, country_headers),
+            'indicators': read_indicators(series_rows),
+            'country_name_by_code': read_country_name_by_code(country_rows),
+            'data_rows': list(data_rows)
+        }
+
+    def test_csv_bundle_reads_like_workbook(self):
+        excel = self.read(open_excel_tables(self.excel_filepath))
+        csv_tables = self.read(open_csv_tables(self.csv_filepath))
+        for key in excel:
+            self.assertEqual(csv_tables[key], excel[key], key)
+
+    def test_values(self):
+        tables = self.read(open_csv_tables(self.csv_filepath))
+        self.assertEqual(tables['data_rows'], [tuple(row) for row in DATA_ROWS[1:]])
+        self.assertEqual([type(value) for value in tables['data_rows'][0][4:6]], [int, float])
+        self.assertEqual(tables['country_name_by_code']['CIV'], 'Côte d\'Ivoire')
+        self.assertEqual(tables['country_name_by_code']['INX'], 'Not classified')
+        self.assertEqual(
+            [(indicator['code'], indicator['category'], indicator['unit']) for indicator in tables['indicators']],
+            [('SP.POP.TOTL', 'Health', ''), ('EG.USE.PCAP.KG.OE', 'Environment', 'kg of oil equivalent per capita')]
+        )
+
+if __name__ == '__main__':
+    unittest.main()
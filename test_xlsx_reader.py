@@ -0,0 +1,127 @@
+import os
+import shutil
+import zipfile
+import tempfile
+import unittest
+from openpyxl import load_workbook
+
+from xlsx_reader import XlsxReader
+
+# A workbook written by hand rather than by openpyxl, with the parts of the
+# format that openpyxl doesn't write itself: inline strings, cells and rows
+# without an `r` reference, missing rows, booleans, and shared strings with
+# rich text and phonetic runs
+CONTENT_TYPES = '''<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">
+<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>
+<Default Extension="xml" ContentType="application/xml"/>
+<Override PartName="/xl/workbook.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>
+<Override PartName="/xl/worksheets/sheet1.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>
+<Override PartName="/xl/worksheets/sheet2.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>
+<Override PartName="/xl/sharedStrings.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sharedStrings+xml"/>
+</Types>'''
+
+PACKAGE_RELATIONSHIPS = '''<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">
+<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" Target="xl/workbook.xml"/>
+</Relationships>'''
+
+WORKBOOK = '''<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">
+<sheets>
+<sheet name="Data" sheetId="1" r:id="rId1"/>
+<sheet name="Notes" sheetId="2" r:id="rId2"/>
+</sheets>
+</workbook>'''
+
+WORKBOOK_RELATIONSHIPS = '''<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">
+<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" Target="worksheets/sheet1.xml"/>
+<Relationship Id="rId2" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" Target="/xl/worksheets/sheet2.xml"/>
+<Relationship Id="rId3" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/sharedStrings" Target="sharedStrings.xml"/>
+</Relationships>'''
+
+SHARED_STRINGS = '''<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<sst xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" count="4" uniqueCount="4">
+<si><t>Country Name</t></si>
+<si><t>東京</t><rPh sb="0" eb="2"><t>トウキョウ</t></rPh><phoneticPr fontId="1"/></si>
+<si><r><t>Population, </t></r><r><rPr><b/></rPr><t>total</t></r></si>
+<si><t xml:space="preserve"> padded </t></si>
+</sst>'''
+
+DATA_SHEET = '''<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">
+<dimension ref="A1:F6"/>
+<sheetData>
+<row r="1"><c r="A1" t="s"><v>0</v></c><c r="B1" t="inlineStr"><is><t>Indicator</t></is></c><c r="C1"><v>1960</v></c><c r="D1"><v>1961</v></c></row>
+<row r="2"><c r="A2" t="s"><v>1</v></c><c r="B2" t="s"><v>2</v></c><c r="C2"><v>13500000</v></c><c r="D2"><v>1.5E-7</v></c><c r="E2" t="b"><v>1</v></c><c r="F2" t="b"><v>0</v></c></row>
+<row r="4"><c t="inlineStr"><is><r><t>Rich </t></r><r><t>inline</t></r></is></c><c t="s"><v>3</v></c><c><v>-2.25</v></c><c r="F4" t="str"><v>formula text</v></c></row>
+<row><c r="A5" t="e"><v>#N/A</v></c><c r="C5"><v></v></c><c r="D5"><v>7</v></c></row>
+<row r="6"><c r="B6" t="inlineStr"><is><t>東京</t><rPh sb="0" eb="2"><t>トウキョウ</t></rPh></is></c></row>
+</sheetData>
+</worksheet>'''
+
+# Without a dimension, so that the rows are only as long as their cells
+NOTES_SHEET = '''<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">
+<sheetData>
+<row r="2"><c r="B2" t="inlineStr"><is><t>note</t></is></c></row>
+<row r="3"><c r="A3"><v>1</v></c><c r="C3"><v>3</v></c></row>
+</sheetData>
+</worksheet>'''
+
+def write_workbook(filepath):
+    with zipfile.ZipFile(filepath, 'w', zipfile.ZIP_DEFLATED) as z:
+        z.writestr('[Content_Types].xml', CONTENT_TYPES)
+        z.writestr('_rels/.rels', PACKAGE_RELATIONSHIPS)
+        z.writestr('xl/workbook.xml', WORKBOOK)
+        z.writestr('xl/_rels/workbook.xml.rels', WORKBOOK_RELATIONSHIPS)
+        z.writestr('xl/sharedStrings.xml', SHARED_STRINGS)
+        z.writestr('xl/worksheets/sheet1.xml', DATA_SHEET)
+        z.writestr('xl/worksheets/sheet2.xml', NOTES_SHEET)
+
+class XlsxReaderTests(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.filepath = os.path.join(self.directory, 'workbook.xlsx')
+        write_workbook(self.filepath)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def openpyxl_rows(self, sheet_name):
+        wb = load_workbook(self.filepath, read_only=True)
+        try:
+            return [tuple(cell.value for cell in row) for row in wb[sheet_name].rows]
+        finally:
+            wb.close()
+
+    def reader_rows(self, sheet_name):
+        with XlsxReader(self.filepath) as reader:
+            return list(reader[sheet_name].rows)
+
+    def test_reads_like_openpyxl(self):
+        with XlsxReader(self.filepath) as reader:
+            self.assertEqual(reader.sheetnames, ['Data', 'Notes'])
+        for sheet_name in ('Data', 'Notes'):
+            with self.subTest(sheet_name=sheet_name):
+                self.assertEqual(self.reader_rows(sheet_name), self.openpyxl_rows(sheet_name))
+
+    def test_values(self):
+        self.assertEqual(self.reader_rows('Data'), [
+            ('Country Name', 'Indicator', 1960, 1961, None, None),
+            ('東京', 'Population, total', 13500000, 1.5e-07, True, False),
+            (None,) * 6,
+            ('Rich inline', ' padded ', -2.25, None, None, 'formula text'),
+            ('#N/A', None, None, 7, None, None),
+            (None, '東京', None, None, None, None),
+        ])
+
+    def test_unknown_sheet(self):
+        with XlsxReader(self.filepath) as reader:
+            with self.assertRaises(KeyError):
+                reader['Series']
+
+if __name__ == '__main__':
+    unittest.main()
